@@ -4,9 +4,17 @@ tmin = -50;
 tmax = 300;
 lambda = [0.00000001];
 
-eeg = hdf5read('data_p1.h5', 'eeg_TRF');
+% The paths can be set before running the script (see tools/pipeline.py)
+if ~exist('pathData', 'var')
+    pathData = 'data_p1.h5';
+end
+if ~exist('pathReconstructed', 'var')
+    pathReconstructed = 'reconstructed_p1.h5';
+end
+
+eeg = hdf5read(pathData, 'eeg_TRF');
 
-att = hdf5read('data_p1.h5', 'envAttended');
+att = hdf5read(pathData, 'envAttended');
 
 % 80 trials
 for i = 1:80
@@ -19,4 +27,4 @@ end
 
 
 % convert to h5
-hdf5write('reconstructed_p1.h5', 'reconstructed', pred_att);
+hdf5write(pathReconstructed, 'reconstructed', pred_att);
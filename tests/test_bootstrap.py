@@ -0,0 +1,25 @@
+import unittest
+import numpy as np
+from tools.benchmark import generateEEG
+from tools.decodingSSR import getSSRAccuracyByDur
+from tools.bootstrap import bootstrapSSRAccuracyByDur
+
+try:
+    import eeg
+except ImportError:
+    eeg = None
+
+class TestBootstrapSSR(unittest.TestCase):
+    @unittest.skipIf(eeg is None, 'getSSRAccuracyByDur needs the eeg package')
+    def testPointEstimate(self):
+        # The accuracy of the bootstrap must be the one of `getSSRAccuracyByDur`
+        labels = np.arange(30) % 40 >= 20
+        data, labels = generateEEG(30, 59, labels=labels, ssrAmp=0.1, dtype=np.float32,
+                                   seed=0)
+        trials = np.arange(30)
+        results = bootstrapSSRAccuracyByDur(data, [trials], 512., nBoot=10)
+        acc = getSSRAccuracyByDur(data, trials, 512.).mean(axis=1)
+        np.testing.assert_allclose(results.acc.values, acc, atol=1./64 + 1e-12)
+
+if __name__ == '__main__':
+    unittest.main()
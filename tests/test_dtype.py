@@ -0,0 +1,102 @@
+import unittest
+import numpy as np
+from tools.benchmark import generateEnvelopes, generateEEG
+from tools.decodingTRF import (calculateCorr, getTRFAccuracyByDur, calculateLaggedCorr,
+                               calculateLaggedCorrByDur)
+from tools.decodingSSR import (getTagCoefsByDur, getTagEnergies, calculateTagBaseline,
+                               classifyTags, getSSRAccuracyByDur)
+
+try:
+    import eeg
+except ImportError:
+    eeg = None
+
+class TestFloat32Decoding(unittest.TestCase):
+    """
+    The decoding accuracies computed in float32 must match the float64 ones
+    (see the `dtype` arguments of the processing).
+    """
+    trialNum = 40
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        envelopes = generateEnvelopes(3*self.trialNum, 60, seed=0)
+        self.envAttended = envelopes[:self.trialNum]
+        self.envReconstructed = self.envAttended + 2*rng.randn(*self.envAttended.shape)
+        self.trialsDualStream = np.arange(self.trialNum//2, self.trialNum)
+        self.envUnattended = envelopes[self.trialNum:self.trialNum + len(self.trialsDualStream)]
+        self.envMismatch = envelopes[2*self.trialNum:]
+
+    def assertAccuracyEqual(self, acc32, acc64):
+        # At most one trial can flip (correlations closer than the float32
+        # precision)
+        np.testing.assert_allclose(acc32, acc64, rtol=0, atol=1./self.trialNum + 1e-12)
+
+    def testCalculateCorr(self):
+        for end in [1, 10, None]:
+            corrs64 = calculateCorr(self.envAttended, self.envReconstructed, 64., end=end)
+            corrs32 = calculateCorr(self.envAttended.astype(np.float32),
+                                    self.envReconstructed.astype(np.float32), 64., end=end,
+                                    dtype=np.float32)
+            self.assertEqual(corrs32.dtype, np.float32)
+            np.testing.assert_allclose(corrs32, corrs64, rtol=1e-4, atol=1e-5)
+
+    def testCalculateLaggedCorrByDur(self):
+        durs = [1, 10, 60]
+        env1 = self.envAttended.astype(np.float32)
+        env2 = self.envReconstructed.astype(np.float32)
+        peak64, lag64, corrs64 = calculateLaggedCorrByDur(self.envAttended,
+                                                          self.envReconstructed, 64., 0.1,
+                                                          durs)
+        peak32, lag32, corrs32 = calculateLaggedCorrByDur(env1, env2, 64., 0.1, durs,
+                                                          dtype=np.float32)
+        self.assertEqual(corrs32.dtype, np.float32)
+        self.assertEqual(peak32.dtype, np.float32)
+        np.testing.assert_allclose(peak32, peak64, rtol=1e-4, atol=1e-4)
+        # Same correlations as the FFT version for the whole trials
+        peakFFT = calculateLaggedCorr(env1, env2, 64., 0.1, dtype=np.float32)[0]
+        self.assertEqual(peakFFT.dtype, np.float32)
+        np.testing.assert_allclose(peak32[-1], peakFFT, rtol=1e-4, atol=1e-4)
+
+    def testGetTRFAccuracyByDur(self):
+        args = (self.envAttended, self.envUnattended, self.envMismatch, self.envReconstructed,
+                np.arange(self.trialNum), self.trialsDualStream)
+        for maxLag in [None, 0.1]:
+            acc64 = getTRFAccuracyByDur(*args, maxLag=maxLag)
+            acc32 = getTRFAccuracyByDur(*[np.asarray(arg, dtype=np.float32)
+                                          if i < 4 else arg for i, arg in enumerate(args)],
+                                        dtype=np.float32, maxLag=maxLag)
+            for classif32, classif64 in zip(acc32, acc64):
+                self.assertAccuracyEqual(classif32, classif64)
+
+    def testGetTagCoefsByDur(self):
+        durs = [1, 5, 10]
+        tagFreqs = [36, 44]
+        data64, labels = generateEEG(self.trialNum, 10, electrodes=16, ssrAmp=0.1, seed=0)
+        data32 = data64.astype(np.float32)
+        labels = np.asarray(tagFreqs, dtype=float)[labels]
+        coefs64 = getTagCoefsByDur(data64, tagFreqs, 512., durs)
+        coefs32 = getTagCoefsByDur(data32, tagFreqs, 512., durs)
+        np.testing.assert_allclose(coefs32, coefs64, rtol=1e-4,
+                                   atol=1e-4*np.abs(coefs64).max())
+        accs = []
+        for data in [data64, data32]:
+            energies = getTagEnergies(data, tagFreqs, 512., durs)
+            baseline = calculateTagBaseline(data, labels, tagFreqs, 512., durs)
+            accs.append(classifyTags(energies, labels, tagFreqs, baseline=baseline))
+        self.assertAccuracyEqual(accs[1], accs[0])
+
+    @unittest.skipIf(eeg is None, 'getSSRAccuracyByDur needs the eeg package')
+    def testGetSSRAccuracyByDur(self):
+        labels = np.arange(30) % 40 >= 20
+        data64, labels = generateEEG(30, 59, labels=labels, ssrAmp=0.1, seed=0)
+        acc64 = getSSRAccuracyByDur(data64, np.arange(30), 512.)
+        del data64
+        data32, labels = generateEEG(30, 59, labels=labels, ssrAmp=0.1, dtype=np.float32,
+                                     seed=0)
+        acc32 = getSSRAccuracyByDur(data32, np.arange(30), 512.)
+        # Proportion of electrodes above the baseline for each duration
+        np.testing.assert_allclose(acc32.mean(axis=1), acc64.mean(axis=1), atol=1./64 + 1e-12)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+import unittest
+from tools.benchmark import benchmarkImports
+
+# Modules that must stay importable without their optional dependencies
+# (see `lazy.py`)
+numericalModules = ['decodingTRF', 'decodingSSR', 'lagMatrix', 'encodingTRF', 'eeg_utils',
+                    'behavior', 'audio', 'bdf', 'streamingTRF', 'streamingSSR',
+                    'spatialFilter', 'spectrogramSSR', 'electrodeSelection',
+                    'learningCurve', 'bootstrap', 'permutation', 'parallel']
+optionalModules = ['sklearn', 'h5py', 'couchdb', 'IPython', 'matplotlib', 'eeg']
+
+class TestLazyImports(unittest.TestCase):
+    """
+    Importing the numerical modules in a new process must not import the
+    optional dependencies (they are imported on first use).
+    """
+    def testNoOptionalModules(self):
+        results = benchmarkImports(numericalModules, repeat=1)
+        for module, loaded in zip(results.module, results.heavyModules):
+            loaded = [name for name in loaded.split(', ') if name in optionalModules]
+            self.assertEqual(loaded, [], '%s imports %s' % (module, ', '.join(loaded)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""
+Command-line entry point running the pipeline (see `pipeline.buildTasks`)
+without the notebooks:
+
+    python -m tools run config.json --jobs 4
+    python -m tools status config.json
+"""
+import sys
+import argparse
+import pandas as pd
+from pipeline import stages, buildTasks, loadConfig, runPipeline, getStageSummary, isUpToDate
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tools',
+                                     description='Run the processing pipeline of the cohort.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    parserRun = subparsers.add_parser('run', help='Run the stages that are not up to date.')
+    parserStatus = subparsers.add_parser('status', help='Show the stages that are up to date.')
+    for sub in [parserRun, parserStatus]:
+        sub.add_argument('config', help='JSON configuration (see pipeline.buildTasks).')
+        sub.add_argument('--stages', nargs='+', choices=stages, default=None,
+                         help='Stages to consider (default to all).')
+        sub.add_argument('--participants', nargs='+', default=None,
+                         help='Participants to consider (default to all).')
+    parserRun.add_argument('--jobs', type=int, default=1,
+                           help='Number of tasks running at the same time.')
+    parserRun.add_argument('--force', action='store_true',
+                           help='Run the stages even if they are up to date.')
+    parserRun.add_argument('--dry-run', action='store_true',
+                           help='Only print the stages that would run.')
+    parserRun.add_argument('--summary', default=None,
+                           help='Path of a CSV file to save the status of each task.')
+    args = parser.parse_args(argv)
+
+    tasks = buildTasks(loadConfig(args.config), stageNames=args.stages,
+                       participants=args.participants)
+
+    if args.command == 'status':
+        status = pd.DataFrame([{'task': task.name, 'stage': task.stage,
+                                'participant': task.participant,
+                                'upToDate': isUpToDate(task)} for task in tasks],
+                              columns=['task', 'stage', 'participant', 'upToDate'])
+        print status.pivot(index='participant', columns='stage',
+                           values='upToDate').reindex(columns=status.stage.unique())
+        return 0
+
+    summary = runPipeline(tasks, nJobs=args.jobs, force=args.force, dryRun=args.dry_run)
+    print
+    print getStageSummary(summary)
+    if args.summary is not None:
+        summary.to_csv(args.summary, index=False)
+    return int(summary.status.isin(['failed', 'blocked']).any())
+
+if __name__ == '__main__':
+    sys.exit(main())
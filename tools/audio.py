@@ -1,11 +1,15 @@
 import numpy as np
-from scipy.io import wavfile
 from scipy import signal, fftpack
-import urllib2, base64
+import base64
 from subprocess import Popen, PIPE
-import soundfile as sf
-import couchdb
-from IPython.display import display, clear_output
+from snapshot import getServer, isRemote
+from profiling import stage
+from lazy import lazyImport, lazyFunction
+
+# Only needed to fetch and convert the audio files: imported on first use
+wavfile = lazyImport('scipy.io.wavfile')
+urllib2 = lazyImport('urllib2')
+display = lazyFunction('IPython.display', 'display')
 
 def audioToNP(audioWebm, stream, verbose=False):
     """
@@ -55,7 +59,7 @@ def audioToNP(audioWebm, stream, verbose=False):
 
     return audioList, trialLen
 
-def butterLpass(data, cutoff, fs, order=5):
+def butterLpass(data, cutoff, fs, order=5, dtype=np.float64):
     """
     Filter data with a low pass butterworth filter.
 
@@ -69,6 +73,8 @@ def butterLpass(data, cutoff, fs, order=5):
         The sampling frequency of the signal.
     order : int
         Order of the filter.
+    dtype : numpy.dtype
+        Floating point type of the filtered signal.
 
     Returns:
 
@@ -79,10 +85,10 @@ def butterLpass(data, cutoff, fs, order=5):
     normal_cutoff = cutoff / nyq
     b, a = signal.butter(order, normal_cutoff, btype='low', analog=False)
     # using filtfilt instead of lfilt to avoid the offset of the window size
-    y = signal.filtfilt(b, a, data)
+    y = signal.filtfilt(b, a, data).astype(dtype, copy=False)
     return(y)
 
-def downsampleTo64(data):
+def downsampleTo64(data, dtype=np.float64):
     """
     Decimate data with a factor 750 to go from 48000 to 64 Hz.
 
@@ -90,6 +96,8 @@ def downsampleTo64(data):
     ----------
     data : instance of numpy.array
         Matrix to downsample.
+    dtype : numpy.dtype
+        Floating point type of the downsampled matrix.
 
     Returns:
 
@@ -101,9 +109,10 @@ def downsampleTo64(data):
     # advice to use a factor bellow 13
     decimate_intermediate = [10, 5, 5, 3]
     newdata = data
-    for i in decimate_intermediate:
-        newdata = signal.decimate(newdata, q=i, axis=1, zero_phase=True)
-    return newdata
+    with stage('decimate', nbytes=data.nbytes):
+        for i in decimate_intermediate:
+            newdata = signal.decimate(newdata, q=i, axis=1, zero_phase=True)
+    return newdata.astype(dtype, copy=False)
 
 def fromWebmToWav(inputFile, filename, verbose=False):
     """
@@ -155,7 +164,7 @@ def getAudio(dbAddress, dbName, password, sessionNum, verbose=False):
     Parameters
     ----------
     dbAddress : str
-        Path to the couch database.
+        Path to the couch database or to the snapshots (see `getServer`).
     dbName : str
         Name of the database on the couch instance.
     password : str
@@ -169,12 +178,19 @@ def getAudio(dbAddress, dbName, password, sessionNum, verbose=False):
         List of all audio files corresponding to the session, db etc.
     """
     allAudioFileNames = getAudioFilenames(dbAddress, dbName, password, sessionNum)
+    if not isRemote(dbAddress):
+        db = getServer(dbAddress)[dbName]
     allAudioFiles = []
     for trial in allAudioFileNames:
         allAudioFiles.append({})
         audioFileNames = allAudioFileNames[trial]
         audioFilesTrial = []
         for audioFileName in audioFileNames:
+            if not isRemote(dbAddress):
+                docId = 'maskingEEG_%d_%d' % (sessionNum, trial)
+                allAudioFiles[trial][audioFileName] = db.get_attachment(docId,
+                                                                        audioFileName).read()
+                continue
             url = "%s%s/maskingEEG_%d_%d/%s" % (dbAddress, dbName, sessionNum, trial, audioFileName)
             if verbose:
                 print url
@@ -199,7 +215,7 @@ def getAudioFilenames(dbAddress, dbName, password, sessionNum):
     Parameters
     ----------
     dbAddress : str
-        Path to the couch database.
+        Path to the couch database or to the snapshots (see `getServer`).
     dbName : str
         Name of the database on the couch instance.
     password : str
@@ -214,8 +230,7 @@ def getAudioFilenames(dbAddress, dbName, password, sessionNum):
         names as values.
     """
 
-    couch = couchdb.Server(dbAddress)
-    couch.resource.credentials = (dbName, password)
+    couch = getServer(dbAddress, credentials=(dbName, password))
     db = couch[dbName]
 
     count = 0
@@ -232,7 +247,7 @@ def getWebm(dbAddress, dbName, password, sessionNums):
     Parameters
     ----------
     dbAddress : str
-        Path to the couch database.
+        Path to the couch database or to the snapshots (see `getServer`).
     dbName : str
         Name of the database on the couch instance.
     password : str
@@ -252,7 +267,7 @@ def getWebm(dbAddress, dbName, password, sessionNums):
     allAudioFiles = [item for sublist in allAudioFiles for item in sublist]
     return allAudioFiles
 
-def getConcatAudio(audioList, trialLen, verbose=False):
+def getConcatAudio(audioList, trialLen, verbose=False, dtype=np.float64):
     """
     Get all audio files under the form of one concatenated matrix containing the
     raw audio and another one containing the envelopes.
@@ -265,6 +280,8 @@ def getConcatAudio(audioList, trialLen, verbose=False):
         The number of samples in each trial.
     verbose : bool
         If True, more information are displayed.
+    dtype : numpy.dtype
+        Floating point type of the returned matrices.
 
     Returns:
 
@@ -277,14 +294,15 @@ def getConcatAudio(audioList, trialLen, verbose=False):
     trialLenFastHilbert = fftpack.next_fast_len(trialLen)
     trialNum = len(audioList)
 
-    audioAllEnv = np.zeros((trialNum*trialLen))
-    audioAll = np.zeros((trialNum*trialLen))
+    audioAllEnv = np.zeros((trialNum*trialLen), dtype=dtype)
+    audioAll = np.zeros((trialNum*trialLen), dtype=dtype)
 
     for i in range(len(audioList)):
         audio = audioList[i]
         audioAll[trialLen*i:trialLen*(i+1)] = audio[:trialLen]
 
-        env = np.abs(signal.hilbert(audio, N=trialLenFastHilbert))
+        with stage('envelope', nbytes=audio.nbytes):
+            env = np.abs(signal.hilbert(audio, N=trialLenFastHilbert))
 
         if verbose:
             # clear_output(wait=True)
@@ -295,14 +313,15 @@ def getConcatAudio(audioList, trialLen, verbose=False):
 
     return(audioAll, audioAllEnv)
 
-def getEnv(dbAddress, dbName, password, verbose, sessionNums, fs, stream):
+def getEnv(dbAddress, dbName, password, verbose, sessionNums, fs, stream,
+           dtype=np.float64):
     """
     Get the requested envelope corresponding to the user, sessionNum, stream etc.
 
     Parameters
     ----------
     dbAddress : str
-        Path to the couch database.
+        Path to the couch database or to the snapshots (see `getServer`).
     dbName : str
         Name of the database on the couch instance.
     password : str
@@ -315,6 +334,8 @@ def getEnv(dbAddress, dbName, password, verbose, sessionNums, fs, stream):
         Sampling frequency
     stream : str
         Stream to keep ('36' or '44').
+    dtype : numpy.dtype
+        Floating point type of the envelopes.
 
     Returns:
 
@@ -323,15 +344,17 @@ def getEnv(dbAddress, dbName, password, verbose, sessionNums, fs, stream):
     """
     audioWebm = getWebm(dbAddress, dbName, password, sessionNums)
     audioList, trialLen = audioToNP(audioWebm, stream, verbose)
-    audioAll, audioAllEnv = getConcatAudio(audioList, trialLen, verbose)
+    audioAll, audioAllEnv = getConcatAudio(audioList, trialLen, verbose, dtype=dtype)
     # Filtering
-    audioAllEnvFilt = butterLpass(audioAllEnv, cutoff=15, fs=fs, order=5)
+    audioAllEnvFilt = butterLpass(audioAllEnv, cutoff=15, fs=fs, order=5, dtype=dtype)
     totalTrialNum = len(audioList)
     # converting to 2D matrix
-    audioAllEnvFilt2D = splitEnvInTrials(audioAllEnvFilt, totalTrialNum, trialLen)
+    audioAllEnvFilt2D = splitEnvInTrials(audioAllEnvFilt, totalTrialNum, trialLen,
+        dtype=dtype)
     return audioAllEnvFilt2D
 
-def getAttendedAndUnattendedEnv(dbAddress, dbName, password, verbose, fs=48000.):
+def getAttendedAndUnattendedEnv(dbAddress, dbName, password, verbose, fs=48000.,
+                                dtype=np.float64):
     """
     Get all envelopes required for the analyses. The function will return
     3D matrices containing attended and unattended envelopes.
@@ -339,7 +362,7 @@ def getAttendedAndUnattendedEnv(dbAddress, dbName, password, verbose, fs=48000.)
     Parameters
     ----------
     dbAddress : str
-        Path to the couch database.
+        Path to the couch database or to the snapshots (see `getServer`).
     dbName : str
         Name of the database on the couch instance.
     password : str
@@ -352,6 +375,8 @@ def getAttendedAndUnattendedEnv(dbAddress, dbName, password, verbose, fs=48000.)
         Stream to keep ('36' or '44').
     fs : float
         Sampling frequency
+    dtype : numpy.dtype
+        Floating point type of the envelopes.
 
     Returns:
 
@@ -366,36 +391,36 @@ def getAttendedAndUnattendedEnv(dbAddress, dbName, password, verbose, fs=48000.)
     if verbose:
         print('noTC36...')
     noTC36 = getEnv(dbAddress, dbName, password, verbose, sessionNums=[1],
-        fs=fs, stream='36')
+        fs=fs, stream='36', dtype=dtype)
     if verbose:
         print('noTC44...')
     noTC44 = getEnv(dbAddress, dbName, password, verbose, sessionNums=[3],
-        fs=fs, stream='44')
+        fs=fs, stream='44', dtype=dtype)
     if verbose:
         print('TC36...')
     TC36 = getEnv(dbAddress, dbName, password, verbose, sessionNums=[2],
-        fs=fs, stream='36')
+        fs=fs, stream='36', dtype=dtype)
     if verbose:
         print('TC44...')
     TC44 = getEnv(dbAddress, dbName, password, verbose, sessionNums=[4],
-        fs=fs, stream='44')
+        fs=fs, stream='44', dtype=dtype)
 
     if verbose:
         print('stim36Att36...')
     stim36Att36 = getEnv(dbAddress, dbName, password, verbose, sessionNums=[5, 6],
-        fs=fs, stream='36')
+        fs=fs, stream='36', dtype=dtype)
     if verbose:
         print('stim44Att36...')
     stim44Att36 = getEnv(dbAddress, dbName, password, verbose, sessionNums=[5, 6],
-        fs=fs, stream='44')
+        fs=fs, stream='44', dtype=dtype)
     if verbose:
         print('stim36Att44...')
     stim36Att44 = getEnv(dbAddress, dbName, password, verbose, sessionNums=[7, 8],
-        fs=fs, stream='36')
+        fs=fs, stream='36', dtype=dtype)
     if verbose:
         print('stim44Att44...')
     stim44Att44 = getEnv(dbAddress, dbName, password, verbose, sessionNums=[7, 8],
-        fs=fs, stream='44')
+        fs=fs, stream='44', dtype=dtype)
 
     # Remove the first two seconds to avoid bias since in some trials one
     # stream starts 2 seconds before the other
@@ -413,12 +438,12 @@ def getAttendedAndUnattendedEnv(dbAddress, dbName, password, verbose, fs=48000.)
         stim36Att44[:, start:end]], axis=0)
 
     # downsampling
-    attendedDS = downsampleTo64(attended)
-    unattendedDS = downsampleTo64(unattended)
+    attendedDS = downsampleTo64(attended, dtype=dtype)
+    unattendedDS = downsampleTo64(unattended, dtype=dtype)
     print('Done!')
     return attendedDS, unattendedDS
 
-def splitEnvInTrials(data, totalTrialNum, trialLen, verbose=False):
+def splitEnvInTrials(data, totalTrialNum, trialLen, verbose=False, dtype=np.float64):
     """
     Convert the concatenated array of sound to a 2D matrix of shape (trial, time).
 
@@ -431,6 +456,8 @@ def splitEnvInTrials(data, totalTrialNum, trialLen, verbose=False):
         The number of trials contained in the matrix data.
     trialLen : int
         The number of sample of one trial (we expect same length trials).
+    dtype : numpy.dtype
+        Floating point type of the returned matrix.
 
     Returns:
 
@@ -438,7 +465,7 @@ def splitEnvInTrials(data, totalTrialNum, trialLen, verbose=False):
         Matrix of shape (trial, time).
     """
 
-    newData = np.zeros((totalTrialNum, trialLen))
+    newData = np.zeros((totalTrialNum, trialLen), dtype=dtype)
     for trial in range(totalTrialNum):
         if verbose:
             print trial
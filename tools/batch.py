@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import hashlib
+import traceback
+import multiprocessing
+import numpy as np
+import pandas as pd
+import h5py
+from eeg_utils import processEEG
+from behavior import getBehaviorData
+from cache import getCodeVersion
+import profiling
+from profiling import stage
+
+def getProcessingParams(entry, fs, ref, dtype):
+    """
+    Get the parameters used to process the EEG of one participant. They are
+    stored with the processed data to know if it has to be computed again.
+    Like `cachedProcessEEG`, they include the trial numbers of the behavior
+    data of the entry (the epochs kept) and the version of the processing
+    code. When the entry has no behavior data, it is fetched from the
+    database at each processing and considered unchanged.
+
+    Parameters
+    ----------
+    entry : dict
+        Entry of the manifest (see `runBatchProcessing`).
+    fs : float
+        Sampling frequency in Hz.
+    ref : str
+        Choose between referencing to mastoids ('mastoids') or to the average
+        of all electrodes ('average').
+    dtype : numpy.dtype
+        Floating point type used to process the data.
+
+    Returns
+    -------
+    params : str
+        JSON string of the parameters.
+    """
+    params = {
+        'fnEEG': os.path.abspath(entry['fnEEG']),
+        'dbName': entry['dbName'],
+        'sessionNums': [int(i) for i in entry['sessionNums']],
+        'trialsToRemove': [int(i) for i in entry['trialsToRemove']],
+        'fs': float(fs),
+        'ref': ref,
+        'dtype': np.dtype(dtype).name,
+        'code': getCodeVersion(['eeg_utils', 'bdf', 'eeg']),
+    }
+    trialBehavior = entry.get('trialBehavior')
+    if trialBehavior is not None:
+        trialNums = [int(i) for i in trialBehavior.trialNum.values]
+        params['trialNums'] = hashlib.sha1(json.dumps(trialNums)).hexdigest()
+    return json.dumps(params, sort_keys=True)
+
+def isProcessed(pathOut, params):
+    """
+    Check if the processed EEG of a participant already exists with the same
+    parameters.
+
+    Parameters
+    ----------
+    pathOut : str
+        Path to the `.h5` file of the participant.
+    params : str
+        JSON string returned by `getProcessingParams`.
+
+    Returns
+    -------
+    processed : bool
+        True if the file contains the EEG processed with `params`.
+    """
+    if not os.path.exists(pathOut):
+        return False
+    try:
+        with h5py.File(pathOut, 'r') as hf:
+            return ('eeg_TRF' in hf and 'eeg_aSSR' in hf and
+                    hf.attrs.get('processingParams') == params)
+    except (IOError, OSError):
+        return False
+
+def setMemoryLimit(maxMemory):
+    """
+    Limit the address space of the current process. Used as initializer of
+    the workers of `runBatchProcessing`.
+
+    Parameters
+    ----------
+    maxMemory : int
+        Maximum memory in bytes. No limit if None.
+    """
+    if maxMemory is None:
+        return
+    import resource
+    resource.setrlimit(resource.RLIMIT_AS, (int(maxMemory), int(maxMemory)))
+
+def processParticipant(args):
+    """
+    Process the EEG of one participant and store it in its `.h5` file. The
+    EEG is stored under the datasets `eeg_TRF` and `eeg_aSSR` next to the
+    other datasets of the file (like the envelopes).
+
+    Parameters
+    ----------
+    args : tuple
+        (entry, pathOut, params, fs, ref, dtype). See `runBatchProcessing`.
+
+    Returns
+    -------
+    result : dict
+        Summary of the processing of this participant.
+    """
+    entry, pathOut, params, fs, ref, dtype = args
+    t0 = time.time()
+    # Records inherited from the parent process
+    del profiling.records[:]
+    try:
+        trialBehavior = entry.get('trialBehavior')
+        if trialBehavior is None:
+            with stage('behavior'):
+                trialBehavior = getBehaviorData(entry['dbName'], entry['sessionNums'])
+        dataFilt3DTRF64, dataFilt3DSSR = processEEG(entry['fnEEG'], entry['dbName'],
+                                                    entry['sessionNums'],
+                                                    entry['trialsToRemove'],
+                                                    trialBehavior, fs, ref,
+                                                    dtype=dtype)
+        with stage('save'), h5py.File(pathOut, 'a') as hf:
+            # The parameters are written last: a file interrupted while
+            # writing will be processed again
+            if 'processingParams' in hf.attrs:
+                del hf.attrs['processingParams']
+            for name, arr in [('eeg_TRF', dataFilt3DTRF64),
+                              ('eeg_aSSR', dataFilt3DSSR)]:
+                if name in hf:
+                    del hf[name]
+                hf.create_dataset(name, data=arr)
+            hf.attrs['processingParams'] = params
+        status, error = 'done', None
+    except Exception:
+        status, error = 'failed', traceback.format_exc()
+    if profiling.enabled:
+        profiling.saveReport(os.path.splitext(pathOut)[0] + '_profile.json',
+                             info={'dbName': entry['dbName'], 'status': status})
+    return {'dbName': entry['dbName'], 'path': pathOut, 'status': status,
+            'duration': time.time() - t0, 'error': error}
+
+def runBatchProcessing(manifest, pathOut, fs, ref, dtype=np.float64, nJobs=None,
+                       maxMemory=None, overwrite=False, verbose=True):
+    """
+    Process the EEG of multiple participants in parallel. Each participant
+    is processed with `processEEG` in its own process and its result is
+    written in its `.h5` file as soon as it is finished. Participants whose
+    file already contains data processed with the same parameters are
+    skipped so an interrupted batch can be run again.
+
+    Parameters
+    ----------
+    manifest : array-like
+        List of dict containing the keys `fnEEG` (path to the .bdf file),
+        `dbName`, `sessionNums`, `trialsToRemove` and optionally
+        `trialBehavior` (behavior data of the participant). If
+        `trialBehavior` is missing, it is fetched with `getBehaviorData`.
+    pathOut : str
+        Path of the `.h5` files with a `%s` replaced by the name of the
+        database of each participant, for instance 'data_preproc/data_%s.h5'.
+    fs : float
+        Sampling frequency in Hz.
+    ref : str
+        Choose between referencing to mastoids ('mastoids') or to the average
+        of all electrodes ('average').
+    dtype : numpy.dtype
+        Floating point type used to process and store the data.
+    nJobs : int
+        Number of participants processed at the same time. Default to the
+        number of CPUs.
+    maxMemory : int
+        Maximum memory in bytes for each worker. A worker going above this
+        limit fails with a MemoryError instead of making the machine swap.
+    overwrite : bool
+        If True, participants already processed are processed again.
+    verbose : bool
+        If True, more information are displayed.
+
+    Returns
+    -------
+    summary : instance of pandas.core.DataFrame
+        Dataframe containing the status ('done', 'skipped' or 'failed'), the
+        duration and the error (if any) for each participant.
+    """
+    if ref != 'average' and ref != 'mastoids':
+        raise ValueError('Bad `ref` argument!')
+
+    results = []
+    todo = []
+    for entry in manifest:
+        path = pathOut % entry['dbName']
+        params = getProcessingParams(entry, fs, ref, dtype)
+        if not overwrite and isProcessed(path, params):
+            if verbose:
+                print('%s already processed: skipping' % entry['dbName'])
+            results.append({'dbName': entry['dbName'], 'path': path,
+                            'status': 'skipped', 'duration': 0., 'error': None})
+        else:
+            todo.append((entry, path, params, fs, ref, dtype))
+
+    if todo:
+        if nJobs is None:
+            nJobs = multiprocessing.cpu_count()
+        # One participant per worker so that memory is released between them
+        pool = multiprocessing.Pool(processes=min(nJobs, len(todo)),
+                                    initializer=setMemoryLimit,
+                                    initargs=(maxMemory,),
+                                    maxtasksperchild=1)
+        try:
+            for result in pool.imap_unordered(processParticipant, todo):
+                if verbose:
+                    print('%s %s in %.1f s' % (result['dbName'], result['status'],
+                                               result['duration']))
+                    if result['error'] is not None:
+                        print(result['error'])
+                results.append(result)
+        finally:
+            pool.close()
+            pool.join()
+
+    summary = pd.DataFrame(results, columns=['dbName', 'path', 'status',
+                                             'duration', 'error'])
+    return summary
@@ -0,0 +1,163 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Byte size of the fields of the header of each signal (in the order of the
+# header)
+signalFields = [('label', 16), ('transducer', 80), ('physDim', 8), ('physMin', 8),
+                ('physMax', 8), ('digMin', 8), ('digMax', 8), ('prefiltering', 80),
+                ('sampleNum', 8), ('reserved', 32)]
+
+def readHeader(fn):
+    """
+    Read the header of a .bdf file (BioSemi 24-bit EDF). Only the header is
+    read, not the data.
+
+    Parameters
+    ----------
+    fn : str
+        Name of the bdf file.
+
+    Returns
+    -------
+    header : dict
+        Header containing the size of the header in bytes (`headerBytes`),
+        the number of data records (`recordNum`), the duration of a record in
+        seconds (`recordDur`), the labels of the channels (`labels`), the
+        number of samples of each channel in a record (`sampleNums`) and the
+        size of a record in bytes (`recordBytes`).
+    """
+    with open(fn, 'rb') as f:
+        main = f.read(256)
+        if len(main) < 256:
+            raise ValueError('%s is not a bdf file' % fn)
+        channelNum = int(main[252:256])
+        fields = f.read(256*channelNum)
+    headerBytes = int(main[184:192])
+    recordDur = float(main[244:252])
+
+    header = {}
+    start = 0
+    for name, size in signalFields:
+        values = fields[start:start + size*channelNum]
+        header[name] = [values[i*size:(i + 1)*size].strip() for i in range(channelNum)]
+        start += size*channelNum
+    sampleNums = np.array([int(value) for value in header['sampleNum']])
+    recordBytes = 3*sampleNums.sum()
+
+    recordNum = int(main[236:244])
+    if recordNum < 0:
+        # Unknown number of records (recording not closed properly)
+        recordNum = (os.path.getsize(fn) - headerBytes) // recordBytes
+    return {'headerBytes': headerBytes, 'recordNum': recordNum, 'recordDur': recordDur,
+            'labels': header['label'], 'sampleNums': sampleNums,
+            'recordBytes': recordBytes}
+
+def readStatus(fn, channel='Status', mask=0xFFFF, header=None):
+    """
+    Read the status channel of a .bdf file without reading the other
+    channels. The file is memory-mapped and only the bytes of the status
+    channel in each record are read (3 bytes per sample).
+
+    Parameters
+    ----------
+    fn : str
+        Name of the bdf file.
+    channel : str
+        Label of the status channel.
+    mask : int
+        Mask applied to the 24-bit values (the trigger codes are the 16 lower
+        bits, the upper byte contains the status of the system).
+    header : dict
+        Header of the file (see `readHeader`). Read from the file if None.
+
+    Returns
+    -------
+    status : instance of numpy.array
+        Status code of each sample (at the sampling frequency of the status
+        channel).
+    fs : float
+        Sampling frequency of the status channel in Hz.
+    """
+    if header is None:
+        header = readHeader(fn)
+    if channel not in header['labels']:
+        raise ValueError('No channel %s in %s' % (channel, fn))
+    index = header['labels'].index(channel)
+    sampleNum = header['sampleNums'][index]
+    start = 3*header['sampleNums'][:index].sum()
+    records = np.memmap(fn, dtype=np.uint8, mode='r', offset=header['headerBytes'],
+                        shape=(header['recordNum'], header['recordBytes']))
+    # Bytes of the status channel: (record, sample, byte) in little-endian
+    raw = records[:, start:start + 3*sampleNum].reshape(-1, 3).astype(np.int32)
+    status = (raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)) & mask
+    return status, sampleNum / header['recordDur']
+
+def findEvents(status):
+    """
+    Find the changes of the status code.
+
+    Parameters
+    ----------
+    status : instance of numpy.array
+        Status code of each sample (see `readStatus`).
+
+    Returns
+    -------
+    events : instance of numpy.array
+        Events of shape (event, 3) with the sample where the code changes,
+        the previous code and the new code (the layout of the MNE events
+        used by `checkLinkTrialsBehaviorEEG`).
+    """
+    samples = np.nonzero(np.diff(status))[0] + 1
+    return np.column_stack([samples, status[samples - 1], status[samples]]).astype(np.int64)
+
+def readEvents(fn, channel='Status', mask=0xFFFF):
+    """
+    Get the events of a .bdf file from its status channel (see `readStatus`
+    and `findEvents`). This reads 3 bytes per sample of the status channel
+    only: the triggers are available before loading the EEG.
+
+    Parameters
+    ----------
+    fn : str
+        Name of the bdf file.
+    channel : str
+        Label of the status channel.
+    mask : int
+        Mask applied to the 24-bit values.
+
+    Returns
+    -------
+    events : instance of numpy.array
+        Events of shape (event, 3) with the sample, the previous code and the
+        code (for instance 65282 for the beginning of the trials and 65312
+        for the responses).
+    fs : float
+        Sampling frequency of the status channel in Hz.
+    """
+    status, fs = readStatus(fn, channel=channel, mask=mask)
+    return findEvents(status), fs
+
+def getTriggers(events, eventCode):
+    """
+    Get the triggers with a given code (the samples where the status code
+    becomes `eventCode`).
+
+    Parameters
+    ----------
+    events : instance of numpy.array
+        Events of shape (event, 3) (see `readEvents`).
+    eventCode : int
+        Code of the triggers (for instance 65282 for the beginning of the
+        trials).
+
+    Returns
+    -------
+    trigs : instance of pandas.core.DataFrame
+        Triggers with the sample in the first column (like the triggers used by
+        `processEEG` and `checkLinkTrialsBehaviorEEG`).
+    """
+    events = events[events[:, 2] == eventCode]
+    return pd.DataFrame({'sample': events[:, 0], 'previous': events[:, 1],
+                         'code': events[:, 2]}, columns=['sample', 'previous', 'code'])
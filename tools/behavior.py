@@ -1,9 +1,14 @@
 import numpy as np
 import pandas as pd
-import couchdb
-import matplotlib.pyplot as plt
-from scipy.stats import norm
-from eeg import getTrialNumList, plotDataSubset
+from snapshot import getServer
+from lazy import lazyImport, lazyFunction
+
+# Imported on first use (plots, h5 files and d-prime only)
+h5py = lazyImport('h5py')
+plt = lazyImport('matplotlib.pyplot')
+stats = lazyImport('scipy.stats')
+getTrialNumList = lazyFunction('eeg', 'getTrialNumList')
+plotDataSubset = lazyFunction('eeg', 'plotDataSubset')
 
 def getBehaviorDataSession(dbAddress, dbName, sessionNum):
     """
@@ -12,7 +17,7 @@ def getBehaviorDataSession(dbAddress, dbName, sessionNum):
     Parameters
     ----------
     dbAddress : str
-        Path to the couch database.
+        Path to the couch database or to the snapshots (see `getServer`).
     dbName : str
         Name of the database on the couch instance.
     sessionNum : int
@@ -24,7 +29,7 @@ def getBehaviorDataSession(dbAddress, dbName, sessionNum):
         A dataframe containing requested data.
     """
 
-    couch = couchdb.Server(dbAddress)
+    couch = getServer(dbAddress)
     db = couch[dbName]
 
     count = 0
@@ -37,7 +42,7 @@ def getBehaviorDataSession(dbAddress, dbName, sessionNum):
     alldoc = alldoc.sort_values(['time']).reset_index(drop=True)
     return alldoc
 
-def getBehaviorData(dbName, sessionNums):
+def getBehaviorData(dbName, sessionNums, dbAddress=None, verbose=False):
     """
     Get behavior data from the couch database according to the name of the DB and
     the sessions.
@@ -48,6 +53,11 @@ def getBehaviorData(dbName, sessionNums):
         Name of the database on the couch instance.
     sessionNums : array-like
         List of sessions to keep.
+    dbAddress : str
+        Path to the snapshots (see `exportSnapshot`) or URL of another couch
+        server. If None, the data is fetched from the remote server.
+    verbose : bool
+        Print the sessions as they are loaded.
 
     Returns
     -------
@@ -55,12 +65,15 @@ def getBehaviorData(dbName, sessionNums):
         Dataframe containing all parameters of all trials.
     """
     password = "a"
-    dbAddress = "https://db.auditory.fr:6984/"
-    dbAddressLog = "https://%s:%s@db.auditory.fr:6984/" % (dbName, password)
+    if dbAddress is None:
+        dbAddressLog = "https://%s:%s@db.auditory.fr:6984/" % (dbName, password)
+    else:
+        dbAddressLog = dbAddress
 
     behaviorData = []
     for session in sessionNums:
-        print 'loading session', session
+        if verbose:
+            print 'loading session', session
         behaviorData.append(getBehaviorDataSession(dbAddress=dbAddressLog,
                                dbName=dbName,
                                sessionNum=session))
@@ -105,7 +118,7 @@ def analyses(data, verbose):
     maxThresh = 1
 
     analyses = pd.DataFrame(columns=['trial', 'freqDiff', 'hit', 'hit1', 'FA',
-        'FA1', 'falseHit', 'allFA', 'dprime', 'TC', 'correctStream', 'twoStreams';
+        'FA1', 'falseHit', 'allFA', 'dprime', 'TC', 'correctStream', 'twoStreams',
         'gapNum'])
     trial = 0
     for i in data.trialNum:
@@ -202,7 +215,7 @@ def analyses(data, verbose):
         if FARatio >= 1:
             FARatio1 = 0.95
 
-        dprime = norm.ppf(hitRatio1) - norm.ppf(FARatio1)
+        dprime = stats.norm.ppf(hitRatio1) - stats.norm.ppf(FARatio1)
 
         if verbose:
             print '\nhit = ', hit
@@ -267,39 +280,167 @@ def plotTrial(data, correctBump, incorrectBump, gapNum, trial, hitTime, FATime,
     plt.title(trial)
     trial += 1
 
-def checkLinkTrialsBehaviorEEG(trialBehavior, events, sessionNum, trigs, fs):
+def matchNearest(keys, sortedKeys):
+    """
+    Find the nearest element of `sortedKeys` for each element of `keys`.
+
+    Parameters
+    ----------
+    keys : instance of numpy.array
+        Values to match.
+    sortedKeys : instance of numpy.array
+        Sorted values (not empty).
+
+    Returns
+    -------
+    nearest : instance of numpy.array
+        Index in `sortedKeys` of the nearest element of each key.
+    """
+    idx = np.clip(np.searchsorted(sortedKeys, keys), 1, len(sortedKeys) - 1)
+    left = sortedKeys[idx - 1]
+    right = sortedKeys[np.minimum(idx, len(sortedKeys) - 1)]
+    return np.where(np.abs(keys - left) <= np.abs(right - keys), idx - 1, idx)
+
+def checkLinkTrialsBehaviorEEG(trialBehavior, events, sessionNum, trigs, fs, offset=None,
+                               respCode=65312, trialDur=60, tol=0.05):
     """
     Check that answer recorded in behavior data correspond to triggers emitted
     by this answer. This allows to be sure that EEG data correspond to behavior.
 
+    The response triggers of all trials are found with one binary search in
+    the sorted events. Each trigger is matched to the nearest response of the
+    same trial in the behavior data. The constant delay between the EEG and
+    the behavior data (about 100 ms) is estimated as the median of the delays
+    between matched responses.
+
     Parameters
     ----------
+    trialBehavior : instance of pandas.core.DataFrame
+        Behavior data.
+    events : instance of numpy.array
+        Events of shape (event, 3) with the sample in the first column and the
+        code in the last column (see `readEvents` in `bdf.py`).
+    sessionNum : int
+        Session to check.
+    trigs : instance of pandas.core.DataFrame
+        Triggers of the beginning of the trials (sample in the first column,
+        see `getTriggers` in `bdf.py`).
     fs : float
         EEG data sampling frequency in Hz.
+    offset : float
+        Delay in seconds added to the EEG responses to match the behavior. If
+        None, it is estimated from the data.
+    respCode : int
+        Code of the response triggers.
+    trialDur : float
+        Duration of a trial in seconds.
+    tol : float
+        Maximum difference in seconds between matched responses.
 
     Returns
     -------
+    report : instance of pandas.core.DataFrame
+        Dataframe containing for each trial the number of responses in the EEG
+        (`eegNum`) and in the behavior data (`behaviorNum`), the number of
+        EEG responses matched with a behavior response (`matchedNum`), the
+        maximum difference in seconds between an EEG response and the nearest
+        behavior response (`maxError`) and whether the trial is consistent
+        (`ok`).
+    offset : float
+        Delay in seconds between EEG and behavior responses.
+    """
+    trials = np.asarray(getTrialNumList(trialBehavior, sessionNum=sessionNum))
+    t0Sample = trigs.iloc[trials, 0].values
+
+    # Responses in the EEG: one search for the bounds of all trials
+    resp = np.sort(events[events[:, 2]==respCode, 0])
+    lo = np.searchsorted(resp, t0Sample, side='right')
+    hi = np.searchsorted(resp, t0Sample + trialDur*fs, side='left')
+    eegNum = hi - lo
+    eegTrial = np.repeat(np.arange(len(trials)), eegNum)
+    eegPos = np.arange(eegNum.sum()) - np.repeat(np.cumsum(eegNum) - eegNum, eegNum)
+    eegTime = (resp[lo[eegTrial] + eegPos] - t0Sample[eegTrial]) / float(fs)
+
+    # Responses in the behavior data
+    behaviorResp = trialBehavior.set_index('trialNum').continuousResponses.loc[trials]
+    behaviorResp = [np.asarray(r, dtype=float).ravel() for r in behaviorResp]
+    behaviorResp = [r[~np.isnan(r)] for r in behaviorResp]
+    behaviorNum = np.array([len(r) for r in behaviorResp])
+    behaviorTrial = np.repeat(np.arange(len(trials)), behaviorNum)
+    behaviorTime = (np.concatenate(behaviorResp) if len(behaviorResp)
+                    else np.zeros(0))
+
+    # Key sorted by trial then time so the nearest response is in the same
+    # trial (if there is one)
+    span = 4.*trialDur
+    behaviorKey = behaviorTrial*span + behaviorTime
+    order = np.argsort(behaviorKey)
+    behaviorKey = behaviorKey[order]
+    behaviorTrial = behaviorTrial[order]
+
+    matched = np.zeros(len(eegTime), dtype=bool)
+    error = np.full(len(eegTime), np.nan)
+    if len(eegTime) and len(behaviorKey):
+        def match(offsetValue):
+            nearest = matchNearest(eegTrial*span + eegTime + offsetValue, behaviorKey)
+            sameTrial = behaviorTrial[nearest] == eegTrial
+            delay = behaviorKey[nearest] - (eegTrial*span + eegTime)
+            return sameTrial, delay
+        sameTrial, delay = match(0. if offset is None else offset)
+        if offset is None:
+            offset = np.median(delay[sameTrial]) if sameTrial.any() else 0.
+            sameTrial, delay = match(offset)
+        error = np.where(sameTrial, np.abs(delay - offset), np.nan)
+        matched = sameTrial & (np.where(sameTrial, error, np.inf) < tol)
+    elif offset is None:
+        offset = 0.
+
+    matchedNum = np.bincount(eegTrial[matched], minlength=len(trials))
+    maxError = np.full(len(trials), np.nan)
+    if len(eegTime):
+        np.fmax.at(maxError, eegTrial, error)
+    report = pd.DataFrame({'trial': trials, 'eegNum': eegNum,
+                           'behaviorNum': behaviorNum, 'matchedNum': matchedNum,
+                           'maxError': maxError},
+                          columns=['trial', 'eegNum', 'behaviorNum', 'matchedNum',
+                                   'maxError'])
+    report['ok'] = ((report.eegNum == report.behaviorNum) &
+                    (report.matchedNum == report.eegNum))
+    return report, offset
+
+def getTrialIndex(trialBehavior):
+    """
+    Build an index of the conditions of the trials. For each column of the
+    behavior data containing hashable values, a boolean mask of the trials is
+    stored for each value. This allows `getTrialNum` to answer queries with
+    logical operations on these masks instead of scanning the dataframe.
+    Missing values (NaN or None) are stored under the key `np.nan`.
+
+    Parameters
+    ----------
+    trialBehavior : instance of Pandas.Dataframe
+        All behavior data.
 
+    Returns
+    -------
+    trialIndex : dict
+        Dictionary containing the trial numbers (`trialNum`) and the masks
+        (`masks`) as a dict {column: {value: mask}}.
     """
-    for trial in getTrialNumList(trialBehavior, sessionNum=sessionNum):
-        print trial
-        t0Sample = trigs.iloc[trial, 0]
-        # get response in this trial
-        ev = events[((events[:, 0]>t0Sample) & (events[:, 0]<t0Sample+(60*fs)) &
-            (events[:, 2]==65312))]
-        # why 100 ms difference with behavior data?
-        print 'eeg     ', (ev[:, 0] - t0Sample)/fs + 0.1
-        # print responses from behavior
-        print 'behavior', trialBehavior.continuousResponses[trialBehavior.trialNum==trial].values[0]
-        # plot 1 second before the beginning of the trial
-        t0 = (t0Sample/fs)-1
-        t1 = t0 + 32
-        # data = pd.DataFrame(data[trial, :, :15])
-        # plotDataSubset(data=data, stim=stim,
-        #                lineTrigs=trigs,
-        #                offset=1, t0=t0, t1=t1, fs=512.)
-
-def getTrialNum(ref, allSubj, trialBehavior, **kwargs):
+    masks = {}
+    for column in trialBehavior.columns:
+        try:
+            codes, uniques = pd.factorize(trialBehavior[column].values)
+        except TypeError:
+            # Columns of lists (like the responses) can't be used as conditions
+            continue
+        masks[column] = dict((value, codes == code) for code, value in enumerate(uniques))
+        # factorize gives the code -1 to the missing values
+        if (codes == -1).any():
+            masks[column][np.nan] = codes == -1
+    return {'trialNum': trialBehavior.trialNum.values, 'masks': masks}
+
+def getTrialNum(ref, allSubj, trialBehavior, subjNum=4, **kwargs):
     """
     Get the trial numbers corresponding to specific conditions.
 
@@ -309,9 +450,12 @@ def getTrialNum(ref, allSubj, trialBehavior, **kwargs):
         If 1: the condition is all trials (like for overall analyses: exp 1 and 2).
     allSubj : bool
         Choose to return the trial number for one or all subjects.
-    trialBehavior : instance of Pandas.Dataframe
+    trialBehavior : instance of Pandas.Dataframe or dict
         All behavior data. Trial numbers will be find related to condition present
-        in this dataset.
+        in this dataset. The index returned by `getTrialIndex` can be used
+        instead to avoid building it for each query.
+    subjNum : int
+        Number of subjects when `allSubj` is True (80 trials per subject).
     **kwargs : other arguments
         All conditions can be passed as argument like `correctStream=[False]`.
 
@@ -328,22 +472,254 @@ def getTrialNum(ref, allSubj, trialBehavior, **kwargs):
         raise ValueError
 
     if (kwargs):
-        acc = pd.DataFrame()
+        if isinstance(trialBehavior, pd.DataFrame):
+            trialIndex = getTrialIndex(trialBehavior)
+        else:
+            trialIndex = trialBehavior
+        trialNum = trialIndex['trialNum']
+        acc = np.ones(trialNum.shape[0], dtype=bool)
         for i in kwargs:
-            acc[i] = trialBehavior[i].isin(kwargs[i])
-        acc['res'] = acc.mean(axis=1)
-        print kwargs
-        results = trialBehavior.trialNum[acc['res']==1].values
-
+            masks = trialIndex['masks'][i]
+            condition = np.zeros(trialNum.shape[0], dtype=bool)
+            for value in kwargs[i]:
+                # Missing values match each other (like `isin`)
+                if value is None or (isinstance(value, float) and np.isnan(value)):
+                    value = np.nan
+                if value in masks:
+                    condition |= masks[value]
+            acc &= condition
+        results = trialNum[acc]
 
         results = results[results>=0]
-        if allSubj:
-            results = np.concatenate([results, results+80,
-                results+(80*2), results+(80*3)])
-        return results
     else:
-        if allSubj:
-            allTrials = np.concatenate([allTrials, allTrials+80,
-                allTrials+(80*2), allTrials+(80*3)])
-        return allTrials
+        results = allTrials
+    if allSubj:
+        results = (results[np.newaxis, :] +
+                   80*np.arange(subjNum)[:, np.newaxis]).ravel()
+    return results
+
+# Columns of the behavior data containing a list for each trial
+listColumns = ['delayBump0', 'delayBump1', 'continuousResponses']
+
+def toColumnar(trialBehavior):
+    """
+    Convert the behavior data to a columnar representation. The numeric and
+    string columns are stored as arrays and the columns of lists
+    (`listColumns`) as a flat array of values with the offsets of each trial
+    in this array (the values of trial i are `values[offsets[i]:offsets[i+1]]`).
+
+    Parameters
+    ----------
+    trialBehavior : instance of pandas.core.DataFrame
+        Behavior data (for instance from `getBehaviorData`).
+
+    Returns
+    -------
+    columnar : dict
+        Dictionary {column: array} for numeric and string columns and
+        {column: {'values': array, 'offsets': array}} for the columns of lists.
+    """
+    columnar = {}
+    for column in trialBehavior.columns:
+        if column in listColumns:
+            lists = [np.asarray(x, dtype=float).ravel() for x in trialBehavior[column]]
+            lengths = np.array([len(x) for x in lists], dtype=np.int64)
+            offsets = np.concatenate([[0], np.cumsum(lengths)])
+            values = np.concatenate(lists) if len(lists) else np.zeros(0)
+            columnar[column] = {'values': values, 'offsets': offsets}
+        elif (trialBehavior[column].dtype.kind in 'biuf'):
+            columnar[column] = trialBehavior[column].values
+        elif (trialBehavior[column].dtype == object and
+              all(isinstance(x, basestring) for x in trialBehavior[column])):
+            # Stored as bytes to be written in .h5 files (like the ids)
+            columnar[column] = np.array([unicode(x).encode('utf-8')
+                                         for x in trialBehavior[column]])
+    return columnar
+
+def fromColumnar(columnar):
+    """
+    Convert the columnar representation back to a dataframe like the one
+    returned by `getBehaviorData` (only the numeric and string columns and
+    the columns of lists are kept).
 
+    Parameters
+    ----------
+    columnar : dict
+        Columnar behavior data (see `toColumnar`).
+
+    Returns
+    -------
+    trialBehavior : instance of pandas.core.DataFrame
+        Behavior data.
+    """
+    data = {}
+    for column, value in columnar.items():
+        if isinstance(value, dict):
+            offsets = value['offsets']
+            data[column] = [list(value['values'][offsets[i]:offsets[i+1]])
+                            for i in range(len(offsets) - 1)]
+        else:
+            data[column] = value
+    return pd.DataFrame(data)
+
+def saveBehaviorH5(path, columnar, group='behavior'):
+    """
+    Save the columnar behavior data in a group of a .h5 file. The file is
+    opened in append mode so the behavior can be stored next to the EEG (see
+    `saveDataH5`).
+
+    Parameters
+    ----------
+    path : str
+        Path of the file.
+    columnar : dict
+        Columnar behavior data (see `toColumnar`).
+    group : str
+        Name of the group.
+    """
+    with h5py.File(path, 'a') as hf:
+        if group in hf:
+            del hf[group]
+        grp = hf.create_group(group)
+        for column, value in columnar.items():
+            if isinstance(value, dict):
+                sub = grp.create_group(column)
+                sub.create_dataset('values', data=value['values'])
+                sub.create_dataset('offsets', data=value['offsets'])
+            else:
+                grp.create_dataset(column, data=value)
+
+def loadBehaviorH5(path, group='behavior'):
+    """
+    Load the columnar behavior data saved by `saveBehaviorH5`.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file.
+    group : str
+        Name of the group.
+
+    Returns
+    -------
+    columnar : dict
+        Columnar behavior data (see `toColumnar`).
+    """
+    columnar = {}
+    with h5py.File(path, 'r') as hf:
+        for column, item in hf[group].items():
+            if isinstance(item, h5py.Group):
+                columnar[column] = {'values': item['values'][()],
+                                    'offsets': item['offsets'][()]}
+            else:
+                columnar[column] = item[()]
+    return columnar
+
+def getLastGapBefore(gaps, responses):
+    """
+    Find for each response the delay since the last gap of the same trial
+    occurring strictly before the response. The gaps and the responses of all
+    trials are sorted together (by trial, time and with the responses before
+    the gaps at the same time) so the last gap is found with a cumulative
+    maximum instead of a loop over responses.
+
+    Parameters
+    ----------
+    gaps : dict
+        Gaps in the columnar representation ({'values', 'offsets'}).
+    responses : dict
+        Responses in the columnar representation ({'values', 'offsets'}).
+
+    Returns
+    -------
+    lag : instance of numpy.array
+        Delay between each response and the last gap before it (NaN if there
+        is no gap before the response).
+    """
+    gapTrial = np.repeat(np.arange(len(gaps['offsets']) - 1), np.diff(gaps['offsets']))
+    respTrial = np.repeat(np.arange(len(responses['offsets']) - 1),
+                          np.diff(responses['offsets']))
+    times = np.concatenate([responses['values'], gaps['values']])
+    trials = np.concatenate([respTrial, gapTrial])
+    isGap = np.concatenate([np.zeros(len(respTrial), dtype=bool),
+                            np.ones(len(gapTrial), dtype=bool)])
+    order = np.lexsort((isGap, times, trials))
+    pos = np.arange(len(order))
+    lastGap = np.maximum.accumulate(np.where(isGap[order], pos, -1))
+
+    respPos = np.empty(len(respTrial), dtype=int)
+    respPos[order[~isGap[order]]] = pos[~isGap[order]]
+    gapPos = lastGap[respPos]
+    gapIdx = order[np.maximum(gapPos, 0)]
+    valid = (gapPos >= 0) & (trials[gapIdx] == respTrial)
+    return np.where(valid, responses['values'] - times[gapIdx], np.nan)
+
+def analysesColumnar(columnar, minThresh=0.3, maxThresh=1):
+    """
+    Vectorized version of `analyses` working on the columnar behavior data of
+    any number of trials (for instance all participants at once). Each response
+    is linked to the last gap before it in the attended and in the unattended
+    streams (see `analyses`) and the counts of each trial are obtained with
+    `np.bincount`.
+
+    Parameters
+    ----------
+    columnar : dict
+        Columnar behavior data (see `toColumnar`).
+    minThresh : float
+        Minimum delay in seconds between a gap and the response.
+    maxThresh : float
+        Maximum delay in seconds between a gap and the response.
+
+    Returns
+    -------
+    analyses : instance of pandas.core.DataFrame
+        Dataframe containing the number of hits and false alarms for each
+        trial (same columns as `analyses`).
+    """
+    correctStream = columnar['correctStream'].astype(bool)
+    trialNum = correctStream.shape[0]
+    resp = columnar['continuousResponses']
+    respTrial = np.repeat(np.arange(trialNum), np.diff(resp['offsets']))
+    keep = ~np.isnan(resp['values'])
+    respTrial = respTrial[keep]
+    resp = {'values': resp['values'][keep],
+            'offsets': np.concatenate([[0], np.cumsum(np.bincount(respTrial,
+                                                                 minlength=trialNum))])}
+
+    lag0 = getLastGapBefore(columnar['delayBump0'], resp)
+    lag1 = getLastGapBefore(columnar['delayBump1'], resp)
+    respCorrect = correctStream[respTrial]
+    lagCorrect = np.where(respCorrect, lag1, lag0)
+    lagIncorrect = np.where(respCorrect, lag0, lag1)
+    with np.errstate(invalid='ignore'):
+        inCorrect = (lagCorrect > minThresh) & (lagCorrect < maxThresh)
+        inIncorrect = (lagIncorrect > minThresh) & (lagIncorrect < maxThresh)
+    if np.any(inCorrect & inIncorrect):
+        raise ValueError('It seems that there are two bumps very close...')
+
+    hit = np.bincount(respTrial[inCorrect], minlength=trialNum).astype(float)
+    falseHit = np.bincount(respTrial[~inCorrect & inIncorrect],
+                           minlength=trialNum).astype(float)
+    FA = np.bincount(respTrial[~inCorrect], minlength=trialNum).astype(float)
+    allFA = FA + falseHit
+
+    gapNum = columnar['bumpNumber']
+    hitRatio = hit/gapNum
+    FARatio = allFA/gapNum
+    # avoid infinite values in dprime calculation
+    hitRatio1 = np.where(hitRatio >= 1, 0.95, np.where(hitRatio <= 0, 0.05, hitRatio))
+    FARatio1 = np.where(FARatio <= 0, 0.05, np.where(FARatio >= 1, 0.95, FARatio))
+    dprime = stats.norm.ppf(hitRatio1) - stats.norm.ppf(FARatio1)
+
+    columns = ['trial', 'freqDiff', 'hit', 'hit1', 'FA', 'FA1', 'falseHit', 'allFA',
+               'dprime', 'TC', 'correctStream', 'twoStreams', 'gapNum']
+    return pd.DataFrame({'trial': np.arange(trialNum),
+                         'freqDiff': columnar['freqDiff'],
+                         'hit': hitRatio, 'hit1': hitRatio1,
+                         'FA': FARatio, 'FA1': FARatio1,
+                         'falseHit': falseHit, 'allFA': allFA, 'dprime': dprime,
+                         'TC': columnar['cloudCompNum'] != 0,
+                         'correctStream': columnar['correctStream'],
+                         'twoStreams': columnar['twoStreams'],
+                         'gapNum': gapNum}, columns=columns)
@@ -0,0 +1,544 @@
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import traceback
+import subprocess
+import multiprocessing
+import numpy as np
+import pandas as pd
+from scipy import signal
+from eeg_utils import preprocessEEG
+from audio import getConcatAudio, downsampleTo64
+from decodingTRF import calculateCorr, getTRFAccuracyByDur
+from decodingSSR import getSSRAccuracyByDur, crossVal, hyperOptC
+from behavior import analyses, analysesColumnar, toColumnar
+from lagMatrix import getLags, getLaggedCovariances
+
+def generateEnvelopes(trialNum, dur, fs=64., cutoff=8., seed=0):
+    """
+    Generate speech-like envelopes: positive random signals with most of their
+    energy below `cutoff`.
+
+    Parameters
+    ----------
+    trialNum : int
+        Number of trials.
+    dur : float
+        Duration of each trial in seconds.
+    fs : float
+        Sampling frequency in Hz.
+    cutoff : float
+        Cutoff frequency of the low-pass filter in Hz.
+    seed : int
+        Seed of the random generator.
+
+    Returns
+    -------
+    envelopes : instance of numpy.array
+        Matrix of shape (trial, time) with unit variance.
+    """
+    rng = np.random.RandomState(seed)
+    sampleNum = int(np.round(dur*fs))
+    b, a = signal.butter(4, cutoff/(fs/2.))
+    envelopes = np.abs(signal.filtfilt(b, a, rng.randn(trialNum, sampleNum), axis=1))
+    envelopes /= envelopes.std(axis=1, keepdims=True)
+    return envelopes
+
+def generateDoubleAM(trialNum, dur, fs=48000., amFreq=36., depth=1., envFs=64., seed=0):
+    """
+    Generate double amplitude modulated stimuli (see `envAM.png`): a noise
+    carrier modulated by a slow speech-like envelope and by a sinusoid at the
+    tag frequency.
+
+    Parameters
+    ----------
+    trialNum : int
+        Number of trials.
+    dur : float
+        Duration of each trial in seconds.
+    fs : float
+        Sampling frequency of the audio in Hz.
+    amFreq : float
+        Frequency of the tag modulation in Hz.
+    depth : float
+        Depth of the tag modulation (between 0 and 1).
+    envFs : float
+        Sampling frequency of the slow envelopes in Hz.
+    seed : int
+        Seed of the random generator.
+
+    Returns
+    -------
+    audioList : array-like
+        List of arrays of shape (time,) (like the audio given to
+        `getConcatAudio`).
+    envelopes : instance of numpy.array
+        Slow envelopes of shape (trial, time) sampled at `envFs`.
+    """
+    rng = np.random.RandomState(seed)
+    envelopes = generateEnvelopes(trialNum, dur, fs=envFs, seed=seed)
+    sampleNum = int(np.round(dur*fs))
+    t = np.arange(sampleNum)/fs
+    tag = 1 + depth*np.sin(2*np.pi*amFreq*t)
+    audioList = []
+    for trial in range(trialNum):
+        slow = np.interp(t, np.arange(envelopes.shape[1])/envFs, envelopes[trial])
+        audio = rng.randn(sampleNum)*slow*tag
+        audioList.append(audio/np.abs(audio).max())
+    return audioList, envelopes
+
+def generateEEG(trialNum, dur, fs=512., electrodes=64, tagFreqs=(36, 44), labels=None,
+                envelopes=None, envFs=64., lag=0.1, ssrAmp=0.5, envAmp=1., dtype=np.float64,
+                seed=0):
+    """
+    Generate EEG trials containing steady-state responses at the tag
+    frequencies and a component tracking the envelopes.
+
+    Parameters
+    ----------
+    trialNum : int
+        Number of trials.
+    dur : float
+        Duration of each trial in seconds.
+    fs : float
+        Sampling frequency in Hz.
+    electrodes : int
+        Number of electrodes.
+    tagFreqs : array-like
+        Tag frequencies in Hz.
+    labels : array-like
+        Index in `tagFreqs` of the attended frequency of each trial. Default
+        to the first frequency for the first half of the trials and the
+        second frequency for the other half.
+    envelopes : instance of numpy.array
+        Envelopes of shape (trial, time) sampled at `envFs` tracked by the
+        EEG. If None, there is no envelope tracking component.
+    envFs : float
+        Sampling frequency of the envelopes in Hz.
+    lag : float
+        Delay of the envelope tracking in seconds.
+    ssrAmp : float
+        Amplitude of the steady-state responses (the noise has unit variance).
+    envAmp : float
+        Amplitude of the envelope tracking component.
+    dtype : numpy.dtype
+        Floating point type of the data.
+    seed : int
+        Seed of the random generator.
+
+    Returns
+    -------
+    data : instance of numpy.array
+        EEG of shape (trial, time, electrode).
+    labels : instance of numpy.array
+        Index of the attended frequency of each trial.
+    """
+    rng = np.random.RandomState(seed)
+    sampleNum = int(np.round(dur*fs))
+    t = np.arange(sampleNum)/fs
+    if labels is None:
+        labels = (np.arange(trialNum) >= trialNum//2).astype(int)
+    labels = np.asarray(labels)
+    ssrPattern = rng.rand(electrodes)
+    envPattern = rng.randn(electrodes)
+
+    data = np.empty((trialNum, sampleNum, electrodes), dtype=dtype)
+    for trial in range(trialNum):
+        phase = rng.rand()*2*np.pi
+        ssr = np.sin(2*np.pi*tagFreqs[labels[trial]]*t + phase)
+        trialData = rng.randn(sampleNum, electrodes)
+        trialData += ssrAmp*ssr[:, np.newaxis]*ssrPattern
+        if envelopes is not None:
+            env = np.interp(t - lag, np.arange(envelopes.shape[1])/envFs,
+                            envelopes[trial], left=0)
+            trialData += envAmp*env[:, np.newaxis]*envPattern
+        data[trial] = trialData
+    return data, labels
+
+def generateRecording(trialNum, dur, fs=512., electrodes=64, gap=5., seed=0):
+    """
+    Generate a continuous recording like the data loaded by `processEEG`:
+    the 64 scalp electrodes followed by the mastoids (M1 and M2) with trials
+    separated by pauses.
+
+    Parameters
+    ----------
+    trialNum : int
+        Number of trials.
+    dur : float
+        Duration of each trial in seconds (60 in the experiment).
+    fs : float
+        Sampling frequency in Hz.
+    electrodes : int
+        Number of scalp electrodes.
+    gap : float
+        Pause between trials in seconds.
+    seed : int
+        Seed of the random generator.
+
+    Returns
+    -------
+    data : instance of numpy.array
+        Matrix of shape (time, channel).
+    chNames : array-like
+        Names of the channels.
+    onsets : instance of numpy.array
+        Sample of the beginning of each trial.
+    """
+    trialSamples = int(np.round(dur*fs))
+    gapSamples = int(np.round(gap*fs))
+    trials, labels = generateEEG(trialNum, dur, fs=fs, electrodes=electrodes + 2,
+                                 seed=seed)
+    data = np.zeros((trialNum*(trialSamples + gapSamples) + gapSamples, electrodes + 2))
+    onsets = gapSamples + np.arange(trialNum)*(trialSamples + gapSamples)
+    data[onsets[:, np.newaxis] + np.arange(trialSamples)] = trials
+    chNames = ['E%d' % (i + 1) for i in range(electrodes)] + ['M1', 'M2']
+    return data, chNames, onsets
+
+def generateBehavior(trialNum, dur=60., gapNum=5, hitRate=0.7, falseHitRate=0.2, FANum=1,
+                     seed=0):
+    """
+    Generate behavior data like `getBehaviorData`: gaps in the two streams and
+    continuous responses (hits after the gaps of the attended stream, false
+    hits after the gaps of the other stream and random false alarms).
+
+    Parameters
+    ----------
+    trialNum : int
+        Number of trials.
+    dur : float
+        Duration of each trial in seconds.
+    gapNum : int
+        Number of gaps in each stream.
+    hitRate : float
+        Probability to respond to a gap of the attended stream.
+    falseHitRate : float
+        Probability to respond to a gap of the other stream.
+    FANum : float
+        Mean number of random responses per trial.
+    seed : int
+        Seed of the random generator.
+
+    Returns
+    -------
+    trialBehavior : instance of pandas.core.DataFrame
+        Behavior data.
+    """
+    rng = np.random.RandomState(seed)
+    # The gaps of each stream are in separate slots so that a response can't
+    # follow gaps of both streams
+    slot = dur/(2*gapNum + 1.)
+    rows = []
+    for trial in range(trialNum):
+        correctStream = bool(rng.rand() < 0.5)
+        slots = rng.permutation(2*gapNum)
+        gaps = [np.sort((slots[:gapNum] + rng.rand(gapNum)*0.5)*slot),
+                np.sort((slots[gapNum:] + rng.rand(gapNum)*0.5)*slot)]
+        attended = gaps[int(correctStream)]
+        other = gaps[1 - int(correctStream)]
+        hits = attended[rng.rand(gapNum) < hitRate]
+        falseHits = other[rng.rand(gapNum) < falseHitRate]
+        resp = np.concatenate([hits + 0.3 + 0.6*rng.rand(hits.shape[0]),
+                               falseHits + 0.3 + 0.6*rng.rand(falseHits.shape[0]),
+                               rng.rand(rng.poisson(FANum))*dur])
+        rows.append({'_id': 'maskingEEG_1_%d' % trial, 'trialNum': trial,
+                     'freqDiff': rng.randint(3), 'bumpNumber': gapNum,
+                     'correctStream': correctStream, 'twoStreams': trial >= trialNum//2,
+                     'cloudCompNum': rng.randint(2), 'delayBump0': list(gaps[0]),
+                     'delayBump1': list(gaps[1]), 'continuousResponses': list(np.sort(resp))})
+    return pd.DataFrame(rows)
+
+def setupPreprocessEEG(trialNum, dur, electrodes, seed):
+    data, chNames, onsets = generateRecording(trialNum, max(dur, 60), electrodes=electrodes,
+                                              seed=seed)
+    return preprocessEEG, (data, chNames, onsets, 512., 'mastoids'), {}
+
+def setupGetConcatAudio(trialNum, dur, electrodes, seed):
+    audioList, envelopes = generateDoubleAM(trialNum, dur, seed=seed)
+    return getConcatAudio, (audioList, len(audioList[0])), {}
+
+def setupDownsampleTo64(trialNum, dur, electrodes, seed):
+    audioList, envelopes = generateDoubleAM(trialNum, dur, seed=seed)
+    return downsampleTo64, (np.abs(np.array(audioList)),), {}
+
+def setupCalculateCorr(trialNum, dur, electrodes, seed):
+    envelopes = generateEnvelopes(2*trialNum, dur, seed=seed)
+    return calculateCorr, (envelopes[:trialNum], envelopes[trialNum:], 64.), {}
+
+def setupGetTRFAccuracyByDur(trialNum, dur, electrodes, seed):
+    envelopes = generateEnvelopes(3*trialNum, max(dur, 60), seed=seed)
+    envAttended = envelopes[:trialNum]
+    rng = np.random.RandomState(seed)
+    envReconstructed = envAttended + 2*rng.randn(*envAttended.shape)
+    trialsDualStream = np.arange(trialNum//2, trialNum)
+    envUnattended = envelopes[trialNum:trialNum + len(trialsDualStream)]
+    envMismatch = envelopes[2*trialNum:]
+    return getTRFAccuracyByDur, (envAttended, envUnattended, envMismatch, envReconstructed,
+                                 np.arange(trialNum), trialsDualStream), {}
+
+def setupGetSSRAccuracyByDur(trialNum, dur, electrodes, seed):
+    if trialNum < 30 or dur < 59 or electrodes != 64:
+        raise ValueError('`getSSRAccuracyByDur` needs 30 trials of 59 s and 64 electrodes')
+    labels = np.arange(trialNum) % 40 >= 20
+    data, labels = generateEEG(trialNum, dur, electrodes=electrodes, labels=labels, seed=seed)
+    return getSSRAccuracyByDur, (data, np.arange(trialNum), 512.), {}
+
+def setupCrossVal(trialNum, dur, electrodes, seed):
+    data, labels = generateEEG(trialNum, dur, electrodes=electrodes, seed=seed)
+    return crossVal, (data, data, 512.), {}
+
+def setupHyperOptC(trialNum, dur, electrodes, seed):
+    if trialNum % 80:
+        raise ValueError('`hyperOptC` needs 80 trials per participant')
+    subjNum = trialNum//80
+    labels = np.arange(trialNum) % 40 >= 20
+    data, labels = generateEEG(trialNum, dur, electrodes=electrodes, labels=labels, seed=seed)
+    trialBehaviorAll = [generateBehavior(80, seed=seed + i) for i in range(subjNum)]
+    return hyperOptC, (data, [0.1, 1, 10], [dur], electrodes, 0, subjNum, 'twoStreams', 512.,
+                       trialBehaviorAll), {}
+
+def setupAnalyses(trialNum, dur, electrodes, seed):
+    return analyses, (generateBehavior(trialNum, seed=seed), False), {}
+
+def setupAnalysesColumnar(trialNum, dur, electrodes, seed):
+    return analysesColumnar, (toColumnar(generateBehavior(trialNum, seed=seed)),), {}
+
+def setupGetLaggedCovariances(trialNum, dur, electrodes, seed):
+    envelopes = generateEnvelopes(trialNum, dur, seed=seed)
+    rng = np.random.RandomState(seed)
+    eeg = rng.randn(trialNum, envelopes.shape[1], electrodes)
+    return getLaggedCovariances, (eeg, envelopes[..., np.newaxis], getLags(-50, 300, 64.)), {}
+
+# Functions creating the call of each benchmark from the parameters
+benchmarkCases = {
+    'preprocessEEG': setupPreprocessEEG,
+    'getConcatAudio': setupGetConcatAudio,
+    'downsampleTo64': setupDownsampleTo64,
+    'calculateCorr': setupCalculateCorr,
+    'getTRFAccuracyByDur': setupGetTRFAccuracyByDur,
+    'getSSRAccuracyByDur': setupGetSSRAccuracyByDur,
+    'crossVal': setupCrossVal,
+    'hyperOptC': setupHyperOptC,
+    'analyses': setupAnalyses,
+    'analysesColumnar': setupAnalysesColumnar,
+    'getLaggedCovariances': setupGetLaggedCovariances,
+}
+
+def getPeakMemory():
+    """
+    Get the peak resident memory of the current process.
+
+    Returns
+    -------
+    peak : float
+        Peak resident memory in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB on Linux
+    if sys.platform == 'darwin':
+        return peak/1024.**2
+    return peak/1024.
+
+def runBenchmark(args):
+    """
+    Run one benchmark: generate the data and time the function. Used by
+    `runBenchmarks` (in a new process to measure the peak memory).
+
+    Parameters
+    ----------
+    args : tuple
+        (case, trialNum, dur, electrodes, repeat, seed).
+
+    Returns
+    -------
+    result : dict
+        Parameters, best and mean time in seconds and increase of the peak
+        memory during the calls in MB. If the case can't be run with these
+        parameters, `error` contains the reason.
+    """
+    case, trialNum, dur, electrodes, repeat, seed = args
+    result = {'case': case, 'trialNum': trialNum, 'dur': dur, 'electrodes': electrodes}
+    try:
+        func, funcArgs, funcKwargs = benchmarkCases[case](trialNum, dur, electrodes, seed)
+        peakBefore = getPeakMemory()
+        times = []
+        for i in range(repeat):
+            t0 = time.time()
+            func(*funcArgs, **funcKwargs)
+            times.append(time.time() - t0)
+        result['bestTime'] = min(times)
+        result['meanTime'] = float(np.mean(times))
+        # The peak can't decrease: this is the memory used by the function on
+        # top of the data (or 0 if the data creation used more)
+        result['peakMemory'] = getPeakMemory() - peakBefore
+    except ValueError as e:
+        result['error'] = str(e)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    return result
+
+def runBenchmarks(cases=None, trialNums=(20,), durs=(10,), electrodes=(64,), repeat=3,
+                  path=None, isolate=True, seed=0, verbose=True):
+    """
+    Run the benchmarks for all combinations of parameters on synthetic data
+    (see the `generate*` functions).
+
+    Parameters
+    ----------
+    cases : array-like
+        Names of the benchmarks to run (keys of `benchmarkCases`). Default to
+        all benchmarks.
+    trialNums : array-like
+        Numbers of trials.
+    durs : array-like
+        Durations of the trials in seconds.
+    electrodes : array-like
+        Numbers of electrodes.
+    repeat : int
+        Number of calls of the function for each combination.
+    path : str
+        Path of the JSON file where the results are saved (see
+        `compareBenchmarks`). If None, the results are not saved.
+    isolate : bool
+        If True, each combination is run in a new process to measure its peak
+        memory.
+    seed : int
+        Seed of the random generators.
+    verbose : bool
+        If True, print each result.
+
+    Returns
+    -------
+    results : instance of pandas.core.DataFrame
+        Dataframe containing the parameters, the best and mean times (s) and
+        the peak memory (MB) of each combination.
+    """
+    if cases is None:
+        cases = sorted(benchmarkCases)
+    tasks = [(case, int(trialNum), float(dur), int(elec), repeat, seed) for case in cases
+             for trialNum in trialNums for dur in durs for elec in electrodes]
+
+    results = []
+    for task in tasks:
+        if isolate:
+            pool = multiprocessing.Pool(processes=1, maxtasksperchild=1)
+            try:
+                result = pool.apply(runBenchmark, (task,))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            result = runBenchmark(task)
+        if verbose:
+            print result
+        results.append(result)
+    results = pd.DataFrame(results, columns=['case', 'trialNum', 'dur', 'electrodes',
+                                             'bestTime', 'meanTime', 'peakMemory', 'error'])
+
+    if path is not None:
+        info = {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'results': json.loads(results.to_json(orient='records'))}
+        with open(path, 'w') as f:
+            json.dump(info, f, indent=1)
+    return results
+
+def loadBenchmarks(path):
+    """
+    Load results saved by `runBenchmarks`.
+
+    Parameters
+    ----------
+    path : str
+        Path of the JSON file.
+
+    Returns
+    -------
+    results : instance of pandas.core.DataFrame
+        Results of the benchmarks.
+    """
+    with open(path) as f:
+        return pd.DataFrame(json.load(f)['results'])
+
+def compareBenchmarks(pathRef, pathNew, threshold=1.2):
+    """
+    Compare two runs of the benchmarks to find regressions.
+
+    Parameters
+    ----------
+    pathRef : str
+        Path of the JSON file of the reference run.
+    pathNew : str
+        Path of the JSON file of the new run.
+    threshold : float
+        Ratio of time or memory above which the combination is considered as a
+        regression.
+
+    Returns
+    -------
+    comparison : instance of pandas.core.DataFrame
+        Dataframe containing the best times and peak memories of both runs,
+        their ratios (new / reference) and `regression` for each combination
+        present in both runs.
+    """
+    keys = ['case', 'trialNum', 'dur', 'electrodes']
+    ref = loadBenchmarks(pathRef)[keys + ['bestTime', 'peakMemory']]
+    new = loadBenchmarks(pathNew)[keys + ['bestTime', 'peakMemory']]
+    comparison = ref.merge(new, on=keys, suffixes=('Ref', 'New')).dropna()
+    comparison['timeRatio'] = comparison.bestTimeNew/comparison.bestTimeRef
+    # 1 MB margin because small peaks are dominated by the allocator
+    comparison['memoryRatio'] = ((comparison.peakMemoryNew + 1) /
+                                 (comparison.peakMemoryRef + 1))
+    comparison['regression'] = ((comparison.timeRatio > threshold) |
+                                (comparison.memoryRatio > threshold))
+    return comparison
+
+# Dependencies that the numerical modules should not import
+heavyModules = ['couchdb', 'IPython', 'matplotlib', 'sklearn', 'soundfile', 'urllib2', 'eeg',
+                'h5py', 'scipy.stats', 'mne']
+
+def benchmarkImports(modules=None, repeat=3):
+    """
+    Measure the time needed to import modules of `tools` in a new Python
+    process (like a worker of a process pool) and list the heavy dependencies
+    imported with them (see `heavyModules`).
+
+    Parameters
+    ----------
+    modules : array-like
+        Names of the modules (like 'decodingTRF'). Default to the main modules.
+    repeat : int
+        Number of new processes for each module (the best time is kept).
+
+    Returns
+    -------
+    results : instance of pandas.core.DataFrame
+        Dataframe containing the import time in seconds and the heavy modules
+        loaded for each module.
+    """
+    if modules is None:
+        modules = ['decodingTRF', 'decodingSSR', 'eeg_utils', 'behavior', 'audio',
+                   'streamingTRF', 'bootstrap', 'permutation']
+    toolsDir = os.path.dirname(os.path.abspath(__file__))
+    code = ('import sys, time, json\n'
+            'sys.path.insert(0, %r)\n'
+            't0 = time.time()\n'
+            'import %%s\n'
+            't = time.time() - t0\n'
+            'print(json.dumps([t, [m for m in %r if m in sys.modules]]))' %
+            (toolsDir, heavyModules))
+    results = []
+    for module in modules:
+        times = []
+        for i in range(repeat):
+            output = subprocess.check_output([sys.executable, '-c', code % module])
+            importTime, loaded = json.loads(output.strip().splitlines()[-1])
+            times.append(importTime)
+        results.append({'module': module, 'importTime': min(times),
+                        'heavyModules': ', '.join(loaded)})
+    return pd.DataFrame(results, columns=['module', 'importTime', 'heavyModules'])
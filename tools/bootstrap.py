@@ -0,0 +1,296 @@
+import numpy as np
+import pandas as pd
+from decodingSSR import getTagCoefsByDur, calculateTagBaseline
+from decodingTRF import calculateCorrByDur
+from parallel import runTasks
+
+def getResampleWeights(trialNum, nBoot, seed):
+    """
+    Draw bootstrap resamples of trials and return them as weights: each row
+    contains the number of times each trial is drawn.
+
+    Parameters
+    ----------
+    trialNum : int
+        Number of trials.
+    nBoot : int
+        Number of resamples.
+    seed : int
+        Seed of the random generator.
+
+    Returns
+    -------
+    weights : instance of numpy.array
+        Matrix of shape (nBoot, trialNum).
+    """
+    rng = np.random.RandomState(seed)
+    idx = rng.randint(trialNum, size=(nBoot, trialNum))
+    weights = np.zeros((nBoot, trialNum))
+    np.add.at(weights, (np.arange(nBoot)[:, np.newaxis], idx), 1)
+    return weights
+
+def getSSRBootstrapChunk(args):
+    """
+    Compute the aSSR accuracies of a chunk of resamples. Used by
+    `bootstrapSSRAccuracyByDur` (possibly in another process).
+
+    Parameters
+    ----------
+    args : tuple
+        (coefs, baseline, nBoot, seed) where `coefs` are the coefficients of
+        shape (trial, duration, electrode, 2) of one participant and
+        `baseline` the baseline of shape (duration,).
+
+    Returns
+    -------
+    accBoot : instance of numpy.array
+        Accuracies of shape (duration, nBoot).
+    """
+    coefs, baseline, nBoot, seed = args
+    weights = getResampleWeights(coefs.shape[0], nBoot, seed) / coefs.shape[0]
+    # Average of the resampled trials for all resamples at once
+    means = np.tensordot(weights, coefs, axes=([1], [0]))
+    ratios = np.abs(means[..., 0]) / np.abs(means[..., 1])
+    accBoot = (ratios > baseline[:, np.newaxis]).mean(axis=2)
+    return accBoot.T
+
+def getTRFBootstrapChunk(args):
+    """
+    Compute the TRF accuracies of a chunk of resamples. Used by
+    `bootstrapTRFAccuracyByDur` (possibly in another process).
+
+    Parameters
+    ----------
+    args : tuple
+        (isBetter, nBoot, seed) where `isBetter` is a boolean array of shape
+        (duration, trial) of one participant.
+
+    Returns
+    -------
+    accBoot : instance of numpy.array
+        Accuracies of shape (duration, nBoot).
+    """
+    isBetter, nBoot, seed = args
+    rng = np.random.RandomState(seed)
+    idx = rng.randint(isBetter.shape[1], size=(nBoot, isBetter.shape[1]))
+    return isBetter[:, idx].mean(axis=2)
+
+def runBootstrapChunks(func, tasks, nJobs):
+    """
+    Run the bootstrap chunks, possibly in parallel.
+
+    Parameters
+    ----------
+    func : callable
+        Function computing one chunk.
+    tasks : array-like
+        Arguments of each chunk.
+    nJobs : int
+        Number of processes.
+
+    Returns
+    -------
+    results : array-like
+        Results of each chunk in the order of `tasks`.
+    """
+    return runTasks(func, tasks, nJobs)
+
+def getChunkSeeds(seed, participantNum, nBoot, chunkSize):
+    """
+    Get the size and the seed of each chunk of resamples. The seeds are drawn
+    from the main seed so the results do not depend on the number of
+    processes.
+
+    Parameters
+    ----------
+    seed : int
+        Main seed.
+    participantNum : int
+        Number of participants.
+    nBoot : int
+        Number of resamples for each participant.
+    chunkSize : int
+        Number of resamples computed at once.
+
+    Returns
+    -------
+    chunks : array-like
+        List of (participant, size, seed).
+    """
+    sizes = [chunkSize]*(nBoot//chunkSize)
+    if nBoot % chunkSize:
+        sizes.append(nBoot % chunkSize)
+    seeds = np.random.RandomState(seed).randint(2**31 - 1,
+                                                size=(participantNum, len(sizes)))
+    return [(p, size, seeds[p, k]) for p in range(participantNum)
+            for k, size in enumerate(sizes)]
+
+def summarizeBootstrap(acc, accBoot, durs, ci):
+    """
+    Create the dataframe of the confidence intervals.
+
+    Parameters
+    ----------
+    acc : array-like
+        List of arrays of shape (duration,) with the accuracies of each
+        participant.
+    accBoot : array-like
+        List of arrays of shape (duration, nBoot) with the resampled
+        accuracies of each participant.
+    durs : array-type
+        List of durations in seconds.
+    ci : float
+        Confidence level in percent.
+
+    Returns
+    -------
+    results : instance of pandas.core.DataFrame
+        Dataframe containing the accuracy and the bounds of the confidence
+        interval for each participant and duration.
+    """
+    results = []
+    for p in range(len(acc)):
+        lower, upper = np.percentile(accBoot[p], [(100 - ci)/2., (100 + ci)/2.], axis=1)
+        results.append(pd.DataFrame({'participant': p, 'dur': durs, 'acc': acc[p],
+                                     'lower': lower, 'upper': upper},
+                                    columns=['participant', 'dur', 'acc', 'lower',
+                                             'upper']))
+    return pd.concat(results, ignore_index=True)
+
+def bootstrapSSRAccuracyByDur(data, participants, fs, durs=None, nBoot=1000, ci=95,
+                              seed=0, nJobs=1, chunkSize=250, labels=None):
+    """
+    Bootstrap confidence intervals of the aSSR accuracy for each duration and
+    participant. The accuracy is the proportion of electrodes where the ratio
+    between the 36 Hz and 44 Hz tag energies of the average of trials is larger
+    than the baseline (see `getSSRAccuracyByDur` and `calculateBaseline`). The
+    energies are the amplitudes of the Fourier coefficients at the tag
+    frequencies: the accuracy is the one of `getSSRAccuracyByDur` if
+    `computePickEnergy` computes the same energies (checked in
+    `tests/test_bootstrap.py`).
+
+    The Fourier coefficients at 36 and 44 Hz are computed once for each trial,
+    electrode and duration (see `getTagCoefsByDur`). Each resample of trials
+    is then a weighted average of these coefficients, computed for all
+    resamples with one matrix product. The baseline is not resampled.
+
+    Parameters
+    ----------
+    data : array-type
+        Data of shape (trial, time, electrode).
+    participants : array-like
+        List of arrays containing the trials of each participant to consider.
+    fs : float
+        Sampling frequency in Hz.
+    durs : array-type
+        List of durations in seconds. Default to 1 to 59 s.
+    nBoot : int
+        Number of resamples for each participant.
+    ci : float
+        Confidence level in percent.
+    seed : int
+        Seed of the random generator. The results do not depend on `nJobs`.
+    nJobs : int
+        Number of processes.
+    chunkSize : int
+        Number of resamples computed at once.
+    labels : array-type
+        Tag frequency of each trial of `data` used for the baseline (see
+        `calculateTagBaseline`). Trials with other labels are not used.
+        Default to the one stream trials of `calculateBaseline` (36 Hz for
+        the trials 0 to 9 and 44 Hz for the trials 20 to 29).
+
+    Returns
+    -------
+    results : instance of pandas.core.DataFrame
+        Dataframe containing the accuracy (`acc`) and the bounds of the
+        confidence interval (`lower` and `upper`) for each participant and
+        duration.
+    """
+    if durs is None:
+        durs = np.arange(1, 60)
+    if labels is None:
+        labels = np.full(data.shape[0], np.nan)
+        labels[:10] = 36
+        labels[20:30] = 44
+    tagBaseline = calculateTagBaseline(data, np.asarray(labels, dtype=float), [36, 44], fs,
+                                       durs)
+    baseline = tagBaseline[:, 0] / tagBaseline[:, 1]
+
+    allCoefs = [getTagCoefsByDur(data[trials], [36, 44], fs, durs)
+                for trials in participants]
+    acc = []
+    for coefs in allCoefs:
+        means = coefs.mean(axis=0)
+        acc.append((np.abs(means[..., 0])/np.abs(means[..., 1]) >
+                    baseline[:, np.newaxis]).mean(axis=1))
+
+    chunks = getChunkSeeds(seed, len(participants), nBoot, chunkSize)
+    tasks = [(allCoefs[p], baseline, size, s) for p, size, s in chunks]
+    accChunks = runBootstrapChunks(getSSRBootstrapChunk, tasks, nJobs)
+    accBoot = [np.concatenate([a for (p, size, s), a in zip(chunks, accChunks)
+                               if p == participant], axis=1)
+               for participant in range(len(participants))]
+    return summarizeBootstrap(acc, accBoot, durs, ci)
+
+def bootstrapTRFAccuracyByDur(envReconstructed, envTarget, envCompare, participants,
+                              fs=64, durs=None, nBoot=1000, ci=95, seed=0, nJobs=1,
+                              chunkSize=1000):
+    """
+    Bootstrap confidence intervals of the TRF accuracy for each duration and
+    participant. The accuracy is the proportion of trials where the
+    reconstructed envelope is more correlated with the target envelope than
+    with the comparison envelope (see `getTRFAccuracyByDur`).
+
+    The correlations are computed once for each trial and duration (see
+    `calculateCorrByDur`) and the resamples are drawn as an index matrix used
+    to gather the results of all resamples at once.
+
+    Parameters
+    ----------
+    envReconstructed : instance of numpy.array
+        Reconstructed envelopes. Shape (trial, time).
+    envTarget : instance of numpy.array
+        Target envelopes (for instance attended) of the same trials. Shape
+        (trial, time).
+    envCompare : instance of numpy.array
+        Comparison envelopes (for instance mismatch or unattended) of the same
+        trials. Shape (trial, time).
+    participants : array-like
+        List of arrays containing the trials of each participant to consider
+        (indices of the rows of the envelopes).
+    fs : float
+        Sampling frequency in Hz.
+    durs : array-type
+        List of durations in seconds. Default to 1 to 60 s.
+    nBoot : int
+        Number of resamples for each participant.
+    ci : float
+        Confidence level in percent.
+    seed : int
+        Seed of the random generator. The results do not depend on `nJobs`.
+    nJobs : int
+        Number of processes.
+    chunkSize : int
+        Number of resamples computed at once.
+
+    Returns
+    -------
+    results : instance of pandas.core.DataFrame
+        Dataframe containing the accuracy (`acc`) and the bounds of the
+        confidence interval (`lower` and `upper`) for each participant and
+        duration.
+    """
+    if durs is None:
+        durs = np.arange(1, 61)
+    isBetter = (calculateCorrByDur(envReconstructed, envTarget, fs, durs) >
+                calculateCorrByDur(envReconstructed, envCompare, fs, durs))
+    acc = [isBetter[:, trials].mean(axis=1) for trials in participants]
+
+    chunks = getChunkSeeds(seed, len(participants), nBoot, chunkSize)
+    tasks = [(isBetter[:, participants[p]], size, s) for p, size, s in chunks]
+    accChunks = runBootstrapChunks(getTRFBootstrapChunk, tasks, nJobs)
+    accBoot = [np.concatenate([a for (p, size, s), a in zip(chunks, accChunks)
+                               if p == participant], axis=1)
+               for participant in range(len(participants))]
+    return summarizeBootstrap(acc, accBoot, durs, ci)
@@ -0,0 +1,371 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from eeg_utils import processEEG, bandsTRF, bandsSSR
+from audio import getEnv, getAttendedAndUnattendedEnv
+
+defaultCacheDir = os.path.join('data_preproc', 'cache')
+
+def getFileHash(path, fast=True):
+    """
+    Get a string identifying the content of a file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file.
+    fast : bool
+        If True, the size and the modification time of the file are used
+        instead of hashing its content. This is instantaneous but a file copied
+        with a new modification time will be considered as different.
+
+    Returns
+    -------
+    fileHash : str
+        String identifying the file.
+    """
+    if fast:
+        stat = os.stat(path)
+        return 'size%d_mtime%d' % (stat.st_size, int(stat.st_mtime))
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**24), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def getCodeVersion(modules):
+    """
+    Get a hash of the source code of modules. Any change of the code
+    processing the data gives a new version and invalidates the cache.
+
+    Parameters
+    ----------
+    modules : array-like
+        List of module names (like 'eeg_utils'). Modules that can't be
+        imported are ignored.
+
+    Returns
+    -------
+    version : str
+        Hash of the source of the modules.
+    """
+    sha = hashlib.sha1()
+    for name in modules:
+        module = sys.modules.get(name)
+        if module is None:
+            # Modules imported lazily must give the same version before and
+            # after their first use
+            try:
+                module = __import__(name, globals(), {}, ['__name__'], -1)
+            except ImportError:
+                continue
+        path = getattr(module, '__file__', None)
+        if path is None:
+            continue
+        if path.endswith('.pyc'):
+            path = path[:-1]
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()
+
+def getCacheKey(params):
+    """
+    Get the key of a cache entry from the parameters of the call.
+
+    Parameters
+    ----------
+    params : dict
+        Parameters identifying the computation. Values have to be serializable
+        in JSON.
+
+    Returns
+    -------
+    key : str
+        Hash of the parameters.
+    """
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+def cachedCall(func, params, names, cacheDir=defaultCacheDir):
+    """
+    Return the outputs of `func` from the cache if they exist or call it and
+    store its outputs. Outputs are stored as `.npy` files and loaded as
+    read-only memory maps so a cache hit does not read the data until it is
+    used.
+
+    Parameters
+    ----------
+    func : callable
+        Function called without arguments if the cache entry does not exist. It
+        has to return a numpy array or a tuple of numpy arrays.
+    params : dict
+        Parameters identifying the computation (see `getCacheKey`).
+    names : array-like
+        Names of the outputs of `func`.
+    cacheDir : str
+        Directory containing the cache entries.
+
+    Returns
+    -------
+    outputs : instance of numpy.array or tuple
+        Outputs of `func` (memory-mapped).
+    """
+    key = getCacheKey(params)
+    entryDir = os.path.join(cacheDir, key)
+    metaPath = os.path.join(entryDir, 'meta.json')
+
+    if not os.path.exists(metaPath):
+        outputs = func()
+        arrays = outputs if isinstance(outputs, tuple) else (outputs,)
+        if len(arrays) != len(names):
+            raise ValueError('Expected %d outputs but got %d' % (len(names), len(arrays)))
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+        # Write in a temporary directory so an interrupted write does not
+        # leave an incomplete entry
+        tmpDir = tempfile.mkdtemp(dir=cacheDir, prefix='tmp_')
+        size = 0
+        for name, arr in zip(names, arrays):
+            np.save(os.path.join(tmpDir, '%s.npy' % name), np.asarray(arr))
+            size += np.asarray(arr).nbytes
+        meta = {'key': key, 'params': params, 'names': list(names),
+                'created': time.time(), 'size': size}
+        with open(os.path.join(tmpDir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, sort_keys=True)
+        try:
+            os.rename(tmpDir, entryDir)
+        except OSError:
+            # Already created by another process
+            shutil.rmtree(tmpDir)
+    else:
+        # Keep track of the last access to prune unused entries
+        os.utime(metaPath, None)
+
+    outputs = tuple(np.load(os.path.join(entryDir, '%s.npy' % name), mmap_mode='r')
+                    for name in names)
+    return outputs if len(outputs) > 1 else outputs[0]
+
+def cachedProcessEEG(fnEEG, dbName, sessionNums, trialsToRemove, trialBehavior, fs, ref,
+                     dtype=np.float64, cacheDir=defaultCacheDir, fastHash=True):
+    """
+    Cached version of `processEEG`. The EEG is processed only if the .bdf
+    file, the parameters, the trials or the code changed since the last call.
+
+    Parameters
+    ----------
+    fnEEG : str
+        Name of the bdf containing the EEG data.
+    dbName : str
+        Name of the database on the couch instance.
+    sessionNums : array-type
+        List of sessions to keep.
+    trialsToRemove : array-type
+        List of trials to remove from the analyses.
+    trialBehavior : instance of pandas.core.DataFrame
+        Behavior data of the participant.
+    fs : float
+        Sampling frequency in Hz.
+    ref : str
+        Choose between referencing to mastoids ('mastoids') or to the average
+        of all electrodes ('average').
+    dtype : numpy.dtype
+        Floating point type used to process the data.
+    cacheDir : str
+        Directory containing the cache entries.
+    fastHash : bool
+        If True, the .bdf file is identified by its size and modification time
+        instead of the hash of its content.
+
+    Returns
+    -------
+    dataFilt3DTRF64 : instance of numpy.array
+        A matrix of shape (trial, time, electrode) containing the data processed
+        for the TRF (memory-mapped).
+    dataFilt3DSSR : instance of numpy.array
+        A matrix of shape (trial, time, electrode) containing the data processed
+        for the aSSR (memory-mapped).
+    """
+    params = {
+        'function': 'processEEG',
+        'file': getFileHash(fnEEG, fast=fastHash),
+        'sessionNums': [int(i) for i in sessionNums],
+        'trialsToRemove': [int(i) for i in trialsToRemove],
+        'trialNums': [int(i) for i in trialBehavior.trialNum.values],
+        'fs': float(fs),
+        'ref': ref,
+        'bandsTRF': bandsTRF,
+        'bandsSSR': bandsSSR,
+        'dtype': np.dtype(dtype).name,
+        'code': getCodeVersion(['eeg_utils', 'bdf', 'eeg']),
+    }
+    return cachedCall(lambda: processEEG(fnEEG, dbName, sessionNums, trialsToRemove,
+                                         trialBehavior, fs, ref, dtype=dtype),
+                      params, ['eeg_TRF', 'eeg_aSSR'], cacheDir=cacheDir)
+
+def cachedGetEnv(dbAddress, dbName, password, verbose, sessionNums, fs, stream,
+                 dtype=np.float64, cacheDir=defaultCacheDir):
+    """
+    Cached version of `getEnv`. The audio is fetched from the database only
+    if the parameters or the code changed since the last call.
+
+    Parameters
+    ----------
+    dbAddress : str
+        Path to the couch database.
+    dbName : str
+        Name of the database on the couch instance.
+    password : str
+        Password of the couch database.
+    verbose : bool
+        If True, more information are displayed.
+    sessionNums : array-like
+        List of sessions to keep.
+    fs : float
+        Sampling frequency
+    stream : str
+        Stream to keep ('36' or '44').
+    dtype : numpy.dtype
+        Floating point type of the envelopes.
+    cacheDir : str
+        Directory containing the cache entries.
+
+    Returns:
+
+    audioAllEnvFilt2DDS : instance of numpy.array
+        Matrix of shape (trial, time) containing the envelope filtered
+        (memory-mapped).
+    """
+    params = {
+        'function': 'getEnv',
+        'dbName': dbName,
+        'sessionNums': [int(i) for i in sessionNums],
+        'fs': float(fs),
+        'stream': stream,
+        'dtype': np.dtype(dtype).name,
+        'code': getCodeVersion(['audio']),
+    }
+    return cachedCall(lambda: getEnv(dbAddress, dbName, password, verbose,
+                                     sessionNums, fs, stream, dtype=dtype),
+                      params, ['env'], cacheDir=cacheDir)
+
+def cachedGetAttendedAndUnattendedEnv(dbAddress, dbName, password, verbose, fs=48000.,
+                                      dtype=np.float64, cacheDir=defaultCacheDir):
+    """
+    Cached version of `getAttendedAndUnattendedEnv`.
+
+    Parameters
+    ----------
+    dbAddress : str
+        Path to the couch database.
+    dbName : str
+        Name of the database on the couch instance.
+    password : str
+        Password of the couch database.
+    verbose : bool
+        If True, more information are displayed.
+    fs : float
+        Sampling frequency
+    dtype : numpy.dtype
+        Floating point type of the envelopes.
+    cacheDir : str
+        Directory containing the cache entries.
+
+    Returns:
+
+    attended : instance of numpy.array
+        Matrix of shape (trial, time) containing the envelope of all attended
+        streams (memory-mapped).
+    unattended : instance of numpy.array
+        Matrix of shape (trial, time) containing the envelope of all unattended
+        streams (memory-mapped).
+    """
+    params = {
+        'function': 'getAttendedAndUnattendedEnv',
+        'dbName': dbName,
+        'fs': float(fs),
+        'dtype': np.dtype(dtype).name,
+        'code': getCodeVersion(['audio']),
+    }
+    return cachedCall(lambda: getAttendedAndUnattendedEnv(dbAddress, dbName, password,
+                                                          verbose, fs=fs, dtype=dtype),
+                      params, ['envAttended', 'envUnattended'], cacheDir=cacheDir)
+
+def listCache(cacheDir=defaultCacheDir):
+    """
+    List the entries of the cache.
+
+    Parameters
+    ----------
+    cacheDir : str
+        Directory containing the cache entries.
+
+    Returns
+    -------
+    entries : instance of pandas.core.DataFrame
+        Dataframe containing the key, the function, the creation and last
+        access times, the size in bytes and the parameters of each entry.
+    """
+    entries = []
+    if os.path.exists(cacheDir):
+        for key in sorted(os.listdir(cacheDir)):
+            metaPath = os.path.join(cacheDir, key, 'meta.json')
+            if not os.path.exists(metaPath):
+                continue
+            with open(metaPath) as f:
+                meta = json.load(f)
+            entries.append({'key': key,
+                            'function': meta['params'].get('function'),
+                            'created': pd.to_datetime(meta['created'], unit='s'),
+                            'lastAccess': pd.to_datetime(os.path.getmtime(metaPath),
+                                                         unit='s'),
+                            'size': meta['size'],
+                            'params': meta['params']})
+    return pd.DataFrame(entries, columns=['key', 'function', 'created', 'lastAccess',
+                                          'size', 'params'])
+
+def pruneCache(cacheDir=defaultCacheDir, keys=None, maxAge=None, maxSize=None):
+    """
+    Remove entries from the cache.
+
+    Parameters
+    ----------
+    cacheDir : str
+        Directory containing the cache entries.
+    keys : array-like
+        Keys of the entries to remove.
+    maxAge : float
+        Remove the entries not accessed since `maxAge` seconds.
+    maxSize : int
+        Remove the least recently accessed entries until the cache is smaller
+        than `maxSize` bytes.
+
+    Returns
+    -------
+    removed : array-like
+        List of the keys of the removed entries.
+    """
+    entries = listCache(cacheDir).sort_values('lastAccess')
+    toRemove = set()
+    if keys is not None:
+        toRemove.update(keys)
+    if maxAge is not None:
+        limit = pd.to_datetime(time.time() - maxAge, unit='s')
+        toRemove.update(entries.key[entries.lastAccess < limit])
+    if maxSize is not None:
+        kept = entries[~entries.key.isin(toRemove)]
+        # Cumulated size from the most recent entries
+        cumSize = kept['size'].values[::-1].cumsum()[::-1]
+        toRemove.update(kept.key[cumSize > maxSize])
+
+    removed = []
+    for key in entries.key:
+        if key in toRemove:
+            shutil.rmtree(os.path.join(cacheDir, key))
+            removed.append(key)
+    return removed
@@ -1,10 +1,13 @@
 import numpy as np
 import pandas as pd
-from eeg import computePickEnergy
-from behavior import analyses
+from profiling import stage
+from lazy import lazyImport, lazyFunction
 
-from sklearn import svm
-from sklearn.model_selection import train_test_split
+# Imported on first use: the numerical functions don't need them
+computePickEnergy = lazyFunction('eeg', 'computePickEnergy')
+analyses = lazyFunction('behavior', 'analyses', globals())
+svm = lazyImport('sklearn.svm')
+train_test_split = lazyFunction('sklearn.model_selection', 'train_test_split')
 
 def calculateBaseline(data, fs):
     """
@@ -200,9 +203,10 @@ def hyperOptC(data, c_vals, durs, electrodes, dprimeThresh, subjNum, condition,
     for dur in durs:
         durSamples = int(np.round(fs*dur))
         # Get pick values (36 and 44 Hz) for specific duration and electrodes
-        pick36, pick44 = crossVal(data[:, :durSamples, :electrodes],
-                                  data[:, :durSamples, :electrodes],
-                                  fs=fs)
+        with stage('features', nbytes=data[:, :durSamples, :electrodes].nbytes):
+            pick36, pick44 = crossVal(data[:, :durSamples, :electrodes],
+                                      data[:, :durSamples, :electrodes],
+                                      fs=fs)
         # Reshape to have one column per participant and all trials (80) in each col
         allPicks36 = np.zeros((80, subjNum))
         allPicks44 = np.zeros((80, subjNum))
@@ -247,9 +251,10 @@ def hyperOptC(data, c_vals, durs, electrodes, dprimeThresh, subjNum, condition,
                                                                     test_size=0.3,
                                                                     random_state=0)
                 # Train SVM on train data
-                clf = svm.SVC(kernel='rbf', C=c_val).fit(X_train, y_train)
-                # Calculate accuracy on test data
-                acc = clf.score(X_test, y_test)
+                with stage('classify', nbytes=X.nbytes):
+                    clf = svm.SVC(kernel='rbf', C=c_val).fit(X_train, y_train)
+                    # Calculate accuracy on test data
+                    acc = clf.score(X_test, y_test)
                 # Store accuracy
                 bestC = bestC.append({'participant': i, 'dur': dur, 'c': c_val, 'acc': acc},
                              ignore_index=True)
@@ -308,3 +313,215 @@ def getBestAcc(durs, bestC):
 
     return p1AccAll, p2AccAll, p3AccAll, p4AccAll
 
+
+def getTagCoefsByDur(data, freqs, fs, durs):
+    """
+    Get the Fourier coefficients of each trial and electrode at the tag
+    frequencies for a set of durations. The coefficients are calculated from
+    the beginning of the trials (like `getSSRAccuracyByDur`) but the data is
+    read only once: the coefficients are accumulated between consecutive
+    durations. Since the coefficients are linear, the coefficient of the
+    average of trials is the average of the coefficients.
+
+    Parameters
+    ----------
+    data : array-type
+        Data of shape (trial, time, electrode).
+    freqs : array-type
+        Tag frequencies in Hz (for instance [36, 44]).
+    fs : float
+        Sampling frequency in Hz.
+    durs : array-type
+        List of durations in seconds.
+
+    Returns
+    -------
+    coefs : array-type
+        Complex coefficients of shape (trial, duration, electrode, frequency).
+        The energy of the tag is the absolute value of the coefficient.
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    ends = np.clip(np.round(np.asarray(durs, dtype=float)*fs).astype(int), 0, data.shape[1])
+    order = np.argsort(ends)
+    acc = np.zeros((data.shape[0], data.shape[2], len(freqs)), dtype=complex)
+    coefs = np.zeros((data.shape[0], len(ends), data.shape[2], len(freqs)), dtype=complex)
+    last = 0
+    with stage('features', nbytes=data[:, :ends.max()].nbytes):
+        for i in order:
+            end = ends[i]
+            # Only the bins of the tag frequencies are computed
+            phase = 2*np.pi*np.outer(np.arange(last, end), freqs)/fs
+            seg = data[:, last:end, :]
+            acc += np.tensordot(seg, np.cos(phase), axes=([1], [0]))
+            acc -= 1j*np.tensordot(seg, np.sin(phase), axes=([1], [0]))
+            coefs[:, i] = acc
+            last = end
+    return coefs
+
+def getTagEnergies(data, tagFreqs, fs, durs, harmonics=1, average=False):
+    """
+    Get the energy of each trial and electrode at any number of tag
+    frequencies for a set of durations. The energies of all tags and harmonics
+    are computed in one pass over the data (see `getTagCoefsByDur`) and the
+    energies of the harmonics of each tag are summed.
+
+    Parameters
+    ----------
+    data : array-type
+        Data of shape (trial, time, electrode).
+    tagFreqs : array-type
+        Tag frequencies in Hz (for instance [36, 40, 44, 48]).
+    fs : float
+        Sampling frequency in Hz.
+    durs : array-type
+        List of durations in seconds.
+    harmonics : int
+        Number of harmonics to use (1 to use only the tag frequencies).
+    average : bool
+        If True, the energies of the average of trials are returned (like
+        `calculateBaseline`).
+
+    Returns
+    -------
+    energies : instance of numpy.array
+        Energies of shape (trial, duration, electrode, tag) or (duration,
+        electrode, tag) if `average` is True.
+    """
+    tagFreqs = np.asarray(tagFreqs, dtype=float)
+    freqs = np.outer(np.arange(1, harmonics + 1), tagFreqs).ravel()
+    if np.any(freqs >= fs/2.):
+        raise ValueError('Harmonics must be below the Nyquist frequency')
+    coefs = getTagCoefsByDur(data, freqs, fs, durs)
+    if average:
+        coefs = coefs.mean(axis=0)
+    durSamples = np.clip(np.round(np.asarray(durs, dtype=float)*fs), 1, data.shape[1])
+    energies = np.abs(coefs) / durSamples[:, np.newaxis, np.newaxis]
+    # Sum the harmonics of each tag
+    energies = energies.reshape(energies.shape[:-1] + (harmonics, len(tagFreqs)))
+    return energies.sum(axis=-2)
+
+def getTrialLabels(trialBehavior, column, mapping):
+    """
+    Get the label (for instance the attended tag frequency) of each trial from
+    the behavior data.
+
+    Parameters
+    ----------
+    trialBehavior : instance of pandas.Dataframe
+        Behavior data. The column 'session' is created from the document ids if
+        it doesn't exist.
+    column : str
+        Column of `trialBehavior` defining the condition.
+    mapping : dict
+        Label of each value of the column, for instance
+        {1: 36, 2: 36, 3: 44, 4: 44} for the sessions of the one stream
+        condition. Trials with other values get the label NaN.
+
+    Returns
+    -------
+    labels : instance of numpy.array
+        Label of each trial.
+    """
+    if column == 'session' and 'session' not in trialBehavior:
+        # Document ids are 'maskingEEG_<session>_<trial>'
+        values = trialBehavior['_id'].str.split('_').str[1].astype(int)
+    else:
+        values = trialBehavior[column]
+    return values.map(mapping).values.astype(float)
+
+def calculateTagBaseline(data, labels, tagFreqs, fs, durs, harmonics=1):
+    """
+    Calculate the baseline energy of each tag to take into account the fact
+    that the eeg response can be different for each AM rate. This is the
+    generalization of `calculateBaseline` to any number of tags: the energy at
+    each tag is computed from the average of the trials where this tag is
+    presented (for instance in the one stream condition).
+
+    Parameters
+    ----------
+    data : array-type
+        Data of shape (trial, time, electrode).
+    labels : array-type
+        Tag frequency of each trial (see `getTrialLabels`). Trials with other
+        labels are not used.
+    tagFreqs : array-type
+        Tag frequencies in Hz.
+    fs : float
+        Sampling frequency in Hz.
+    durs : array-type
+        List of durations in seconds.
+    harmonics : int
+        Number of harmonics to use.
+
+    Returns
+    -------
+    baseline : instance of numpy.array
+        Baseline of shape (duration, tag).
+    """
+    baseline = np.zeros((len(durs), len(tagFreqs)))
+    for k, tag in enumerate(tagFreqs):
+        energies = getTagEnergies(data[labels == tag], [tag], fs, durs,
+                                  harmonics=harmonics, average=True)
+        # Average electrodes
+        baseline[:, k] = energies[..., 0].mean(axis=1)
+    return baseline
+
+def classifyTags(energies, labels, tagFreqs, baseline=None, method='max', c=1.,
+                 testSize=0.3, randomState=0):
+    """
+    Classify trials among any number of tags from their tag energies and
+    return the accuracy for each duration.
+
+    Parameters
+    ----------
+    energies : instance of numpy.array
+        Energies of shape (trial, duration, electrode, tag) (see
+        `getTagEnergies`).
+    labels : array-type
+        Tag frequency of each trial (see `getTrialLabels`). Trials with other
+        labels (for instance NaN) are not used.
+    tagFreqs : array-type
+        Tag frequencies in Hz corresponding to the last axis of `energies`.
+    baseline : instance of numpy.array
+        Baseline of shape (duration, tag) used to normalize the energies (see
+        `calculateTagBaseline`).
+    method : str
+        'max' to choose the tag with the largest normalized energy (averaged
+        over electrodes) or 'svm' to train a SVM on the log energies of a part
+        of the trials (like `hyperOptC`).
+    c : float
+        C parameter of the SVM.
+    testSize : float
+        Proportion of trials used to test the SVM.
+    randomState : int
+        Seed used to split the trials for the SVM.
+
+    Returns
+    -------
+    accuracy : instance of numpy.array
+        Accuracy for each duration.
+    """
+    tagFreqs = np.asarray(tagFreqs, dtype=float)
+    labels = np.asarray(labels, dtype=float)
+    keep = np.isin(labels, tagFreqs)
+    labels = labels[keep]
+    features = energies[keep].mean(axis=2)
+    if baseline is not None:
+        features = features / baseline
+    if method == 'max':
+        predicted = tagFreqs[np.argmax(features, axis=2)]
+        return (predicted == labels[:, np.newaxis]).mean(axis=0)
+    elif method == 'svm':
+        # Log energies so the features don't depend on the scale of the data
+        features = np.log(features)
+        accuracy = np.zeros(features.shape[1])
+        for dur in range(features.shape[1]):
+            X_train, X_test, y_train, y_test = train_test_split(features[:, dur], labels,
+                                                                test_size=testSize,
+                                                                random_state=randomState)
+            with stage('classify', nbytes=features[:, dur].nbytes):
+                clf = svm.SVC(kernel='rbf', C=c).fit(X_train, y_train)
+                accuracy[dur] = clf.score(X_test, y_test)
+        return accuracy
+    else:
+        raise ValueError('Wrong argument `method`!')
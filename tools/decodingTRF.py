@@ -1,6 +1,7 @@
 import numpy as np
+from profiling import stage
 
-def calculateCorr(env1, env2, fs, end=None):
+def calculateCorr(env1, env2, fs, end=None, dtype=np.float64):
     """
     Get correlations between env1 and env2 for each trials.
 
@@ -14,6 +15,8 @@ def calculateCorr(env1, env2, fs, end=None):
         Sampling frequency in Hz.
     end : float
         End limit in seconds to take for each trial.
+    dtype : numpy.dtype
+        Floating point type used to compute the correlations.
 
     Returns:
 
@@ -30,15 +33,134 @@ def calculateCorr(env1, env2, fs, end=None):
         end = int(np.round(fs*end))
 
 
-    trials = env1.shape[0]
-    corrs = np.zeros(trials)
-    for trial in range(trials):
-        corrs[trial] = np.corrcoef(env1[trial, :end],
-                                   env2[trial, :end])[0, 1]
+    # Pearson correlation of all trials at once
+    with stage('correlate', nbytes=2*env1[:, :end].nbytes):
+        x = env1[:, :end].astype(dtype)
+        y = env2[:, :end].astype(dtype)
+        x -= x.mean(axis=1, keepdims=True)
+        y -= y.mean(axis=1, keepdims=True)
+        corrs = (x*y).sum(axis=1) / np.sqrt((x*x).sum(axis=1)*(y*y).sum(axis=1))
 
     return corrs
 
-def getTRFAccuracyByDur(envAttended, envUnattended, envMismatch, envReconstructed, trials, trialsDualStream):
+def calculateLaggedCorr(env1, env2, fs, maxLag, end=None, dtype=np.float64):
+    """
+    Get correlations between env1 and env2 for each trial and each lag
+    between -maxLag and maxLag. The products for all lags are computed with
+    FFTs along the time axis and each correlation is normalized over the
+    samples that overlap at this lag. A positive lag corresponds to env2
+    delayed relative to env1.
+
+    Parameters
+    ----------
+    env1 : array-type
+        Candidate envelopes of shape (trial, time) or (candidate, trial, time)
+        to compare several sets of envelopes to the same env2.
+    env2 : array-type
+        Second list of envelope (for instance the reconstructed envelopes) of
+        shape (trial, time).
+    fs : float
+        Sampling frequency in Hz.
+    maxLag : float
+        Maximum lag in seconds.
+    end : float
+        End limit in seconds to take for each trial.
+    dtype : numpy.dtype
+        Floating point type used to compute the correlations.
+
+    Returns:
+
+    peakCorrs : array-type
+        Maximum correlation across lags of shape (trial,) or (candidate,
+        trial).
+    peakLags : array-type
+        Lag of the maximum correlation in seconds. Same shape as `peakCorrs`.
+    corrs : array-type
+        Correlations for each lag of shape (trial, lag) or (candidate, trial,
+        lag). The lags are `np.arange(-n, n + 1)/fs` with n the number of
+        samples in `maxLag`.
+    """
+    if env1.shape[-2:] != env2.shape:
+        raise ValueError("Shapes of the envelopes have to be identical\
+ but they are: %s and %s" % (env1.shape, env2.shape))
+
+    if end is None:
+        end = env1.shape[-1]
+    else:
+        end = int(np.round(fs*end))
+    lagNum = int(np.round(maxLag*fs))
+    lags = np.arange(-lagNum, lagNum + 1)
+
+    with stage('correlate', nbytes=env1[..., :end].nbytes + env2[:, :end].nbytes):
+        x = env1[..., :end].astype(dtype)
+        y = env2[:, :end].astype(dtype)
+        # Centering does not change the correlations but limits the numerical
+        # errors of the one-pass formula
+        if end > 0:
+            x -= x.mean(axis=-1, keepdims=True)
+            y -= y.mean(axis=-1, keepdims=True)
+
+        # Zero padding to at least end + lagNum samples avoids the circular
+        # wrap-around for the lags kept
+        nfft = 2**int(np.ceil(np.log2(max(end + lagNum, 1))))
+        cross = np.fft.irfft(np.fft.rfft(x, n=nfft).conj()*np.fft.rfft(y, n=nfft), n=nfft)
+        # numpy.fft always computes in float64
+        sumXY = cross[..., lags % nfft].astype(dtype, copy=False)
+
+        # Sums over the overlapping samples of each lag from cumulative sums
+        def cumsum(arr):
+            zeros = np.zeros(arr.shape[:-1] + (1,), dtype=dtype)
+            return np.concatenate([zeros, np.cumsum(arr, axis=-1)], axis=-1)
+        start = np.clip(-lags, 0, end)
+        stop = np.clip(end - lags, 0, end)
+        startY = np.clip(start + lags, 0, end)
+        stopY = np.clip(stop + lags, 0, end)
+        cumX, cumXX = cumsum(x), cumsum(x*x)
+        cumY, cumYY = cumsum(y), cumsum(y*y)
+        sumX = cumX[..., stop] - cumX[..., start]
+        sumXX = cumXX[..., stop] - cumXX[..., start]
+        sumY = cumY[:, stopY] - cumY[:, startY]
+        sumYY = cumYY[:, stopY] - cumYY[:, startY]
+        n = (stop - start).astype(dtype)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corrs = ((sumXY - sumX*sumY/n) /
+                     np.sqrt((sumXX - sumX**2/n)*(sumYY - sumY**2/n)))
+        # Less than two samples: the rounding errors of the FFT could give
+        # infinite values instead of NaN
+        corrs = np.where(n >= 2, corrs, np.nan)
+
+    peakCorrs, peakLags = getPeakCorr(corrs, lags, fs)
+    return peakCorrs, peakLags, corrs
+
+def getPeakCorr(corrs, lags, fs):
+    """
+    Get the maximum correlation across lags and its lag.
+
+    Parameters
+    ----------
+    corrs : array-type
+        Correlations with the lags on the last axis.
+    lags : array-type
+        Lags in samples.
+    fs : float
+        Sampling frequency in Hz.
+
+    Returns:
+
+    peakCorrs : array-type
+        Maximum correlation (NaN if all correlations are NaN).
+    peakLags : array-type
+        Lag of the maximum correlation in seconds.
+    """
+    valid = ~np.isnan(corrs).all(axis=-1)
+    filled = np.where(np.isnan(corrs), -np.inf, corrs)
+    peakIdx = filled.argmax(axis=-1)
+    peakCorrs = np.where(valid, filled.max(axis=-1), np.nan)
+    peakLags = np.where(valid, lags[peakIdx]/float(fs), np.nan)
+    return peakCorrs, peakLags
+
+def getTRFAccuracyByDur(envAttended, envUnattended, envMismatch, envReconstructed, trials, trialsDualStream,
+                        dtype=np.float64, maxLag=None):
     """
     Get the classification accuracy according to duration of trials and trials used.
 
@@ -57,6 +179,13 @@ def getTRFAccuracyByDur(envAttended, envUnattended, envMismatch, envReconstructe
     trialsDualStream : array-like
         Trials to consider in the exp 2 referential (attended vs unattended with
         only 40 trials)
+    dtype : numpy.dtype
+        Floating point type used to compute the correlations.
+    maxLag : float
+        If not None, each envelope is scored by its maximum correlation with
+        the reconstruction across lags between -maxLag and maxLag seconds
+        (see `calculateLaggedCorr`) instead of the zero-lag correlation. This
+        makes the classification robust to small timing offsets.
 
     Returns
     -------
@@ -73,16 +202,30 @@ def getTRFAccuracyByDur(envAttended, envUnattended, envMismatch, envReconstructe
     classifAtt_unattTime = []
     testAll = []
     # print 'trialsUnattended', trialsUnattended
+    if maxLag is not None:
+        # Peak correlations across lags for all durations at once (the
+        # attended and mismatch envelopes are compared to the reconstruction
+        # together)
+        peakAttendedMismatch = calculateLaggedCorrByDur(
+            np.stack([envAttended, envMismatch]), envReconstructed, fs=64, maxLag=maxLag,
+            durs=np.arange(0, 61), dtype=dtype)[0]
+        peakUnattended = calculateLaggedCorrByDur(envUnattended,
+            envReconstructed[trialsDualStream], fs=64, maxLag=maxLag,
+            durs=np.arange(0, 61), dtype=dtype)[0]
     for i in range(0, 61):
         # Calculate all correlations without taking trials into account
-        corrsAttended = calculateCorr(envAttended, envReconstructed,
-            fs=64, end=i)
+        if maxLag is None:
+            corrsAttended = calculateCorr(envAttended, envReconstructed,
+                fs=64, end=i, dtype=dtype)
 
-        corrsMismatch = calculateCorr(envMismatch, envReconstructed,
-            fs=64, end=i)
+            corrsMismatch = calculateCorr(envMismatch, envReconstructed,
+                fs=64, end=i, dtype=dtype)
 
-        corrsUnattendedDualStream = calculateCorr(envUnattended,
-            envReconstructed[trialsDualStream], fs=64, end=i)
+            corrsUnattendedDualStream = calculateCorr(envUnattended,
+                envReconstructed[trialsDualStream], fs=64, end=i, dtype=dtype)
+        else:
+            corrsAttended, corrsMismatch = peakAttendedMismatch[i]
+            corrsUnattendedDualStream = peakUnattended[i]
         # print 'trialsDualStream', trialsDualStream
         # print 'corrsUnattendedDualStream', np.mean(corrsUnattendedDualStream)
         # Calculate the classification accuracy by selecting the trials to be used
@@ -119,3 +262,181 @@ def getUnattendedTrialsNumber(trials):
 
     return trialsUnattended
 
+
+def getCorrMatrixByDur(env1, env2, fs, durs):
+    """
+    Get correlations between all pairs of trials of env1 and env2 for a set
+    of durations. The correlations are calculated from the beginning of the
+    trials (like `calculateCorr` with `end`) but the data is read only once:
+    the sums needed for the correlations are accumulated between consecutive
+    durations with one matrix product for each duration.
+
+    Parameters
+    ----------
+    env1 : array-type
+        First list of envelope of shape (trial1, time).
+    env2 : array-type
+        Second list of envelope of shape (trial2, time).
+    fs : float
+        Sampling frequency in Hz.
+    durs : array-type
+        List of durations in seconds.
+
+    Returns:
+
+    corrs : array-type
+        Correlations of shape (duration, trial1, trial2). corrs[d, i, j] is the
+        correlation between env1[i] and env2[j] for the duration durs[d].
+    """
+    if env1.shape[1] != env2.shape[1]:
+        raise ValueError("Envelopes must have the same number of samples\
+ but they are: %s and %s" % (env1.shape, env2.shape))
+    # Centering does not change the correlations but limits the numerical
+    # errors of the one-pass formula
+    x = env1 - env1.mean(axis=1, keepdims=True)
+    y = env2 - env2.mean(axis=1, keepdims=True)
+
+    ends = np.clip(np.round(np.asarray(durs, dtype=float)*fs).astype(int), 0, x.shape[1])
+    order = np.argsort(ends)
+    sumX = np.zeros(x.shape[0])
+    sumY = np.zeros(y.shape[0])
+    sumXX = np.zeros(x.shape[0])
+    sumYY = np.zeros(y.shape[0])
+    sumXY = np.zeros((x.shape[0], y.shape[0]))
+    corrs = np.zeros((len(ends), x.shape[0], y.shape[0]))
+    last = 0
+    for i in order:
+        end = ends[i]
+        segX = x[:, last:end]
+        segY = y[:, last:end]
+        sumX += segX.sum(axis=1)
+        sumY += segY.sum(axis=1)
+        sumXX += (segX*segX).sum(axis=1)
+        sumYY += (segY*segY).sum(axis=1)
+        sumXY += np.dot(segX, segY.T)
+        last = end
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = sumXY - np.outer(sumX, sumY)/end
+            varX = sumXX - sumX**2/end
+            varY = sumYY - sumY**2/end
+            corrs[i] = cov / np.sqrt(np.outer(varX, varY))
+    return corrs
+
+def calculateCorrByDur(env1, env2, fs, durs):
+    """
+    Get correlations between env1 and env2 for each trial and a set of
+    durations. This is equivalent to calling `calculateCorr` with `end` for
+    each duration but the data is read only once.
+
+    Parameters
+    ----------
+    env1 : array-type
+        First list of envelope of shape (trial, time).
+    env2 : array-type
+        Second list of envelope of shape (trial, time).
+    fs : float
+        Sampling frequency in Hz.
+    durs : array-type
+        List of durations in seconds.
+
+    Returns:
+
+    corrs : array-type
+        Correlations of shape (duration, trial).
+    """
+    if env1.shape != env2.shape:
+        raise ValueError("Shapes of the envelopes have to be identical\
+ but they are: %s and %s" % (env1.shape, env2.shape))
+    x = env1 - env1.mean(axis=1, keepdims=True)
+    y = env2 - env2.mean(axis=1, keepdims=True)
+    ends = np.clip(np.round(np.asarray(durs, dtype=float)*fs).astype(int), 0, x.shape[1])
+    # Cumulative sums at the end of each duration
+    sums = np.zeros((5, len(ends), x.shape[0]))
+    for k, arr in enumerate([x, y, x*x, y*y, x*y]):
+        cum = np.concatenate([np.zeros((x.shape[0], 1)), np.cumsum(arr, axis=1)], axis=1)
+        sums[k] = cum[:, ends].T
+    sumX, sumY, sumXX, sumYY, sumXY = sums
+    n = ends[:, np.newaxis].astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corrs = ((sumXY - sumX*sumY/n) /
+                 np.sqrt((sumXX - sumX**2/n)*(sumYY - sumY**2/n)))
+    return corrs
+
+def calculateLaggedCorrByDur(env1, env2, fs, maxLag, durs, dtype=np.float64):
+    """
+    Get correlations between env1 and env2 for each trial, each lag between
+    -maxLag and maxLag and a set of durations. This is equivalent to calling
+    `calculateLaggedCorr` with `end` for each duration, but the products of
+    each lag are accumulated once along the time axis for all durations. For
+    a small range of lags, this is cheaper than one FFT by duration.
+
+    Parameters
+    ----------
+    env1 : array-type
+        Candidate envelopes of shape (trial, time) or (candidate, trial, time).
+    env2 : array-type
+        Second list of envelope of shape (trial, time).
+    fs : float
+        Sampling frequency in Hz.
+    maxLag : float
+        Maximum lag in seconds.
+    durs : array-type
+        List of durations in seconds.
+    dtype : numpy.dtype
+        Floating point type used to compute the correlations.
+
+    Returns:
+
+    peakCorrs : array-type
+        Maximum correlation across lags of shape (duration, trial) or
+        (duration, candidate, trial).
+    peakLags : array-type
+        Lag of the maximum correlation in seconds. Same shape as `peakCorrs`.
+    corrs : array-type
+        Correlations for each lag of shape (duration, trial, lag) or
+        (duration, candidate, trial, lag).
+    """
+    if env1.shape[-2:] != env2.shape:
+        raise ValueError("Shapes of the envelopes have to be identical\
+ but they are: %s and %s" % (env1.shape, env2.shape))
+    sampleNum = env2.shape[1]
+    x = np.asarray(env1, dtype=dtype)
+    y = np.asarray(env2, dtype=dtype)
+    x = x - x.mean(axis=-1, keepdims=True)
+    y = y - y.mean(axis=-1, keepdims=True)
+    ends = np.clip(np.round(np.asarray(durs, dtype=float)*fs).astype(int), 0, sampleNum)
+    lagNum = int(np.round(maxLag*fs))
+    lags = np.arange(-lagNum, lagNum + 1)
+
+    def cumsum(arr):
+        zeros = np.zeros(arr.shape[:-1] + (1,), dtype=dtype)
+        return np.concatenate([zeros, np.cumsum(arr, axis=-1)], axis=-1)
+    cumX, cumXX = cumsum(x), cumsum(x*x)
+    cumY, cumYY = cumsum(y), cumsum(y*y)
+
+    corrs = np.zeros(x.shape[:-1] + (len(lags), len(ends)), dtype=dtype)
+    for i, lag in enumerate(lags):
+        # Overlapping samples of x for each duration
+        start = np.minimum(max(-lag, 0), ends)
+        stop = np.clip(ends - lag, 0, ends)
+        # Products x[t]*y[t + lag] for all t
+        prod = np.zeros(x.shape, dtype=dtype)
+        if lag >= 0:
+            prod[..., :sampleNum - lag] = x[..., :sampleNum - lag]*y[:, lag:]
+        else:
+            prod[..., -lag:] = x[..., -lag:]*y[:, :sampleNum + lag]
+        cumXY = cumsum(prod)
+        sumXY = cumXY[..., stop] - cumXY[..., start]
+        sumX = cumX[..., stop] - cumX[..., start]
+        sumXX = cumXX[..., stop] - cumXX[..., start]
+        sumY = cumY[:, stop + lag] - cumY[:, start + lag]
+        sumYY = cumYY[:, stop + lag] - cumYY[:, start + lag]
+        n = (stop - start).astype(dtype)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corrs[..., i, :] = np.where(n >= 2, (sumXY - sumX*sumY/n) /
+                                        np.sqrt((sumXX - sumX**2/n)*(sumYY - sumY**2/n)),
+                                        np.nan)
+    # Durations first like `getCorrMatrixByDur`
+    corrs = np.moveaxis(corrs, -1, 0)
+    peakCorrs, peakLags = getPeakCorr(corrs, lags, fs)
+    return peakCorrs, peakLags, corrs
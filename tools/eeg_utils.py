@@ -1,12 +1,22 @@
 import numpy as np
-import pandas as pd
 from scipy import signal
-from eeg import loadEEG, getEvents, chebyBandpassFilter, refToMastoids,\
-    create3DMatrix, getTrialNumList, refToAverageNP
-from behavior import getBehaviorData
-import h5py
+from profiling import stage
+from lazy import lazyImport, lazyFunction
+from bdf import readEvents, getTriggers
 
-def processEEG(fnEEG, dbName, sessionNums, trialsToRemove, trialBehavior, fs, ref):
+# The `eeg` package (and its dependencies) is imported on first use
+h5py = lazyImport('h5py')
+loadEEG = lazyFunction('eeg', 'loadEEG')
+chebyBandpassFilter = lazyFunction('eeg', 'chebyBandpassFilter')
+getTrialNumList = lazyFunction('eeg', 'getTrialNumList')
+
+# Band edges (stop, pass, pass, stop in Hz) of the filters used for the TRF
+# and the aSSR analyses
+bandsTRF = [0.5, 1, 14.5, 15]
+bandsSSR = [0.5, 1, 100, 101]
+
+def processEEG(fnEEG, dbName, sessionNums, trialsToRemove, trialBehavior, fs, ref,
+               dtype=np.float64):
     """
     Load and process EEG from .bdf file. The data is filtered according to
     `freqFilter`, re-referenced according to the mastoids and downsampled
@@ -26,7 +36,15 @@ def processEEG(fnEEG, dbName, sessionNums, trialsToRemove, trialBehavior, fs, re
         Choose between referencing to mastoids ('mastoids') or to the average
         of all electrodes ('average').
     fs : float
-        Sampling frequency in Hz.
+        Sampling frequency of the recording in Hz (it must be the sampling
+        frequency of the status channel giving the triggers).
+    dtype : numpy.dtype
+        Floating point type used to store the data between the steps of the
+        processing and of the returned arrays. The EEG is loaded and filtered
+        in float64 (`chebyBandpassFilter` computes in float64 whatever the
+        type of its input): `np.float32` halves the memory of the filtered,
+        epoched and returned data but not the peak memory of the loading and
+        filtering.
 
     Returns
     -------
@@ -36,77 +54,152 @@ def processEEG(fnEEG, dbName, sessionNums, trialsToRemove, trialBehavior, fs, re
     if ref != 'average' and ref != 'mastoids':
         raise ValueError('Bad `ref` argument!')
 
-    # Loading
-    raw = loadEEG(fnEEG)
-    print raw.ch_names[:64]
-    data = raw[:, :][0].T
-
-    # Get triggers
-    trigs = getEvents(raw=raw, eventCode=65282, shortest_event=1)
+    # Get triggers from the status channel only, before loading the EEG
+    with stage('events'):
+        events, eventFs = readEvents(fnEEG)
+        # The samples of the triggers are used as indices in the EEG
+        if eventFs != fs:
+            raise ValueError('The status channel is sampled at %g Hz but `fs` is %g Hz'
+                             % (eventFs, fs))
+        trigs = getTriggers(events, eventCode=65282)
     # Some triggers have been sent but the trial not done due to experimental errors
     # Let's remove these trials in the EEG data
     newTrigs = trigs.drop(trigs.index[trialsToRemove]).reset_index(drop=True)
 
+    onsets = newTrigs.iloc[getTrialNumList(trialBehavior), 0].values
+
+    # Loading
+    with stage('load'):
+        raw = loadEEG(fnEEG)
+    # The data is not kept here so it can be freed after the filtering
+    return preprocessEEG(raw[:, :][0].T.astype(dtype, copy=False), raw.ch_names,
+                         onsets, fs, ref, dtype=dtype)
+
+def preprocessEEG(data, chNames, onsets, fs, ref, dtype=np.float64):
+    """
+    Process the continuous EEG once it is loaded (see `processEEG`): filter
+    in the TRF and aSSR bands, re-reference, cut the trials and downsample
+    the TRF data to 64 Hz.
+
+    Parameters
+    ----------
+    data : instance of numpy.array
+        Matrix of shape (time, channel) containing the raw EEG.
+    chNames : array-like
+        Names of the channels (columns of `data`).
+    onsets : array-like
+        Sample of the trigger of each trial to keep.
+    fs : float
+        Sampling frequency in Hz.
+    ref : str
+        Choose between referencing to mastoids ('mastoids') or to the average
+        of all electrodes ('average').
+    dtype : numpy.dtype
+        Floating point type used to store the filtered data and the trials.
+        The filters themselves run in float64 (see `processEEG`).
+
+    Returns
+    -------
+    dataFilt3DTRF64 : instance of numpy.array
+        A matrix of shape (trial, time, electrode) containing the data filtered
+        for the TRF analyses and downsampled to 64 Hz.
+    dataFilt3DSSR : instance of numpy.array
+        A matrix of shape (trial, time, electrode) containing the data filtered
+        for the aSSR analyses.
+    """
     # Filtering
-    zpk, dataFiltTRF = chebyBandpassFilter(data, [0.5, 1, 14.5, 15], gstop=80, gpass=1,
-        fs=fs)
-    zpk, dataFiltSSR = chebyBandpassFilter(data, [0.5, 1, 100, 101], gstop=80, gpass=1,
-        fs=fs)
+    with stage('filter', nbytes=2*data.nbytes):
+        zpk, dataFiltTRF = chebyBandpassFilter(data, bandsTRF, gstop=80, gpass=1,
+            fs=fs)
+        dataFiltTRF = dataFiltTRF.astype(dtype, copy=False)
+        zpk, dataFiltSSR = chebyBandpassFilter(data, bandsSSR, gstop=80, gpass=1,
+            fs=fs)
+        dataFiltSSR = dataFiltSSR.astype(dtype, copy=False)
 
     del data
 
-    if ref=='mastoids':
-        dataFiltTRF = pd.DataFrame(dataFiltTRF, columns=raw.ch_names)
-        dataFiltSSR = pd.DataFrame(dataFiltSSR, columns=raw.ch_names)
-        # Re-referencing
-        dataFiltRefTRF = refToMastoids(dataFiltTRF,
-                                    dataFiltTRF['M1'],
-                                    dataFiltTRF['M2']).iloc[:, :64]
-        del dataFiltTRF
-        # Re-referencing
-        dataFiltRefSSR = refToMastoids(dataFiltSSR,
-                                    dataFiltSSR['M1'],
-                                    dataFiltSSR['M2']).iloc[:, :64]
-        del dataFiltSSR
-    elif ref=='average':
-        # Re-referencing
-        dataFiltRefTRF = refToAverageNP(dataFiltTRF[:, :64])
-        del dataFiltTRF
-        # Re-referencing
-        dataFiltRefSSR = refToAverageNP(dataFiltSSR[:, :64])
-        del dataFiltSSR
-
-        dataFiltRefTRF = pd.DataFrame(dataFiltRefTRF, columns=raw.ch_names[:64])
-        dataFiltRefSSR = pd.DataFrame(dataFiltRefSSR, columns=raw.ch_names[:64])
+    # Re-referencing
+    with stage('rereference', nbytes=dataFiltTRF.nbytes + dataFiltSSR.nbytes):
+        rereference(dataFiltTRF, ref, chNames)
+        rereference(dataFiltSSR, ref, chNames)
 
     trialDur = 60
-    # Changing shape to 3D matrix
-    # Choose the length according to the number of sample in the sound files
-    dataFilt3DTRF = create3DMatrix(data=dataFiltRefTRF, trialTable=trialBehavior,
-                           events=newTrigs, trialList=getTrialNumList(trialBehavior),
-                           trialDur=trialDur, fs=fs, normalize=False, baselineDur=0)
-    del dataFiltRefTRF
-    dataFilt3DSSR = create3DMatrix(data=dataFiltRefSSR, trialTable=trialBehavior,
-                           events=newTrigs, trialList=getTrialNumList(trialBehavior),
-                           trialDur=trialDur, fs=fs, normalize=False, baselineDur=0)
-
-    del dataFiltRefSSR
-
     # Remove the first two seconds to avoid bias since in some trials one
     # stream starts 2 seconds before the other
     start = int(np.round(2*fs))
     # Remove last two seconds that should be less reliable
     end = start + int(np.round((trialDur - 2)*fs))
 
-    dataFilt3DTRF = dataFilt3DTRF[:, start:end, :]
-    dataFilt3DSSR = dataFilt3DSSR[:, start:end, :]
+    # Changing shape to 3D matrix: the same sample indices are used for both
+    # bands and only the trimmed part of each trial is gathered
+    with stage('epoch'):
+        epochIdx = getEpochIndices(onsets, start, end)
+        dataFilt3DTRF = dataFiltTRF[epochIdx, :64]
+        del dataFiltTRF
+        dataFilt3DSSR = dataFiltSSR[epochIdx, :64]
+        del dataFiltSSR
 
     # Downsampling
-    dataFilt3DTRF64 = signal.decimate(dataFilt3DTRF, q=8, axis=1, zero_phase=True)
+    with stage('decimate', nbytes=dataFilt3DTRF.nbytes):
+        dataFilt3DTRF64 = signal.decimate(dataFilt3DTRF, q=8, axis=1, zero_phase=True)
+        dataFilt3DTRF64 = dataFilt3DTRF64.astype(dtype, copy=False)
 
-    return dataFilt3DTRF64, dataFilt3DSSR
+    return dataFilt3DTRF64, dataFilt3DSSR.astype(dtype, copy=False)
 
-def loadDataH5(path, pathReconstructed):
+def rereference(data, ref, chNames):
+    """
+    Re-reference the data in place to the mastoids or to the average of the
+    64 scalp electrodes.
+
+    Parameters
+    ----------
+    data : instance of numpy.array
+        Matrix of shape (time, channel) containing the data. It is modified
+        in place.
+    ref : str
+        Choose between referencing to mastoids ('mastoids') or to the average
+        of all electrodes ('average').
+    chNames : array-like
+        Names of the channels (columns of `data`). Used to find the mastoids.
+
+    Returns
+    -------
+    data : instance of numpy.array
+        The re-referenced matrix (same object as the input).
+    """
+    if ref=='mastoids':
+        picks = [list(chNames).index('M1'), list(chNames).index('M2')]
+    elif ref=='average':
+        picks = slice(0, 64)
+    else:
+        raise ValueError('Bad `ref` argument!')
+    data -= data[:, picks].mean(axis=1, keepdims=True)
+    return data
+
+def getEpochIndices(onsets, start, end):
+    """
+    Get the sample indices of all trials in the continuous data. Indexing a
+    matrix of shape (time, channel) with the result gives a matrix of shape
+    (trial, time, channel) in one step.
+
+    Parameters
+    ----------
+    onsets : array-like
+        Sample of the trigger of each trial.
+    start : int
+        First sample to keep relative to the trigger.
+    end : int
+        Last sample (excluded) to keep relative to the trigger.
+
+    Returns
+    -------
+    epochIdx : instance of numpy.array
+        Matrix of shape (trial, time) containing the sample indices.
+    """
+    onsets = np.asarray(onsets, dtype=np.intp)
+    return onsets[:, np.newaxis] + np.arange(start, end, dtype=np.intp)
+
+def loadDataH5(path, pathReconstructed, dtype=None):
     """
     Load data from .h5 file. This expects to load one file containing the EEG
     and the envelopes of the stimuli and another file the reconstructed
@@ -118,6 +211,9 @@ def loadDataH5(path, pathReconstructed):
         Path to the `.h5` file containing EEG and stimuli envelopes.
     pathReconstructed : str
         Path to the `.h5` file containing the reconstructed envelopes.
+    dtype : numpy.dtype
+        Floating point type of the returned arrays. If None, the type used to
+        store the data in the `.h5` files is kept.
 
     Returns
     -------
@@ -135,15 +231,23 @@ def loadDataH5(path, pathReconstructed):
     eeg_aSSR : instance of numpy.array
         to do.
     """
+    def read(dataset):
+        if dtype is None:
+            return dataset[()]
+        # Read directly in the requested type to avoid a temporary copy
+        arr = np.empty(dataset.shape, dtype=dtype)
+        dataset.read_direct(arr)
+        return arr
+
     f1 = h5py.File(path, 'r')
-    eeg_TRF = np.array(list(f1['eeg_TRF']))
-    eeg_aSSR = np.array(list(f1['eeg_aSSR']))
-    envAttended = np.array(list(f1['envAttended']))
-    envUnattended = np.array(list(f1['envUnattended']))
+    eeg_TRF = read(f1['eeg_TRF'])
+    eeg_aSSR = read(f1['eeg_aSSR'])
+    envAttended = read(f1['envAttended'])
+    envUnattended = read(f1['envUnattended'])
     f1.close()
 
     f2 = h5py.File(pathReconstructed, 'r')
-    envReconstructed = np.array(list(f2['reconstructed']))
+    envReconstructed = read(f2['reconstructed'])
     f2.close()
 
     # Roll trials to create mismatch envelope:
@@ -151,3 +255,33 @@ def loadDataH5(path, pathReconstructed):
 
     return eeg_TRF, envAttended, envMismatch, envUnattended, envReconstructed, eeg_aSSR
 
+
+def saveDataH5(path, eeg_TRF, eeg_aSSR, envAttended, envUnattended, dtype=None):
+    """
+    Save the EEG and the envelopes of the stimuli in a .h5 file that can be
+    read by `loadDataH5` and by Matlab for the TRF analyses.
+
+    Parameters
+    ----------
+    path : str
+        Path to the `.h5` file to create.
+    eeg_TRF : instance of numpy.array
+        A matrix of shape (trial, time, electrode) containing the data processed
+        for the TRF.
+    eeg_aSSR : instance of numpy.array
+        A matrix of shape (trial, time, electrode) containing the data processed
+        for the aSSR.
+    envAttended : instance of numpy.array
+        Attended envelopes. Shape (trial, time).
+    envUnattended : instance of numpy.array
+        Unattended envelopes. Shape (trial, time).
+    dtype : numpy.dtype
+        Floating point type used to store the data. If None, the type of each
+        array is kept.
+    """
+    with h5py.File(path, 'w') as hf:
+        for name, arr in [('eeg_TRF', eeg_TRF), ('eeg_aSSR', eeg_aSSR),
+                          ('envAttended', envAttended),
+                          ('envUnattended', envUnattended)]:
+            hf.create_dataset(name, data=arr,
+                              dtype=arr.dtype if dtype is None else dtype)
@@ -0,0 +1,261 @@
+import numpy as np
+import pandas as pd
+from decodingSSR import getTagEnergies
+from parallel import runTasks
+
+def scoreSubsets(sums, labels, tagFreqs, train, test):
+    """
+    Classify trials from the tag energies summed over subsets of electrodes.
+    The energies of each tag are normalized by their mean over the training
+    trials (to take into account that the response is different for each AM
+    rate, like the baseline of `calculateTagBaseline`) and the tag with the
+    largest normalized energy is chosen. Since the normalization is a ratio,
+    the sums give the same result as the averages over electrodes.
+
+    Parameters
+    ----------
+    sums : instance of numpy.array
+        Energies summed over the electrodes of each subset. Shape (subset,
+        trial, duration, tag).
+    labels : instance of numpy.array
+        Tag frequency of each trial.
+    tagFreqs : array-type
+        Tag frequencies in Hz corresponding to the last axis of `sums`.
+    train : instance of numpy.array
+        Boolean mask of the trials used to normalize the energies.
+    test : instance of numpy.array
+        Boolean mask of the trials to classify.
+
+    Returns
+    -------
+    correct : instance of numpy.array
+        Number of test trials correctly classified. Shape (subset, duration).
+    margin : instance of numpy.array
+        Mean log ratio between the normalized energy of the correct tag and
+        the largest normalized energy of the other tags (used to choose
+        between subsets with the same number of correct trials). Shape
+        (subset, duration).
+    """
+    tagFreqs = np.asarray(tagFreqs, dtype=float)
+    norm = sums[:, train].mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        features = np.log(sums[:, test] / norm)
+    isTrue = labels[test][:, np.newaxis, np.newaxis] == tagFreqs
+    trueFeature = np.where(isTrue, features, -np.inf).max(axis=-1)
+    otherFeature = np.where(isTrue, -np.inf, features).max(axis=-1)
+    predicted = tagFreqs[np.argmax(features, axis=-1)]
+    correct = (predicted == labels[test][:, np.newaxis]).sum(axis=1)
+    margin = (trueFeature - otherFeature).mean(axis=1)
+    return correct, margin
+
+def chooseBest(correct, margin):
+    """
+    Get the index of the subset with the largest number of correct trials
+    (summed over durations), ties being broken by the margin.
+
+    Parameters
+    ----------
+    correct : instance of numpy.array
+        Number of correct trials of shape (subset, duration).
+    margin : instance of numpy.array
+        Margins of shape (subset, duration).
+
+    Returns
+    -------
+    best : int
+        Index of the best subset.
+    """
+    return np.lexsort((np.nan_to_num(margin.mean(axis=1)), correct.sum(axis=1)))[-1]
+
+def getElectrodeOrder(energies, labels, tagFreqs, train, method, maxElectrodes):
+    """
+    Order electrodes from the training trials.
+
+    Parameters
+    ----------
+    energies : instance of numpy.array
+        Energies of shape (trial, duration, electrode, tag).
+    labels : instance of numpy.array
+        Tag frequency of each trial.
+    tagFreqs : array-type
+        Tag frequencies in Hz.
+    train : instance of numpy.array
+        Boolean mask of the training trials.
+    method : str
+        'greedy' for a forward selection (each step adds the electrode
+        giving the best subset with the electrodes already selected) or
+        'ranked' to rank the electrodes by their own score.
+    maxElectrodes : int
+        Number of electrodes to select.
+
+    Returns
+    -------
+    order : instance of numpy.array
+        Selected electrodes in the order of selection.
+    """
+    # Candidates on the first axis: (electrode, trial, duration, tag)
+    candidates = energies.transpose(2, 0, 1, 3)
+    if method == 'ranked':
+        correct, margin = scoreSubsets(candidates, labels, tagFreqs, train, train)
+        order = np.lexsort((np.nan_to_num(margin.mean(axis=1)), correct.sum(axis=1)))[::-1]
+        return order[:maxElectrodes]
+    elif method == 'greedy':
+        order = []
+        remaining = np.arange(energies.shape[2])
+        sums = np.zeros(candidates.shape[1:])
+        for step in range(maxElectrodes):
+            # All candidates added to the current subset at once
+            subsets = sums + candidates[remaining]
+            best = chooseBest(*scoreSubsets(subsets, labels, tagFreqs, train, train))
+            order.append(remaining[best])
+            sums = subsets[best]
+            remaining = np.delete(remaining, best)
+        return np.array(order)
+    else:
+        raise ValueError('Wrong argument `method`!')
+
+def selectElectrodes(energies, labels, tagFreqs, method='greedy', maxElectrodes=None,
+                     foldNum=5):
+    """
+    Get the cross-validated accuracy as a function of the number of
+    electrodes. For each fold, the electrodes are ordered from the training
+    trials (see `getElectrodeOrder`) and the test trials are classified with
+    the first 1 to `maxElectrodes` electrodes. The energies are computed once
+    (see `getTagEnergies`): the energies of a subset are sums of the cached
+    energies of its electrodes.
+
+    Parameters
+    ----------
+    energies : instance of numpy.array
+        Energies of shape (trial, duration, electrode, tag).
+    labels : array-type
+        Tag frequency of each trial. Trials with other labels (for instance
+        NaN) are not used.
+    tagFreqs : array-type
+        Tag frequencies in Hz.
+    method : str
+        'greedy' or 'ranked' (see `getElectrodeOrder`).
+    maxElectrodes : int
+        Maximum number of electrodes. Default to all electrodes.
+    foldNum : int
+        Number of folds (the trials are assigned to the folds alternately so
+        each fold contains all conditions).
+
+    Returns
+    -------
+    accuracy : instance of numpy.array
+        Accuracy over the test trials of all folds. Shape (electrode number,
+        duration): accuracy[k] corresponds to k + 1 electrodes.
+    order : instance of numpy.array
+        Electrodes ordered from all trials (the montage to use).
+    """
+    tagFreqs = np.asarray(tagFreqs, dtype=float)
+    labels = np.asarray(labels, dtype=float)
+    keep = np.isin(labels, tagFreqs)
+    energies = energies[keep]
+    labels = labels[keep]
+    if maxElectrodes is None:
+        maxElectrodes = energies.shape[2]
+
+    folds = np.arange(energies.shape[0]) % foldNum
+    correct = np.zeros((maxElectrodes, energies.shape[1]))
+    for fold in range(foldNum):
+        test = folds == fold
+        train = ~test
+        order = getElectrodeOrder(energies, labels, tagFreqs, train, method, maxElectrodes)
+        # Subsets of the first 1 to maxElectrodes electrodes at once
+        sums = np.cumsum(energies[:, :, order], axis=2).transpose(2, 0, 1, 3)
+        correct += scoreSubsets(sums, labels, tagFreqs, train, test)[0]
+    accuracy = correct / energies.shape[0]
+    order = getElectrodeOrder(energies, labels, tagFreqs, np.ones(len(labels), dtype=bool),
+                              method, maxElectrodes)
+    return accuracy, order
+
+def selectElectrodesParticipant(args):
+    """
+    Run `selectElectrodes` for one participant (possibly in another process).
+
+    Parameters
+    ----------
+    args : tuple
+        (energies, labels, tagFreqs, method, maxElectrodes, foldNum).
+
+    Returns
+    -------
+    accuracy : instance of numpy.array
+        Accuracy of shape (electrode number, duration).
+    order : instance of numpy.array
+        Electrodes ordered from all trials.
+    """
+    return selectElectrodes(*args)
+
+def getAccuracyByElectrodeNum(data, labels, participants, tagFreqs, fs, durs=None,
+                              harmonics=1, method='greedy', maxElectrodes=None, foldNum=5,
+                              nJobs=1, chNames=None):
+    """
+    Get the aSSR accuracy of each participant as a function of the number of
+    electrodes to know how small a montage can be. The tag energies of each
+    trial, electrode and duration are computed once (see `getTagEnergies`)
+    and the subsets are evaluated from sums of these energies. The searches
+    of the participants run in parallel.
+
+    Parameters
+    ----------
+    data : array-type
+        Data of shape (trial, time, electrode).
+    labels : array-type
+        Tag frequency of each trial (see `getTrialLabels`).
+    participants : array-like
+        List of arrays containing the trials of each participant to consider.
+    tagFreqs : array-type
+        Tag frequencies in Hz (for instance [36, 44]).
+    fs : float
+        Sampling frequency in Hz.
+    durs : array-type
+        List of durations in seconds. Default to the whole trials.
+    harmonics : int
+        Number of harmonics to use.
+    method : str
+        'greedy' or 'ranked' (see `getElectrodeOrder`).
+    maxElectrodes : int
+        Maximum number of electrodes. Default to all electrodes.
+    foldNum : int
+        Number of folds of the cross-validation.
+    nJobs : int
+        Number of processes.
+    chNames : array-like
+        Names of the electrodes used in the orders (default to the indices).
+
+    Returns
+    -------
+    results : instance of pandas.core.DataFrame
+        Dataframe containing the accuracy for each participant, number of
+        electrodes and duration.
+    orders : instance of pandas.core.DataFrame
+        Dataframe containing the electrodes selected for each participant in
+        the order of selection (from all trials).
+    """
+    if durs is None:
+        durs = [data.shape[1]/float(fs)]
+    labels = np.asarray(labels, dtype=float)
+    tasks = []
+    for trials in participants:
+        energies = getTagEnergies(data[trials], tagFreqs, fs, durs, harmonics=harmonics)
+        tasks.append((energies, labels[trials], tagFreqs, method, maxElectrodes, foldNum))
+
+    outputs = runTasks(selectElectrodesParticipant, tasks, nJobs)
+
+    results = []
+    orders = []
+    for p, (accuracy, order) in enumerate(outputs):
+        electrodeNums = np.arange(1, accuracy.shape[0] + 1)
+        results.append(pd.DataFrame({'participant': p,
+                                     'electrodeNum': np.repeat(electrodeNums, len(durs)),
+                                     'dur': np.tile(durs, len(electrodeNums)),
+                                     'acc': accuracy.ravel()},
+                                    columns=['participant', 'electrodeNum', 'dur', 'acc']))
+        electrodes = order if chNames is None else np.asarray(chNames)[order]
+        orders.append(pd.DataFrame({'participant': p, 'rank': np.arange(1, len(order) + 1),
+                                    'electrode': electrodes},
+                                   columns=['participant', 'rank', 'electrode']))
+    return pd.concat(results, ignore_index=True), pd.concat(orders, ignore_index=True)
@@ -0,0 +1,247 @@
+import numpy as np
+from lagMatrix import getLags, getLaggedCovariances, getLaggedPrediction
+
+def getStimulusFeatures(envAttended, envUnattended=None, trialsUnattended=None):
+    """
+    Get the stimulus features of the forward model from the envelopes of
+    `loadDataH5`: the attended envelope and the unattended envelope (zero
+    for the trials with only one stream).
+
+    Parameters
+    ----------
+    envAttended : instance of numpy.array
+        Attended envelopes of shape (trial, time).
+    envUnattended : instance of numpy.array
+        Unattended envelopes of shape (trial2, time) or None to use only the
+        attended envelope.
+    trialsUnattended : array-like
+        Trials (in the referential of `envAttended`) corresponding to the rows
+        of `envUnattended`. Default to the last trials (trials 40 to 79 for the
+        dual stream part).
+
+    Returns
+    -------
+    stim : instance of numpy.array
+        Features of shape (trial, time, feature).
+    """
+    if envUnattended is None:
+        return envAttended[:, :, np.newaxis].astype(np.float64)
+    if trialsUnattended is None:
+        trialsUnattended = np.arange(envAttended.shape[0] - envUnattended.shape[0],
+                                     envAttended.shape[0])
+    minLen = np.min([envAttended.shape[1], envUnattended.shape[1]])
+    stim = np.zeros((envAttended.shape[0], minLen, 2))
+    stim[:, :, 0] = envAttended[:, :minLen]
+    stim[trialsUnattended, :, 1] = envUnattended[:, :minLen]
+    return stim
+
+def solveRidge(xtx, xty, lambdas):
+    """
+    Solve the ridge regression (X^T X + lambda I) w = X^T y for all outputs
+    and all regularization parameters with one eigendecomposition of X^T X
+    (or one linear solve if there is only one parameter).
+
+    Parameters
+    ----------
+    xtx : instance of numpy.array
+        X^T X of shape (feature, feature).
+    xty : instance of numpy.array
+        X^T y of shape (feature, output).
+    lambdas : array-like
+        Regularization parameters (applied to X^T X like `mTRFcrossval`).
+
+    Returns
+    -------
+    weights : instance of numpy.array
+        Weights of shape (lambda, feature, output).
+    """
+    lambdas = np.asarray(lambdas, dtype=float)
+    if lambdas.shape[0] == 1:
+        identity = np.eye(xtx.shape[0])
+        return np.linalg.solve(xtx + lambdas[0]*identity, xty)[np.newaxis]
+    eigvals, eigvecs = np.linalg.eigh(xtx)
+    proj = np.dot(eigvecs.T, xty)
+    scale = 1. / (eigvals[np.newaxis, :] + lambdas[:, np.newaxis])
+    # weights[l] = V diag(scale[l]) V^T X^T y
+    return np.einsum('fk,lk,ko->lfo', eigvecs, scale, proj)
+
+def getPredictionCorr(prediction, eeg):
+    """
+    Get the correlation between the predicted and the recorded EEG for each
+    electrode (over all samples of all trials given).
+
+    Parameters
+    ----------
+    prediction : instance of numpy.array
+        Predicted EEG of shape (..., time, electrode) (for instance (lambda,
+        time, electrode)).
+    eeg : instance of numpy.array
+        Recorded EEG of shape (time, electrode).
+
+    Returns
+    -------
+    corrs : instance of numpy.array
+        Correlations of shape (..., electrode).
+    """
+    x = prediction - prediction.mean(axis=-2, keepdims=True)
+    y = eeg - eeg.mean(axis=-2, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (x*y).sum(axis=-2) / np.sqrt((x*x).sum(axis=-2)*(y*y).sum(axis=-2))
+
+def getFolds(trialNum, foldNum=None):
+    """
+    Get the fold of each trial for the cross-validation.
+
+    Parameters
+    ----------
+    trialNum : int
+        Number of trials.
+    foldNum : int
+        Number of folds of consecutive trials. If None, each trial is a fold
+        (leave one trial out like `mTRFcrossval`).
+
+    Returns
+    -------
+    folds : instance of numpy.array
+        Fold of each trial.
+    """
+    if foldNum is None:
+        return np.arange(trialNum)
+    return np.arange(trialNum) * foldNum // trialNum
+
+def crossValForwardTRF(stim, eeg, lags, lambdas, folds=None):
+    """
+    Cross-validate a forward TRF model predicting all electrodes from the
+    stimulus features. The lagged stimulus covariance X^T X is shared by all
+    electrodes: each fold takes one eigendecomposition for all electrodes and
+    regularization parameters. The covariances of each trial are computed
+    once and the training covariances of a fold are obtained by subtracting
+    the covariances of the test trials from the total.
+
+    Each trial of the stimulus and the EEG is centered before fitting (the
+    model has no bias term).
+
+    Parameters
+    ----------
+    stim : instance of numpy.array
+        Stimulus features of shape (trial, time, feature) (see
+        `getStimulusFeatures`).
+    eeg : instance of numpy.array
+        EEG of shape (trial, time, electrode) with the same number of samples.
+    lags : array-like
+        Lags in samples (see `getLags`). Positive lags correspond to the EEG
+        following the stimulus.
+    lambdas : array-like
+        Regularization parameters.
+    folds : array-like
+        Fold of each trial (see `getFolds`). Default to leave one trial out.
+
+    Returns
+    -------
+    corrs : instance of numpy.array
+        Correlations between the predicted and the recorded EEG of the test
+        trials of each fold. Shape (fold, lambda, electrode).
+    """
+    stim = stim - stim.mean(axis=1, keepdims=True)
+    eeg = eeg - eeg.mean(axis=1, keepdims=True)
+    if folds is None:
+        folds = getFolds(stim.shape[0])
+    folds = np.asarray(folds)
+    xtxTrials, xtyTrials = getLaggedCovariances(stim, eeg, lags, perTrial=True)
+    xtx = xtxTrials.sum(axis=0)
+    xty = xtyTrials.sum(axis=0)
+
+    foldNums = np.unique(folds)
+    corrs = np.zeros((len(foldNums), len(lambdas), eeg.shape[2]))
+    for i, fold in enumerate(foldNums):
+        test = folds == fold
+        weights = solveRidge(xtx - xtxTrials[test].sum(axis=0),
+                             xty - xtyTrials[test].sum(axis=0), lambdas)
+        # Predictions of all lambdas at once: (trial, time, lambda*electrode)
+        prediction = getLaggedPrediction(stim[test],
+                                         weights.transpose(1, 0, 2).reshape(
+                                             weights.shape[1], -1), lags)
+        prediction = prediction.reshape(-1, len(lambdas), eeg.shape[2]).transpose(1, 0, 2)
+        corrs[i] = getPredictionCorr(prediction, eeg[test].reshape(-1, eeg.shape[2]))
+    return corrs
+
+def fitForwardTRF(stim, eeg, lags, lambdas):
+    """
+    Fit a forward TRF model on all trials.
+
+    Parameters
+    ----------
+    stim : instance of numpy.array
+        Stimulus features of shape (trial, time, feature).
+    eeg : instance of numpy.array
+        EEG of shape (trial, time, electrode).
+    lags : array-like
+        Lags in samples (see `getLags`).
+    lambdas : array-like
+        Regularization parameters.
+
+    Returns
+    -------
+    weights : instance of numpy.array
+        Weights of shape (lambda, lag, feature, electrode).
+    """
+    stim = stim - stim.mean(axis=1, keepdims=True)
+    eeg = eeg - eeg.mean(axis=1, keepdims=True)
+    xtx, xty = getLaggedCovariances(stim, eeg, lags)
+    weights = solveRidge(xtx, xty, lambdas)
+    return weights.reshape(len(lambdas), len(lags), stim.shape[2], eeg.shape[2])
+
+def getEncodingAccuracyMap(eeg_TRF, envAttended, envUnattended=None, fs=64., tmin=-50,
+                           tmax=300, lambdas=10.**np.arange(-2, 7), foldNum=None):
+    """
+    Get the prediction accuracy of a forward TRF model for each electrode.
+    The regularization parameter maximizing the accuracy averaged across
+    electrodes is selected.
+
+    Parameters
+    ----------
+    eeg_TRF : instance of numpy.array
+        EEG of shape (trial, time, electrode) (like the output of
+        `loadDataH5`).
+    envAttended : instance of numpy.array
+        Attended envelopes of shape (trial, time).
+    envUnattended : instance of numpy.array
+        Unattended envelopes of the dual stream trials of shape (trial2, time)
+        or None to predict from the attended envelope only.
+    fs : float
+        Sampling frequency in Hz.
+    tmin : float
+        Minimum lag in ms.
+    tmax : float
+        Maximum lag in ms.
+    lambdas : array-like
+        Regularization parameters.
+    foldNum : int
+        Number of folds. If None, leave one trial out.
+
+    Returns
+    -------
+    accuracyMap : instance of numpy.array
+        Correlation between the predicted and the recorded EEG averaged
+        across folds for each electrode. Shape (electrode,).
+    bestLambda : float
+        Selected regularization parameter.
+    weights : instance of numpy.array
+        Weights fitted on all trials with `bestLambda`. Shape (lag, feature,
+        electrode).
+    corrs : instance of numpy.array
+        Correlations for all folds and regularization parameters. Shape
+        (fold, lambda, electrode).
+    """
+    stim = getStimulusFeatures(envAttended, envUnattended)
+    minLen = np.min([stim.shape[1], eeg_TRF.shape[1]])
+    stim = stim[:, :minLen]
+    eeg = eeg_TRF[:, :minLen]
+    lags = getLags(tmin, tmax, fs)
+
+    corrs = crossValForwardTRF(stim, eeg, lags, lambdas,
+                               folds=getFolds(eeg.shape[0], foldNum))
+    meanCorrs = np.nanmean(corrs, axis=0)
+    best = np.nanargmax(meanCorrs.mean(axis=1))
+    weights = fitForwardTRF(stim, eeg, lags, [lambdas[best]])[0]
+    return meanCorrs[best], lambdas[best], weights, corrs
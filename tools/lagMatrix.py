@@ -0,0 +1,233 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+def getLags(tmin, tmax, fs):
+    """
+    Get the lags in samples corresponding to a time window in ms (like `tmin`
+    and `tmax` in `analyses_TRF.m`).
+
+    Parameters
+    ----------
+    tmin : float
+        Minimum lag in ms.
+    tmax : float
+        Maximum lag in ms.
+    fs : float
+        Sampling frequency in Hz.
+
+    Returns
+    -------
+    lags : instance of numpy.array
+        Lags in samples.
+    """
+    return np.arange(int(np.floor(tmin*fs/1000.)), int(np.ceil(tmax*fs/1000.)) + 1)
+
+def getLagStep(lags):
+    """
+    Get the step between consecutive lags. The lags have to be evenly spaced
+    (like the output of `getLags`) to be represented by strides.
+
+    Parameters
+    ----------
+    lags : array-like
+        Lags in samples.
+
+    Returns
+    -------
+    step : int
+        Step between lags (0 if there is only one lag).
+    """
+    lags = np.asarray(lags)
+    if lags.ndim != 1 or lags.shape[0] == 0:
+        raise ValueError('`lags` must be a non-empty 1D array')
+    if lags.shape[0] == 1:
+        return 0
+    steps = np.diff(lags)
+    if np.any(steps != steps[0]) or steps[0] == 0:
+        raise ValueError('`lags` must be evenly spaced')
+    return int(steps[0])
+
+def lagView(x, lags, dtype=None):
+    """
+    Get the time-lagged version of a signal as a read-only view. The signal is
+    copied once in a buffer padded with zeros and the lags are strides on
+    this buffer: the lagged matrix takes the memory of the signal instead of
+    the memory of the signal times the number of lags. Lags are applied
+    separately for each trial (the padding prevents a trial to be lagged into
+    another one).
+
+    Like `lagGen` in the mTRF toolbox, the value at time t and lag l is the
+    signal at time t - lags[l]: positive lags look at the past of the signal
+    (forward model where the EEG follows the stimulus). Use the opposite lags
+    for a backward model (the envelope at time t is reconstructed from the
+    EEG at times t + lag).
+
+    Parameters
+    ----------
+    x : instance of numpy.array
+        Signal of shape (time,), (time, channel) or (trial, time, channel).
+    lags : array-like
+        Evenly spaced lags in samples (see `getLags`).
+    dtype : numpy.dtype
+        Floating point type of the buffer. If None, the type of `x` is kept.
+
+    Returns
+    -------
+    lagged : instance of numpy.array
+        Read-only view of shape (time, lag), (time, lag, channel) or (trial,
+        time, lag, channel). Reshaping it to a 2D design matrix makes a copy:
+        use it by blocks of time (see `getLaggedCovariances`).
+    """
+    lags = np.asarray(lags)
+    step = getLagStep(lags)
+    x = np.asarray(x)
+    squeeze = x.ndim == 1
+    if squeeze:
+        x = x[:, np.newaxis]
+    if x.ndim not in (2, 3):
+        raise ValueError('`x` must have 1, 2 or 3 dimensions')
+    if dtype is None:
+        dtype = x.dtype
+    sampleNum = x.shape[-2]
+    padBefore = max(int(lags.max()), 0)
+    padAfter = max(-int(lags.min()), 0)
+
+    buffer = np.zeros(x.shape[:-2] + (padBefore + sampleNum + padAfter, x.shape[-1]),
+                      dtype=dtype)
+    buffer[..., padBefore:padBefore + sampleNum, :] = x
+    # The first element of the view is the signal at time -lags[0]
+    start = buffer[..., padBefore - int(lags[0]):, :]
+    rowStride, colStride = buffer.strides[-2:]
+    lagged = as_strided(start, shape=x.shape[:-2] + (sampleNum, lags.shape[0], x.shape[-1]),
+                        strides=buffer.strides[:-2] + (rowStride, -step*rowStride, colStride),
+                        writeable=False)
+    if squeeze:
+        lagged = lagged[..., 0]
+    return lagged
+
+def asTrials(x):
+    """
+    Get a signal with the shape (trial, time, channel).
+
+    Parameters
+    ----------
+    x : instance of numpy.array
+        Signal of shape (time,), (time, channel) or (trial, time, channel).
+
+    Returns
+    -------
+    x3D : instance of numpy.array
+        View of shape (trial, time, channel).
+    """
+    x = np.asarray(x)
+    if x.ndim == 1:
+        return x[np.newaxis, :, np.newaxis]
+    if x.ndim == 2:
+        return x[np.newaxis]
+    if x.ndim == 3:
+        return x
+    raise ValueError('The signals must have 1, 2 or 3 dimensions')
+
+def getLaggedCovariances(x, y, lags, blockSize=1024, perTrial=False, dtype=np.float64):
+    """
+    Compute X^T X and X^T y where X is the time-lagged version of `x` (see
+    `lagView`) without building X: the products are accumulated over blocks
+    of `blockSize` samples so only one block of the lagged matrix is in
+    memory. For 80 trials of 58 s at 64 Hz, 64 electrodes and the 25 lags
+    between -50 and 300 ms, X would take 3.8 GB in float64 while a block of
+    1024 samples takes 13 MB.
+
+    Parameters
+    ----------
+    x : instance of numpy.array
+        Signal to lag of shape (time,), (time, channel) or (trial, time,
+        channel).
+    y : instance of numpy.array
+        Target of shape (time,), (time, output) or (trial, time, output) with
+        the same number of trials and samples as `x`.
+    lags : array-like
+        Evenly spaced lags in samples (see `getLags`).
+    blockSize : int
+        Number of samples in each block.
+    perTrial : bool
+        If True, the products are returned for each trial (for instance to
+        leave one trial out by subtraction). This takes one X^T X matrix per
+        trial (1.6 GB for 80 trials of 64 electrodes and 25 lags).
+    dtype : numpy.dtype
+        Floating point type of the products.
+
+    Returns
+    -------
+    xtx : instance of numpy.array
+        X^T X of shape (lag*channel, lag*channel), or (trial, lag*channel,
+        lag*channel) if `perTrial` is True. The features are ordered by lag
+        then channel.
+    xty : instance of numpy.array
+        X^T y of shape (lag*channel, output), or (trial, lag*channel, output)
+        if `perTrial` is True.
+    """
+    x = asTrials(x)
+    y = asTrials(y)
+    if x.shape[:2] != y.shape[:2]:
+        raise ValueError('`x` and `y` must have the same number of trials and samples')
+    lagged = lagView(x, lags, dtype=dtype)
+    trialNum, sampleNum, lagNum, channelNum = lagged.shape
+    featureNum = lagNum*channelNum
+
+    # Without `perTrial`, all trials are accumulated in the same matrices
+    outNum = trialNum if perTrial else 1
+    xtx = np.zeros((outNum, featureNum, featureNum), dtype=dtype)
+    xty = np.zeros((outNum, featureNum, y.shape[2]), dtype=dtype)
+    for trial in range(trialNum):
+        out = trial if perTrial else 0
+        for start in range(0, sampleNum, blockSize):
+            stop = min(start + blockSize, sampleNum)
+            block = lagged[trial, start:stop].reshape(stop - start, featureNum)
+            xtx[out] += np.dot(block.T, block)
+            xty[out] += np.dot(block.T, y[trial, start:stop].astype(dtype, copy=False))
+    if perTrial:
+        return xtx, xty
+    return xtx[0], xty[0]
+
+def getLaggedPrediction(x, weights, lags, blockSize=1024, dtype=np.float64):
+    """
+    Compute Xw where X is the time-lagged version of `x` (see `lagView`)
+    without building X.
+
+    Parameters
+    ----------
+    x : instance of numpy.array
+        Signal to lag of shape (time,), (time, channel) or (trial, time,
+        channel).
+    weights : instance of numpy.array
+        Weights of shape (lag*channel,) or (lag*channel, output) ordered like
+        the features of `getLaggedCovariances`.
+    lags : array-like
+        Evenly spaced lags in samples (see `getLags`).
+    blockSize : int
+        Number of samples in each block.
+    dtype : numpy.dtype
+        Floating point type of the prediction.
+
+    Returns
+    -------
+    prediction : instance of numpy.array
+        Prediction of shape (trial, time, output), or (trial, time) if
+        `weights` is 1D.
+    """
+    squeeze = np.ndim(weights) == 1
+    weights = np.asarray(weights, dtype=dtype).reshape(np.shape(weights)[0], -1)
+    lagged = lagView(asTrials(x), lags, dtype=dtype)
+    trialNum, sampleNum, lagNum, channelNum = lagged.shape
+    if weights.shape[0] != lagNum*channelNum:
+        raise ValueError('`weights` must have one row per lag and channel')
+
+    prediction = np.zeros((trialNum, sampleNum, weights.shape[1]), dtype=dtype)
+    for trial in range(trialNum):
+        for start in range(0, sampleNum, blockSize):
+            stop = min(start + blockSize, sampleNum)
+            block = lagged[trial, start:stop].reshape(stop - start, lagNum*channelNum)
+            prediction[trial, start:stop] = np.dot(block, weights)
+    if squeeze:
+        prediction = prediction[..., 0]
+    return prediction
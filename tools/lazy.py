@@ -0,0 +1,88 @@
+class LazyModule(object):
+    """
+    Module imported the first time one of its attributes is used. This
+    avoids paying the import of optional dependencies (couchdb, IPython,
+    matplotlib, sklearn...) in processes that only use the numerical
+    functions.
+
+    Parameters
+    ----------
+    name : str
+        Name of the module (for instance 'matplotlib.pyplot').
+    globals : dict
+        Globals of the importing module (`globals()`) so the name is resolved
+        like an import statement in this module (relative imports inside
+        `tools`). If None, the import is absolute.
+    """
+    def __init__(self, name, globals=None):
+        self.__dict__['name'] = name
+        self.__dict__['globals'] = globals
+        self.__dict__['module'] = None
+
+    def load(self):
+        """
+        Import the module if it is not imported yet.
+
+        Returns
+        -------
+        module : module
+            The imported module.
+        """
+        if self.module is None:
+            # A non-empty fromlist returns the last module of a dotted name
+            # and level -1 resolves the name like an import statement
+            self.__dict__['module'] = __import__(self.name, self.globals, {},
+                                                 ['__name__'], -1)
+        return self.module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.module is not None else 'not loaded'
+        return '<lazy module %s (%s)>' % (self.name, state)
+
+def lazyImport(name, globals=None):
+    """
+    Get a module that will be imported on first use (see `LazyModule`).
+
+    Parameters
+    ----------
+    name : str
+        Name of the module.
+    globals : dict
+        Globals of the importing module to resolve relative imports.
+
+    Returns
+    -------
+    module : instance of LazyModule
+        Proxy of the module.
+    """
+    return LazyModule(name, globals)
+
+def lazyFunction(name, funcName, globals=None):
+    """
+    Get a function of a module that will be imported on its first call. This
+    replaces `from name import funcName` without changing the calls.
+
+    Parameters
+    ----------
+    name : str
+        Name of the module.
+    funcName : str
+        Name of the function in the module.
+    globals : dict
+        Globals of the importing module to resolve relative imports.
+
+    Returns
+    -------
+    func : callable
+        Function importing the module and calling `funcName`.
+    """
+    module = LazyModule(name, globals)
+
+    def func(*args, **kwargs):
+        return getattr(module, funcName)(*args, **kwargs)
+    func.__name__ = funcName
+    func.__doc__ = 'Lazy version of `%s.%s`.' % (name, funcName)
+    return func
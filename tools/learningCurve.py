@@ -0,0 +1,290 @@
+import numpy as np
+import pandas as pd
+from lazy import lazyImport
+from decodingSSR import getTagEnergies
+from decodingTRF import calculateCorrByDur
+from lagMatrix import getLags, getLaggedCovariances, getLaggedPrediction
+from encodingTRF import solveRidge
+from parallel import runTasks
+
+svm = lazyImport('sklearn.svm')
+
+def getNestedSubsets(labels, sizes, repNum, testSize=0.3, seed=0):
+    """
+    Draw the test trials and the nested training subsets of each repetition.
+    The training trials of a repetition are ordered so the first n trials are
+    the subset of size n: each subset contains the smaller ones. The trials
+    of each label are interleaved so all subsets are balanced.
+
+    Parameters
+    ----------
+    labels : array-like
+        Label (condition) of each trial.
+    sizes : array-like
+        Sizes of the training subsets.
+    repNum : int
+        Number of repetitions.
+    testSize : float
+        Proportion of trials of each label kept for the test.
+    seed : int
+        Seed of the random generator.
+
+    Returns
+    -------
+    orders : instance of numpy.array
+        Training trials of shape (repetition, max(sizes)).
+    tests : instance of numpy.array
+        Test trials of shape (repetition, test trial).
+    """
+    labels = np.asarray(labels)
+    rng = np.random.RandomState(seed)
+    values = np.unique(labels)
+    orders = []
+    tests = []
+    for rep in range(repNum):
+        test = []
+        train = []
+        for value in values:
+            trials = rng.permutation(np.where(labels == value)[0])
+            testNum = int(np.round(testSize*len(trials)))
+            test.append(trials[:testNum])
+            train.append(trials[testNum:])
+        # Interleave the labels: the first trials of each label, then the
+        # second ones...
+        trainNum = min(len(trials) for trials in train)
+        orders.append(np.array([trials[:trainNum] for trials in train]).T.ravel())
+        tests.append(np.sort(np.concatenate(test)))
+    orders = np.array(orders)
+    if max(sizes) > orders.shape[1]:
+        raise ValueError('The largest subset can only contain %d trials' % orders.shape[1])
+    return orders[:, :max(sizes)], np.array(tests)
+
+def getSSRCurveChunk(args):
+    """
+    Compute the SVM accuracies of one repetition of the aSSR learning curve
+    (possibly in another process).
+
+    Parameters
+    ----------
+    args : tuple
+        (features, labels, order, test, sizes, c) where `features` are the log
+        energies of shape (trial, duration, tag).
+
+    Returns
+    -------
+    accuracy : instance of numpy.array
+        Accuracy of shape (size, duration).
+    """
+    features, labels, order, test, sizes, c = args
+    accuracy = np.zeros((len(sizes), features.shape[1]))
+    for i, size in enumerate(sizes):
+        train = order[:size]
+        for dur in range(features.shape[1]):
+            clf = svm.SVC(kernel='rbf', C=c).fit(features[train, dur], labels[train])
+            accuracy[i, dur] = clf.score(features[test, dur], labels[test])
+    return accuracy
+
+def getSSRLearningCurve(data, labels, tagFreqs, fs, sizes, durs=None, repNum=10,
+                        testSize=0.3, method='max', c=1., harmonics=1, seed=0, nJobs=1):
+    """
+    Get the aSSR accuracy as a function of the number of training trials.
+    The tag energies of each trial and duration (averaged over electrodes
+    like `crossVal`) are computed once (see `getTagEnergies`) and each
+    repetition draws nested training subsets and a fixed set of test trials
+    (see `getNestedSubsets`).
+
+    With the method 'max', the energies of each tag are normalized by their
+    mean over the training trials (the baseline) and the tag with the
+    largest normalized energy is chosen. The baselines of all subsets are the
+    cumulative sums of the energies along the training order: all sizes and
+    repetitions are evaluated at once. With the method 'svm' (like
+    `hyperOptC`), a SVM is trained on the log energies of each subset and the
+    repetitions run in parallel.
+
+    Parameters
+    ----------
+    data : array-type
+        Data of shape (trial, time, electrode).
+    labels : array-type
+        Tag frequency of each trial (see `getTrialLabels`). Trials with other
+        labels are not used.
+    tagFreqs : array-type
+        Tag frequencies in Hz.
+    fs : float
+        Sampling frequency in Hz.
+    sizes : array-like
+        Numbers of training trials (at least the number of labels with the
+        method 'svm').
+    durs : array-type
+        List of durations in seconds. Default to the whole trials.
+    repNum : int
+        Number of repetitions.
+    testSize : float
+        Proportion of trials kept for the test.
+    method : str
+        'max' or 'svm'.
+    c : float
+        C parameter of the SVM.
+    harmonics : int
+        Number of harmonics to use.
+    seed : int
+        Seed of the random generator.
+    nJobs : int
+        Number of processes (method 'svm').
+
+    Returns
+    -------
+    results : instance of pandas.core.DataFrame
+        Dataframe containing the accuracy for each training size, repetition
+        and duration.
+    """
+    if durs is None:
+        durs = [data.shape[1]/float(fs)]
+    tagFreqs = np.asarray(tagFreqs, dtype=float)
+    labels = np.asarray(labels, dtype=float)
+    keep = np.where(np.isin(labels, tagFreqs))[0]
+    labels = labels[keep]
+    sizes = np.sort(np.asarray(sizes))
+    # Energies averaged over electrodes: (trial, duration, tag)
+    features = getTagEnergies(data[keep], tagFreqs, fs, durs, harmonics=harmonics).mean(axis=2)
+    orders, tests = getNestedSubsets(labels, sizes, repNum, testSize=testSize, seed=seed)
+
+    if method == 'max':
+        # Baselines of all subsets: (repetition, size, duration, tag)
+        cumFeatures = np.cumsum(features[orders], axis=1)
+        baselines = cumFeatures[:, sizes - 1] / sizes[:, np.newaxis, np.newaxis]
+        # Normalized test energies: (repetition, size, test, duration, tag)
+        normalized = features[tests][:, np.newaxis] / baselines[:, :, np.newaxis]
+        predicted = tagFreqs[np.argmax(normalized, axis=-1)]
+        accuracy = (predicted == labels[tests][:, np.newaxis, :, np.newaxis]).mean(axis=2)
+    elif method == 'svm':
+        # The interleaved subsets contain all labels from this size
+        if sizes[0] < len(np.unique(labels)):
+            raise ValueError('The SVM needs at least %d training trials (one per label)'
+                             % len(np.unique(labels)))
+        tasks = [(np.log(features), labels, orders[rep], tests[rep], sizes, c)
+                 for rep in range(repNum)]
+        accuracy = np.array(runTasks(getSSRCurveChunk, tasks, nJobs))
+    else:
+        raise ValueError('Wrong argument `method`!')
+
+    rep, size, dur = np.meshgrid(np.arange(repNum), sizes, durs, indexing='ij')
+    return pd.DataFrame({'size': size.ravel(), 'rep': rep.ravel(), 'dur': dur.ravel(),
+                         'acc': accuracy.ravel()}, columns=['size', 'rep', 'dur', 'acc'])
+
+def getTRFLearningCurve(eeg_TRF, envAttended, envMismatch, sizes, fs=64., tmin=-50,
+                        tmax=300, lambdas=(1e-8,), durs=None, repNum=10, testSize=0.3,
+                        seed=0, dtype=np.float64):
+    """
+    Get the TRF accuracy (attended versus mismatch envelope like
+    `getTRFAccuracyByDur`) as a function of the number of training trials.
+    A backward model (reconstructing the envelope from the EEG at lags tmin
+    to tmax like `analyses_TRF.m`) is trained on nested subsets of trials and
+    tested on a fixed set of trials for each repetition.
+
+    The lagged EEG covariances of each trial are computed once (see
+    `getLaggedCovariances`) and the covariances of the subsets are
+    accumulated as the subsets grow: a repetition only takes one ridge solve
+    per size. The reconstructions of all sizes and regularization parameters
+    are computed at once. The covariances of all trials are kept in memory
+    (1.6 GB in float64 for 80 trials of 64 electrodes and 25 lags: use
+    `dtype=np.float32` to halve it).
+
+    Parameters
+    ----------
+    eeg_TRF : instance of numpy.array
+        EEG of shape (trial, time, electrode).
+    envAttended : instance of numpy.array
+        Attended envelopes of shape (trial, time).
+    envMismatch : instance of numpy.array
+        Mismatch envelopes of shape (trial, time).
+    sizes : array-like
+        Numbers of training trials.
+    fs : float
+        Sampling frequency in Hz.
+    tmin : float
+        Minimum lag in ms.
+    tmax : float
+        Maximum lag in ms.
+    lambdas : array-like
+        Regularization parameters.
+    durs : array-type
+        List of durations in seconds used for the test correlations. Default
+        to the whole trials.
+    repNum : int
+        Number of repetitions.
+    testSize : float
+        Proportion of trials kept for the test.
+    seed : int
+        Seed of the random generator.
+    dtype : numpy.dtype
+        Floating point type of the covariances.
+
+    Returns
+    -------
+    results : instance of pandas.core.DataFrame
+        Dataframe containing the accuracy for each training size, repetition,
+        regularization parameter and duration.
+    """
+    minLen = np.min([eeg_TRF.shape[1], envAttended.shape[1], envMismatch.shape[1]])
+    eeg = eeg_TRF[:, :minLen] - eeg_TRF[:, :minLen].mean(axis=1, keepdims=True)
+    env = envAttended[:, :minLen] - envAttended[:, :minLen].mean(axis=1, keepdims=True)
+    if durs is None:
+        durs = [minLen/float(fs)]
+    # Backward model: the envelope at time t from the EEG at t + lag
+    lags = -getLags(tmin, tmax, fs)[::-1]
+    sizes = np.sort(np.asarray(sizes))
+    xtxTrials, xtyTrials = getLaggedCovariances(eeg, env[..., np.newaxis], lags,
+                                                perTrial=True, dtype=dtype)
+    orders, tests = getNestedSubsets(np.zeros(eeg.shape[0]), sizes, repNum,
+                                     testSize=testSize, seed=seed)
+
+    accuracy = np.zeros((repNum, len(sizes), len(lambdas), len(durs)))
+    for rep in range(repNum):
+        xtx = np.zeros(xtxTrials.shape[1:])
+        xty = np.zeros(xtyTrials.shape[1:])
+        last = 0
+        weights = []
+        for size in sizes:
+            # Only the new trials are added to the covariances
+            xtx += xtxTrials[orders[rep, last:size]].sum(axis=0)
+            xty += xtyTrials[orders[rep, last:size]].sum(axis=0)
+            last = size
+            weights.append(solveRidge(xtx, xty, lambdas)[..., 0])
+        # Reconstructions of all sizes and lambdas: (trial, time, size*lambda)
+        weights = np.concatenate(weights, axis=0).T
+        test = tests[rep]
+        reconstructed = getLaggedPrediction(eeg[test], weights, lags)
+        for k in range(weights.shape[1]):
+            isBetter = (calculateCorrByDur(reconstructed[..., k], envAttended[test, :minLen],
+                                           fs, durs) >
+                        calculateCorrByDur(reconstructed[..., k], envMismatch[test, :minLen],
+                                           fs, durs))
+            accuracy[rep, k//len(lambdas), k % len(lambdas)] = isBetter.mean(axis=1)
+
+    rep, size, lambdaVal, dur = np.meshgrid(np.arange(repNum), sizes, lambdas, durs,
+                                            indexing='ij')
+    return pd.DataFrame({'size': size.ravel(), 'rep': rep.ravel(),
+                         'lambda': lambdaVal.ravel(), 'dur': dur.ravel(),
+                         'acc': accuracy.ravel()},
+                        columns=['size', 'rep', 'lambda', 'dur', 'acc'])
+
+def summarizeLearningCurve(results):
+    """
+    Average the accuracies of the repetitions of a learning curve.
+
+    Parameters
+    ----------
+    results : instance of pandas.core.DataFrame
+        Dataframe returned by `getSSRLearningCurve` or `getTRFLearningCurve`.
+
+    Returns
+    -------
+    summary : instance of pandas.core.DataFrame
+        Dataframe containing the mean and the standard deviation of the
+        accuracy across repetitions for each size (and duration and
+        regularization parameter).
+    """
+    keys = [key for key in ['size', 'lambda', 'dur'] if key in results]
+    summary = results.groupby(keys).acc.agg(['mean', 'std']).reset_index()
+    return summary.rename(columns={'mean': 'acc', 'std': 'accStd'})
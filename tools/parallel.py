@@ -0,0 +1,30 @@
+import multiprocessing
+
+def runTasks(func, tasks, nJobs):
+    """
+    Call a function on a list of tasks, in a pool of processes if `nJobs` is
+    larger than 1.
+
+    Parameters
+    ----------
+    func : callable
+        Function called with each task (it must be picklable to run in other
+        processes).
+    tasks : array-like
+        Argument of each call.
+    nJobs : int
+        Number of processes.
+
+    Returns
+    -------
+    results : list
+        Results of each task in the order of `tasks`.
+    """
+    if nJobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(processes=min(nJobs, len(tasks)))
+        try:
+            return pool.map(func, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    return [func(task) for task in tasks]
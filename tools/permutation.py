@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+from decodingTRF import getCorrMatrixByDur
+from parallel import runTasks
+
+def getNullAccuracies(args):
+    """
+    Compute the classification accuracies for a chunk of random trial
+    permutations. Used by `permutationTestTRF` (possibly in another process).
+
+    Parameters
+    ----------
+    args : tuple
+        (isBetter, nPerm, seed) where `isBetter` is a boolean array of shape
+        (duration, trial, trial) with isBetter[d, i, j] True if the
+        reconstruction of trial i is more correlated with the target envelope
+        of trial j than with its comparison envelope. `nPerm` is the number of
+        permutations of the chunk and `seed` the seed of the random generator.
+
+    Returns
+    -------
+    nullAcc : instance of numpy.array
+        Accuracies of shape (duration, nPerm).
+    """
+    isBetter, nPerm, seed = args
+    trialNum = isBetter.shape[1]
+    rng = np.random.RandomState(seed)
+    # One permutation of the trials per row
+    perms = np.argsort(rng.rand(nPerm, trialNum), axis=1)
+    rows = np.arange(trialNum)
+    # Pair the reconstruction of each trial with the envelopes of another trial
+    nullAcc = isBetter[:, rows, perms].mean(axis=2)
+    return nullAcc
+
+def permutationTestTRF(envReconstructed, envTarget, envCompare, fs=64, durs=None,
+                       nPerm=1000, seed=0, nJobs=1, chunkSize=1000,
+                       percentiles=(5, 50, 95)):
+    """
+    Permutation test of the classification accuracy of the TRF decoding for
+    each duration. The accuracy is the proportion of trials where the
+    reconstructed envelope is more correlated with the target envelope than
+    with the comparison envelope. The null distribution is obtained by pairing
+    the reconstructed envelopes with the envelopes of shuffled trials.
+
+    The correlations between all reconstructed and all candidate envelopes are
+    computed once for each duration (see `getCorrMatrixByDur`) so each
+    permutation is only an indexing of these matrices.
+
+    Parameters
+    ----------
+    envReconstructed : instance of numpy.array
+        Reconstructed envelopes. Shape (trial, time).
+    envTarget : instance of numpy.array
+        Target envelopes (for instance attended) of the same trials. Shape
+        (trial, time).
+    envCompare : instance of numpy.array
+        Comparison envelopes (for instance mismatch or unattended) of the same
+        trials. Shape (trial, time).
+    fs : float
+        Sampling frequency in Hz.
+    durs : array-type
+        List of durations in seconds. Default to 1 to 60 s.
+    nPerm : int
+        Number of permutations.
+    seed : int
+        Seed of the random generator. The results do not depend on `nJobs`.
+    nJobs : int
+        Number of processes used to compute the permutations.
+    chunkSize : int
+        Number of permutations computed at once.
+    percentiles : array-type
+        Percentiles of the null distribution to return.
+
+    Returns
+    -------
+    results : instance of pandas.core.DataFrame
+        Dataframe containing for each duration the accuracy (`acc`), the
+        p-value (`pValue`) and the requested percentiles of the null
+        distribution (`null5`, `null50`...).
+    nullAcc : instance of numpy.array
+        Null accuracies of shape (duration, nPerm).
+    """
+    if durs is None:
+        durs = np.arange(1, 61)
+    corrsTarget = getCorrMatrixByDur(envReconstructed, envTarget, fs, durs)
+    corrsCompare = getCorrMatrixByDur(envReconstructed, envCompare, fs, durs)
+    isBetter = corrsTarget > corrsCompare
+    del corrsTarget, corrsCompare
+
+    acc = np.diagonal(isBetter, axis1=1, axis2=2).mean(axis=1)
+
+    # The seed of each chunk is drawn from the main seed so the permutations
+    # are the same whatever the number of processes
+    chunks = [chunkSize]*(nPerm//chunkSize)
+    if nPerm % chunkSize:
+        chunks.append(nPerm % chunkSize)
+    seeds = np.random.RandomState(seed).randint(2**31 - 1, size=len(chunks))
+    tasks = [(isBetter, n, s) for n, s in zip(chunks, seeds)]
+    nullAcc = np.concatenate(runTasks(getNullAccuracies, tasks, nJobs), axis=1)
+
+    # The observed accuracy is counted in the null distribution
+    pValue = ((nullAcc >= acc[:, np.newaxis]).sum(axis=1) + 1.) / (nPerm + 1.)
+    results = pd.DataFrame({'dur': durs, 'acc': acc, 'pValue': pValue},
+                           columns=['dur', 'acc', 'pValue'])
+    for q in percentiles:
+        results['null%g' % q] = np.percentile(nullAcc, q, axis=1)
+    return results, nullAcc
+
+def permutationTestTRFByDur(envAttended, envUnattended, envMismatch, envReconstructed,
+                            trials, trialsDualStream, fs=64, durs=None, nPerm=1000,
+                            seed=0, nJobs=1):
+    """
+    Permutation tests of the accuracies returned by `getTRFAccuracyByDur`.
+
+    Parameters
+    ----------
+    envAttended : instance of numpy.array
+        Attended envelopes. Shape (trial, time).
+    envUnattended : instance of numpy.array
+        Unattended envelopes. Shape (trial, time).
+    envMismatch : instance of numpy.array
+        Mismatch envelopes (corresponding to another trial). Shape (trial, time).
+    envReconstructed : instance of numpy.array
+        Reconstructed envelopes. Shape (trial, time).
+    trials : array-type
+        Trials to consider.
+    trialsDualStream : array-like
+        Trials to consider in the exp 2 referential (attended vs unattended with
+        only 40 trials)
+    fs : float
+        Sampling frequency in Hz.
+    durs : array-type
+        List of durations in seconds. Default to 1 to 60 s.
+    nPerm : int
+        Number of permutations.
+    seed : int
+        Seed of the random generator.
+    nJobs : int
+        Number of processes used to compute the permutations.
+
+    Returns
+    -------
+    resultsMismatch : instance of pandas.core.DataFrame
+        Results of `permutationTestTRF` for attended versus mismatch stream.
+    resultsAtt_unatt : instance of pandas.core.DataFrame
+        Results of `permutationTestTRF` for attended versus unattended stream
+        (only trials included in the dual stream part).
+    """
+    resultsMismatch = permutationTestTRF(envReconstructed[trials], envAttended[trials],
+                                         envMismatch[trials], fs=fs, durs=durs,
+                                         nPerm=nPerm, seed=seed, nJobs=nJobs)[0]
+    resultsAtt_unatt = permutationTestTRF(envReconstructed[trialsDualStream],
+                                          envAttended[trialsDualStream],
+                                          envUnattended, fs=fs, durs=durs,
+                                          nPerm=nPerm, seed=seed, nJobs=nJobs)[0]
+    return resultsMismatch, resultsAtt_unatt
@@ -0,0 +1,481 @@
+import os
+import json
+import time
+import subprocess
+import traceback
+import multiprocessing
+import numpy as np
+import pandas as pd
+from lazy import lazyImport, lazyFunction
+
+# The stages import the processing modules on first use so the runner
+# starts quickly
+h5py = lazyImport('h5py')
+behavior = lazyImport('behavior', globals())
+getAttendedAndUnattendedEnv = lazyFunction('audio', 'getAttendedAndUnattendedEnv', globals())
+processEEG = lazyFunction('eeg_utils', 'processEEG', globals())
+saveDataH5 = lazyFunction('eeg_utils', 'saveDataH5', globals())
+loadDataH5 = lazyFunction('eeg_utils', 'loadDataH5', globals())
+getSSRAccuracyByDur = lazyFunction('decodingSSR', 'getSSRAccuracyByDur', globals())
+getTRFAccuracyByDur = lazyFunction('decodingTRF', 'getTRFAccuracyByDur', globals())
+
+# Command running the TRF reconstruction of `analyses_TRF.m` on one file
+matlabCommand = ('matlab -nodisplay -nosplash -r "pathData=\'%(pathData)s\'; '
+                 'pathReconstructed=\'%(pathReconstructed)s\'; '
+                 'run(\'%(script)s\'); exit"')
+
+class Task(object):
+    """
+    Stage of the pipeline for one participant. The task is defined by the
+    function to call and the files it reads and writes: a task depends on the
+    tasks writing its inputs.
+
+    Parameters
+    ----------
+    name : str
+        Unique name of the task (for instance 'processEEG:p1').
+    stage : str
+        Name of the stage (for instance 'processEEG').
+    participant : str
+        Name of the participant.
+    func : callable
+        Module-level function running the task (called in a worker process).
+    args : tuple
+        Arguments of `func`.
+    inputs : array-like
+        Paths of the files read by the task.
+    outputs : array-like
+        Paths of the files written by the task.
+    """
+    def __init__(self, name, stage, participant, func, args, inputs, outputs):
+        self.name = name
+        self.stage = stage
+        self.participant = participant
+        self.func = func
+        self.args = args
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+def isUpToDate(task):
+    """
+    Check if the outputs of a task exist and are more recent than its inputs
+    (like make).
+
+    Parameters
+    ----------
+    task : instance of Task
+        The task.
+
+    Returns
+    -------
+    upToDate : bool
+        True if the task doesn't need to run.
+    """
+    if not all(os.path.exists(path) for path in task.outputs):
+        return False
+    if not all(os.path.exists(path) for path in task.inputs):
+        return False
+    oldestOutput = min(os.path.getmtime(path) for path in task.outputs)
+    newestInput = max([os.path.getmtime(path) for path in task.inputs] or [0])
+    return oldestOutput >= newestInput
+
+def getDependencies(tasks):
+    """
+    Get the dependencies of the tasks from their inputs and outputs.
+
+    Parameters
+    ----------
+    tasks : array-like
+        List of instances of Task.
+
+    Returns
+    -------
+    dependencies : dict
+        Dictionary {task name: set of the names of the tasks it depends on}.
+    """
+    producers = {}
+    for task in tasks:
+        for path in task.outputs:
+            path = os.path.abspath(path)
+            if path in producers:
+                raise ValueError('%s is written by %s and %s' % (path, producers[path],
+                                                                 task.name))
+            producers[path] = task.name
+    dependencies = {}
+    for task in tasks:
+        dependencies[task.name] = set(producers[os.path.abspath(path)]
+                                      for path in task.inputs
+                                      if os.path.abspath(path) in producers)
+    # Check that there is no cycle (the order is not needed here)
+    getTaskOrder(tasks, dependencies)
+    return dependencies
+
+def getTaskOrder(tasks, dependencies):
+    """
+    Sort the tasks so each task comes after its dependencies.
+
+    Parameters
+    ----------
+    tasks : array-like
+        List of instances of Task.
+    dependencies : dict
+        Dependencies returned by `getDependencies`.
+
+    Returns
+    -------
+    order : array-like
+        Names of the tasks.
+    """
+    order = []
+    done = set()
+    remaining = [task.name for task in tasks]
+    while remaining:
+        ready = [name for name in remaining if dependencies[name] <= done]
+        if not ready:
+            raise ValueError('Circular dependencies between %s' % ', '.join(remaining))
+        order.extend(ready)
+        done.update(ready)
+        remaining = [name for name in remaining if name not in done]
+    return order
+
+def runTask(args):
+    """
+    Run one task and measure its duration. If the task fails, its outputs
+    are removed so an incomplete file is not considered up to date.
+
+    Parameters
+    ----------
+    args : tuple
+        (name, func, funcArgs, outputs).
+
+    Returns
+    -------
+    result : dict
+        Name, status ('done' or 'failed'), duration and error of the task.
+    """
+    name, func, funcArgs, outputs = args
+    t0 = time.time()
+    try:
+        for path in outputs:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Created by another worker
+                    pass
+        func(*funcArgs)
+        missing = [path for path in outputs if not os.path.exists(path)]
+        if missing:
+            raise IOError('Outputs not created: %s' % ', '.join(missing))
+        status, error = 'done', None
+    except Exception:
+        status, error = 'failed', traceback.format_exc()
+        for path in outputs:
+            if os.path.exists(path):
+                os.remove(path)
+    return {'task': name, 'status': status, 'duration': time.time() - t0, 'error': error}
+
+def runPipeline(tasks, nJobs=1, force=False, dryRun=False, verbose=True):
+    """
+    Run the tasks in the order of their dependencies. Tasks whose outputs are
+    up to date are skipped and independent tasks (for instance the same stage
+    for different participants) run at the same time.
+
+    Parameters
+    ----------
+    tasks : array-like
+        List of instances of Task.
+    nJobs : int
+        Number of tasks running at the same time.
+    force : bool
+        If True, all tasks are run even if their outputs are up to date.
+    dryRun : bool
+        If True, only print the tasks that would run.
+    verbose : bool
+        If True, print the status of each task.
+
+    Returns
+    -------
+    summary : instance of pandas.core.DataFrame
+        Dataframe containing the stage, participant, status ('done',
+        'skipped', 'failed', 'blocked' when a dependency failed or 'todo' for
+        a dry run), duration and error of each task.
+    """
+    dependencies = getDependencies(tasks)
+    byName = dict((task.name, task) for task in tasks)
+    order = getTaskOrder(tasks, dependencies)
+    results = {}
+
+    def finish(result):
+        results[result['task']] = result
+        if verbose:
+            print '%-30s %-8s %8.1f s' % (result['task'], result['status'], result['duration'])
+            if result.get('error'):
+                print result['error']
+
+    pool = None
+    if nJobs > 1 and not dryRun:
+        pool = multiprocessing.Pool(processes=nJobs, maxtasksperchild=1)
+    running = {}
+    changed = set()
+    try:
+        while len(results) < len(tasks):
+            for name in order:
+                if name in results or name in running:
+                    continue
+                deps = dependencies[name]
+                if any(results.get(dep, {}).get('status') in ('failed', 'blocked')
+                       for dep in deps):
+                    finish({'task': name, 'status': 'blocked', 'duration': 0.,
+                            'error': None})
+                    continue
+                if not all(dep in results for dep in deps):
+                    continue
+                task = byName[name]
+                # In a dry run, the outputs of the tasks that would run are
+                # not updated: their dependents have to run too
+                if not force and not (deps & changed) and isUpToDate(task):
+                    finish({'task': name, 'status': 'skipped', 'duration': 0.,
+                            'error': None})
+                elif dryRun:
+                    changed.add(name)
+                    finish({'task': name, 'status': 'todo', 'duration': 0., 'error': None})
+                else:
+                    changed.add(name)
+                    args = (name, task.func, task.args, task.outputs)
+                    if pool is None:
+                        finish(runTask(args))
+                    else:
+                        running[name] = pool.apply_async(runTask, (args,))
+            for name in [name for name in running if running[name].ready()]:
+                finish(running.pop(name).get())
+            if running:
+                time.sleep(0.05)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    summary = pd.DataFrame([dict(results[name], stage=byName[name].stage,
+                                 participant=byName[name].participant)
+                            for name in order],
+                           columns=['task', 'stage', 'participant', 'status', 'duration',
+                                    'error'])
+    return summary
+
+def getStageSummary(summary):
+    """
+    Summarize the durations of the tasks by stage.
+
+    Parameters
+    ----------
+    summary : instance of pandas.core.DataFrame
+        Dataframe returned by `runPipeline`.
+
+    Returns
+    -------
+    stageSummary : instance of pandas.core.DataFrame
+        Dataframe containing for each stage the number of tasks by status and
+        the total, mean and maximum duration of the tasks that ran.
+    """
+    counts = pd.crosstab(summary.stage, summary.status)
+    ran = summary[summary.status.isin(['done', 'failed'])]
+    durations = ran.groupby('stage').duration.agg(['sum', 'mean', 'max'])
+    durations.columns = ['totalTime', 'meanTime', 'maxTime']
+    stageSummary = counts.join(durations).fillna(0)
+    # Stages in the order of the pipeline
+    return stageSummary.reindex(summary.stage.drop_duplicates().values)
+
+def fetchBehavior(dbName, sessionNums, dbAddress, pathBehavior):
+    """
+    Stage fetching the behavior data of a participant and saving it in
+    columnar form (see `toColumnar`).
+    """
+    trialBehavior = behavior.getBehaviorData(dbName, sessionNums, dbAddress=dbAddress)
+    behavior.saveBehaviorH5(pathBehavior, behavior.toColumnar(trialBehavior))
+
+def loadBehavior(pathBehavior):
+    """
+    Load the behavior data saved by `fetchBehavior` as a dataframe.
+    """
+    return behavior.fromColumnar(behavior.loadBehaviorH5(pathBehavior))
+
+def fetchStimuli(dbAddress, dbName, password, pathEnv):
+    """
+    Stage computing the envelopes of the attended and unattended streams.
+    """
+    envAttended, envUnattended = getAttendedAndUnattendedEnv(dbAddress, dbName, password,
+                                                             verbose=False, fs=48000.)
+    with h5py.File(pathEnv, 'w') as hf:
+        hf.create_dataset('envAttended', data=envAttended)
+        hf.create_dataset('envUnattended', data=envUnattended)
+
+def preprocess(fnEEG, dbName, sessionNums, trialsToRemove, fs, ref, pathBehavior, pathEnv,
+               pathData):
+    """
+    Stage processing the EEG and saving it with the envelopes cut to the same
+    length (like `preprocessing.ipynb`).
+    """
+    dataFilt3DTRF64, dataFilt3DSSR = processEEG(fnEEG, dbName, sessionNums, trialsToRemove,
+                                                loadBehavior(pathBehavior), fs, ref)
+    with h5py.File(pathEnv, 'r') as hf:
+        envAttended = hf['envAttended'][()]
+        envUnattended = hf['envUnattended'][()]
+    minLen = np.min([envAttended.shape[1], envUnattended.shape[1],
+                     dataFilt3DTRF64.shape[1]])
+    saveDataH5(pathData, dataFilt3DTRF64[:, :minLen], dataFilt3DSSR,
+               envAttended[:, :minLen], envUnattended[:, :minLen])
+
+def reconstructTRF(pathData, pathReconstructed, command, script):
+    """
+    Stage running the TRF reconstruction of `analyses_TRF.m` (Matlab).
+    """
+    subprocess.check_call(command % {'pathData': os.path.abspath(pathData),
+                                     'pathReconstructed': os.path.abspath(pathReconstructed),
+                                     'script': os.path.abspath(script)},
+                          shell=True)
+
+def decodeSSR(pathData, fs, pathResults):
+    """
+    Stage computing the aSSR accuracy for each duration (see
+    `getSSRAccuracyByDur`).
+    """
+    with h5py.File(pathData, 'r') as hf:
+        eeg_aSSR = hf['eeg_aSSR'][()]
+    comparisons = getSSRAccuracyByDur(eeg_aSSR, np.arange(eeg_aSSR.shape[0]), fs)
+    pd.DataFrame({'dur': np.arange(1, comparisons.shape[0] + 1),
+                  'acc': comparisons.mean(axis=1)},
+                 columns=['dur', 'acc']).to_csv(pathResults, index=False)
+
+def decodeTRF(pathData, pathReconstructed, pathBehavior, lambdaIdx, maxLag, pathResults):
+    """
+    Stage computing the TRF accuracies for each duration (see
+    `getTRFAccuracyByDur`): attended versus mismatch, attended versus
+    unattended and unattended versus mismatch envelopes.
+    """
+    envAttended, envMismatch, envUnattended, envReconstructed = loadDataH5(
+        pathData, pathReconstructed)[1:-1]
+    trialBehavior = loadBehavior(pathBehavior)
+    trials = behavior.getTrialNum(ref=1, allSubj=False, trialBehavior=trialBehavior)
+    trialsDualStream = behavior.getTrialNum(ref=2, allSubj=False,
+                                            trialBehavior=trialBehavior, twoStreams=[True])
+    if envReconstructed.ndim == 3:
+        envReconstructed = envReconstructed[..., lambdaIdx]
+    minLen = np.min([envAttended.shape[1], envReconstructed.shape[1]])
+    accMismatch, accUnattended, accUnattendedMismatch = getTRFAccuracyByDur(
+        envAttended[:, :minLen], envUnattended[:, :minLen], envMismatch[:, :minLen],
+        envReconstructed[:, :minLen], trials, trialsDualStream, maxLag=maxLag)
+    pd.DataFrame({'dur': np.arange(len(accMismatch)), 'accMismatch': accMismatch,
+                  'accUnattended': accUnattended,
+                  'accUnattendedMismatch': accUnattendedMismatch},
+                 columns=['dur', 'accMismatch', 'accUnattended',
+                          'accUnattendedMismatch']).to_csv(pathResults, index=False)
+
+# Stages in the order of the pipeline
+stages = ['fetchBehavior', 'fetchStimuli', 'processEEG', 'reconstructTRF', 'decodeSSR',
+          'decodeTRF']
+
+def buildTasks(config, stageNames=None, participants=None):
+    """
+    Create the tasks of the pipeline (preprocessing.ipynb -> analyses_TRF.m
+    -> aSSR and TRF decoding) for each participant of a configuration.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration containing `participants`: a list of dict with the keys
+        `fnEEG`, `dbName`, `sessionNums`, `trialsToRemove` (like the
+        manifest of `runBatchProcessing`) and optionally `name` (used in the
+        file names, default to `dbName`). Optional keys: `dbAddress`
+        (URL or snapshots, default to the remote server), `password`, `fs`
+        (512), `ref` ('average'), `dirPreproc` ('data_preproc'),
+        `dirResults` ('results'), `matlabCommand`, `trfScript`
+        ('analyses_TRF.m'), `lambdaIdx` (0) and `maxLag` (None, see
+        `getTRFAccuracyByDur`).
+    stageNames : array-like
+        Stages to include (default to all `stages`). The other stages are
+        not run but their outputs are used as inputs.
+    participants : array-like
+        Names of the participants to include (default to all).
+
+    Returns
+    -------
+    tasks : array-like
+        List of instances of Task.
+    """
+    dbAddress = config.get('dbAddress')
+    password = config.get('password', 'a')
+    fs = float(config.get('fs', 512.))
+    ref = config.get('ref', 'average')
+    dirPreproc = config.get('dirPreproc', 'data_preproc')
+    dirResults = config.get('dirResults', 'results')
+    command = config.get('matlabCommand', matlabCommand)
+    trfScript = config.get('trfScript', 'analyses_TRF.m')
+    lambdaIdx = int(config.get('lambdaIdx', 0))
+    maxLag = config.get('maxLag')
+    if stageNames is None:
+        stageNames = stages
+
+    tasks = []
+    for entry in config['participants']:
+        name = entry.get('name', entry['dbName'])
+        if participants is not None and name not in participants:
+            continue
+        dbName = entry['dbName']
+        # The audio is fetched with the same address as the behavior data
+        dbAddressAudio = dbAddress or 'https://db.auditory.fr:6984/'
+        sessionNums = [int(i) for i in entry['sessionNums']]
+        paths = {
+            'behavior': os.path.join(dirPreproc, 'behavior_%s.h5' % name),
+            'env': os.path.join(dirPreproc, 'env_%s.h5' % name),
+            'data': os.path.join(dirPreproc, 'data_%s.h5' % name),
+            'reconstructed': os.path.join(dirPreproc, 'reconstructed_%s.h5' % name),
+            'ssr': os.path.join(dirResults, 'ssr_%s.csv' % name),
+            'trf': os.path.join(dirResults, 'trf_%s.csv' % name),
+        }
+        definitions = {
+            'fetchBehavior': (fetchBehavior, (dbName, sessionNums, dbAddress,
+                                              paths['behavior']),
+                              [], [paths['behavior']]),
+            'fetchStimuli': (fetchStimuli, (dbAddressAudio, dbName, password, paths['env']),
+                             [], [paths['env']]),
+            'processEEG': (preprocess, (entry['fnEEG'], dbName, sessionNums,
+                                        [int(i) for i in entry['trialsToRemove']], fs, ref,
+                                        paths['behavior'], paths['env'], paths['data']),
+                           [entry['fnEEG'], paths['behavior'], paths['env']],
+                           [paths['data']]),
+            'reconstructTRF': (reconstructTRF, (paths['data'], paths['reconstructed'],
+                                                command, trfScript),
+                               [paths['data'], trfScript], [paths['reconstructed']]),
+            'decodeSSR': (decodeSSR, (paths['data'], fs, paths['ssr']),
+                          [paths['data']], [paths['ssr']]),
+            'decodeTRF': (decodeTRF, (paths['data'], paths['reconstructed'],
+                                      paths['behavior'], lambdaIdx, maxLag, paths['trf']),
+                          [paths['data'], paths['reconstructed'], paths['behavior']],
+                          [paths['trf']]),
+        }
+        for stage in stages:
+            if stage not in stageNames:
+                continue
+            func, args, inputs, outputs = definitions[stage]
+            tasks.append(Task('%s:%s' % (stage, name), stage, name, func, args, inputs,
+                              outputs))
+    return tasks
+
+def loadConfig(path):
+    """
+    Load a pipeline configuration (see `buildTasks`) from a JSON file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the JSON file.
+
+    Returns
+    -------
+    config : dict
+        The configuration.
+    """
+    with open(path) as f:
+        return json.load(f)
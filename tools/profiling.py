@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import resource
+
+# Profiling is enabled for the whole run with the environment variable
+# TOOLS_PROFILE=1 or for a block of code with `profiling()`
+enabled = os.environ.get('TOOLS_PROFILE', '0') not in ('', '0')
+records = []
+stack = []
+
+def getCPUTime():
+    """
+    Get the CPU time (user and system) used by the current process.
+
+    Returns
+    -------
+    cpuTime : float
+        CPU time in seconds.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def getPeakRSS():
+    """
+    Get the peak resident memory of the current process.
+
+    Returns
+    -------
+    peak : int
+        Peak resident memory in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB on Linux
+    if os.uname()[0] == 'Darwin':
+        return peak
+    return peak*1024
+
+class Stage(object):
+    """
+    Context manager measuring one stage of the pipeline (see `stage`). The
+    wall time, the CPU time, the increase of the peak resident memory and the
+    number of bytes processed are stored in `records` when the stage ends.
+    Stages can be nested: the path of the stage contains the names of its
+    parents.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage (for instance 'filter' or 'correlate').
+    nbytes : int
+        Number of bytes processed by the stage (for instance the size of the
+        input).
+    """
+    def __init__(self, name, nbytes=0):
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        stack.append(self.name)
+        self.path = ';'.join(stack)
+        self.peak = getPeakRSS()
+        self.cpu = getCPUTime()
+        self.wall = time.time()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        wall = time.time() - self.wall
+        cpu = getCPUTime() - self.cpu
+        records.append({'stage': self.name, 'path': self.path, 'depth': len(stack) - 1,
+                        'start': self.wall, 'wall': wall, 'cpu': cpu,
+                        'peakRSSDelta': getPeakRSS() - self.peak,
+                        'nbytes': int(self.nbytes), 'failed': excType is not None})
+        stack.pop()
+        return False
+
+class NoStage(object):
+    """
+    Context manager doing nothing used when profiling is disabled.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        return False
+
+noStage = NoStage()
+
+def stage(name, nbytes=0):
+    """
+    Get the context manager measuring a stage of the pipeline. When profiling
+    is disabled, a shared object doing nothing is returned so the cost is one
+    function call.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+    nbytes : int
+        Number of bytes processed by the stage.
+
+    Returns
+    -------
+    stage : context manager
+        Instance of `Stage` or `NoStage`.
+    """
+    if not enabled:
+        return noStage
+    return Stage(name, nbytes)
+
+class profiling(object):
+    """
+    Context manager enabling the profiling for a block of code. The records
+    are cleared when entering the block and the report is saved when leaving
+    it if `path` is given (see `saveReport`).
+
+    Parameters
+    ----------
+    path : str
+        Path of the JSON report. If None, the report is not saved.
+    """
+    def __init__(self, path=None):
+        self.path = path
+
+    def __enter__(self):
+        global enabled
+        self.wasEnabled = enabled
+        enabled = True
+        del records[:]
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        global enabled
+        enabled = self.wasEnabled
+        if self.path is not None:
+            saveReport(self.path)
+        return False
+
+def getReport():
+    """
+    Summarize the records by stage path.
+
+    Returns
+    -------
+    report : array-like
+        List of dict (one per stage path, in the order of the first call)
+        containing the number of calls, the total wall and CPU times, the
+        self wall time (without the nested stages), the largest increase of
+        peak memory and the bytes processed.
+    """
+    report = {}
+    order = []
+    # Records are added when the stages end: sort them by start so the
+    # parents come before their nested stages
+    for record in sorted(records, key=lambda record: record['start']):
+        path = record['path']
+        if path not in report:
+            order.append(path)
+            report[path] = {'path': path, 'stage': record['stage'],
+                            'depth': record['depth'], 'calls': 0, 'wall': 0.,
+                            'cpu': 0., 'selfWall': 0., 'peakRSSDelta': 0,
+                            'nbytes': 0, 'failed': 0}
+        entry = report[path]
+        entry['calls'] += 1
+        entry['wall'] += record['wall']
+        entry['cpu'] += record['cpu']
+        entry['selfWall'] += record['wall']
+        entry['peakRSSDelta'] = max(entry['peakRSSDelta'], record['peakRSSDelta'])
+        entry['nbytes'] += record['nbytes']
+        entry['failed'] += int(record['failed'])
+    # Remove the time of the nested stages from their parent
+    for path in order:
+        parent = path.rpartition(';')[0]
+        if parent in report:
+            report[parent]['selfWall'] -= report[path]['wall']
+    return [report[path] for path in order]
+
+def getFlameSummary():
+    """
+    Get the report in the folded stacks format used by flame graph tools
+    (like `flamegraph.pl`): one line per stage path with its self wall time
+    in microseconds.
+
+    Returns
+    -------
+    lines : str
+        Folded stacks.
+    """
+    return '\n'.join('%s %d' % (entry['path'], max(entry['selfWall'], 0)*1e6)
+                     for entry in getReport())
+
+def saveReport(path, info=None):
+    """
+    Save the report as JSON and the folded stacks next to it (same path
+    with the extension `.folded`).
+
+    Parameters
+    ----------
+    path : str
+        Path of the JSON file.
+    info : dict
+        Other information to save in the report (like the participant).
+    """
+    report = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'pid': os.getpid(),
+              'stages': getReport(), 'records': records}
+    if info is not None:
+        report['info'] = info
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+    with open(os.path.splitext(path)[0] + '.folded', 'w') as f:
+        f.write(getFlameSummary() + '\n')
+
+def printReport():
+    """
+    Print the report as a tree of stages.
+    """
+    report = getReport()
+    total = sum(entry['wall'] for entry in report if entry['depth'] == 0)
+    print '%-30s %10s %14s %6s %11s %12s' % ('stage', 'wall', 'CPU', 'total', 'processed',
+                                            'calls')
+    for entry in report:
+        print '%s%-*s %8.3f s %8.3f s CPU %5.1f%% %8.1f MB %6d calls' % (
+            '  '*entry['depth'], 30 - 2*entry['depth'], entry['stage'], entry['wall'],
+            entry['cpu'], 100*entry['wall']/total if total else 0,
+            entry['nbytes']/1024.**2, entry['calls'])
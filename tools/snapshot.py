@@ -0,0 +1,224 @@
+import json
+import zipfile
+import os
+from lazy import lazyImport
+
+couchdb = lazyImport('couchdb')
+
+def exportSnapshot(dbAddress, dbName, path, password=None, sessionNums=None, verbose=False):
+    """
+    Export the documents and the attachments of a couch database in a zip
+    file that can be read by `SnapshotDatabase`. The documents are stored as
+    JSON files and the attachments as raw files (not compressed again since
+    the audio files are already compressed). An index (`index.json`) gives
+    the location of each document and attachment in the archive.
+
+    Parameters
+    ----------
+    dbAddress : str
+        Path to the couch database.
+    dbName : str
+        Name of the database on the couch instance.
+    path : str
+        Path of the zip file (for instance `snapshots/<dbName>.zip` to be used
+        with `getServer('snapshots')`).
+    password : str
+        Password of the couch database (the user is `dbName`).
+    sessionNums : array-like
+        List of sessions to export. If None, all documents are exported.
+    verbose : bool
+        If True, the exported documents are printed.
+
+    Returns
+    -------
+    index : dict
+        Index of the archive.
+    """
+    couch = couchdb.Server(dbAddress)
+    if password is not None:
+        couch.resource.credentials = (dbName, password)
+    db = couch[dbName]
+
+    prefixes = None
+    if sessionNums is not None:
+        prefixes = tuple('maskingEEG_%d_' % sessionNum for sessionNum in sessionNums)
+
+    index = {'dbName': dbName, 'docs': {}}
+    # Write in a temporary file so an interrupted export doesn't leave a
+    # truncated snapshot
+    pathTmp = path + '.tmp'
+    with zipfile.ZipFile(pathTmp, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for row in db.view('_all_docs'):
+            docId = row['id']
+            if prefixes is not None and not docId.startswith(prefixes):
+                continue
+            if verbose:
+                print 'exporting', docId
+            doc = db.get(docId)
+            entry = {'doc': 'docs/%s.json' % docId, 'attachments': {}}
+            zf.writestr(entry['doc'], json.dumps(doc))
+            for name in doc.get('_attachments', {}):
+                member = 'attachments/%s/%s' % (docId, name)
+                zf.writestr(zipfile.ZipInfo(member), db.get_attachment(docId, name).read(),
+                            zipfile.ZIP_STORED)
+                entry['attachments'][name] = member
+            index['docs'][docId] = entry
+        zf.writestr('index.json', json.dumps(index))
+    os.rename(pathTmp, path)
+    return index
+
+class SnapshotDatabase(object):
+    """
+    Read-only database reading a snapshot created by `exportSnapshot`. It
+    implements the part of the API of `couchdb.Database` used by the loaders
+    (`view('_all_docs')`, `get`, `get_attachment` and `db[docId]`) so they
+    can work without the couch server.
+
+    Parameters
+    ----------
+    path : str
+        Path of the zip file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.zipFile = zipfile.ZipFile(path, 'r')
+        self.index = json.loads(self.zipFile.read('index.json'))
+        self.docIds = sorted(self.index['docs'])
+
+    def view(self, name):
+        """
+        Get the rows of a view. Only `_all_docs` is available.
+
+        Parameters
+        ----------
+        name : str
+            Name of the view.
+
+        Returns
+        -------
+        rows : array-like
+            List of dict containing the `id` and the `key` of each document
+            (sorted by id like in couchdb).
+        """
+        if name != '_all_docs':
+            raise ValueError('Only the `_all_docs` view is available in snapshots')
+        return [{'id': docId, 'key': docId} for docId in self.docIds]
+
+    def get(self, docId, default=None):
+        """
+        Get a document.
+
+        Parameters
+        ----------
+        docId : str
+            Id of the document.
+        default : object
+            Value returned if the document doesn't exist.
+
+        Returns
+        -------
+        doc : dict
+            The document.
+        """
+        if docId not in self.index['docs']:
+            return default
+        return json.loads(self.zipFile.read(self.index['docs'][docId]['doc']))
+
+    def __getitem__(self, docId):
+        doc = self.get(docId)
+        if doc is None:
+            raise KeyError(docId)
+        return doc
+
+    def __contains__(self, docId):
+        return docId in self.index['docs']
+
+    def get_attachment(self, docId, filename, default=None):
+        """
+        Get an attachment of a document.
+
+        Parameters
+        ----------
+        docId : str
+            Id of the document.
+        filename : str
+            Name of the attachment.
+        default : object
+            Value returned if the attachment doesn't exist.
+
+        Returns
+        -------
+        attachment : file-like
+            File object to read the attachment.
+        """
+        attachments = self.index['docs'].get(docId, {}).get('attachments', {})
+        if filename not in attachments:
+            return default
+        return self.zipFile.open(attachments[filename])
+
+class SnapshotServer(object):
+    """
+    Read-only stand-in for `couchdb.Server` giving access to the snapshots of
+    a directory (one `<dbName>.zip` file for each database).
+
+    Parameters
+    ----------
+    path : str
+        Path of the directory containing the snapshots or path of one
+        snapshot.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.databases = {}
+
+    def __getitem__(self, dbName):
+        if dbName not in self.databases:
+            if self.path.endswith('.zip'):
+                path = self.path
+            else:
+                path = os.path.join(self.path, '%s.zip' % dbName)
+            if not os.path.exists(path):
+                raise KeyError(dbName)
+            self.databases[dbName] = SnapshotDatabase(path)
+        return self.databases[dbName]
+
+def isRemote(dbAddress):
+    """
+    Check if a database address corresponds to a couch server.
+
+    Parameters
+    ----------
+    dbAddress : str
+        Path to the couch database or to the snapshots.
+
+    Returns
+    -------
+    remote : bool
+        True if the address is an http(s) URL.
+    """
+    return dbAddress.startswith('http://') or dbAddress.startswith('https://')
+
+def getServer(dbAddress, credentials=None):
+    """
+    Get the couch server or the snapshots corresponding to a database address.
+    URLs (remote server or local couchdb) give a `couchdb.Server` and other
+    paths give a `SnapshotServer`.
+
+    Parameters
+    ----------
+    dbAddress : str
+        URL of the couch server or path of the snapshots.
+    credentials : tuple
+        (user, password) of the couch server (not used with snapshots).
+
+    Returns
+    -------
+    server : instance of couchdb.Server or SnapshotServer
+        Object giving the databases with `server[dbName]`.
+    """
+    if not isRemote(dbAddress):
+        return SnapshotServer(dbAddress)
+    couch = couchdb.Server(dbAddress)
+    if credentials is not None:
+        couch.resource.credentials = credentials
+    return couch
@@ -0,0 +1,160 @@
+import numpy as np
+from decodingSSR import getTagCoefsByDur
+
+def getTrialCovariances(data, freqs, fs):
+    """
+    Compute the unbiased and biased covariance matrices of each trial for the
+    denoising source separation (DSS). The biased covariance only contains
+    the activity at the tag frequencies: it is computed from the Fourier
+    coefficients at these frequencies.
+
+    Parameters
+    ----------
+    data : array-type
+        Data of shape (trial, time, electrode).
+    freqs : array-type
+        Tag frequencies in Hz (for instance [36, 44]).
+    fs : float
+        Sampling frequency in Hz.
+
+    Returns
+    -------
+    c0 : instance of numpy.array
+        Unbiased covariances of shape (trial, electrode, electrode).
+    c1 : instance of numpy.array
+        Biased covariances of shape (trial, electrode, electrode).
+    """
+    c0 = np.matmul(data.transpose(0, 2, 1), data)
+    coefs = getTagCoefsByDur(data, freqs, fs, [data.shape[1]/float(fs)])[:, 0]
+    c1 = np.matmul(coefs, coefs.conj().transpose(0, 2, 1)).real
+    return c0, c1
+
+def computeDSS(c0, c1, nComp, threshold=1e-9):
+    """
+    Compute the DSS spatial filters from the unbiased and biased covariances.
+    The data is whitened from `c0` and the filters are the directions
+    maximizing the ratio between the biased and unbiased power.
+
+    Parameters
+    ----------
+    c0 : instance of numpy.array
+        Unbiased covariance of shape (electrode, electrode).
+    c1 : instance of numpy.array
+        Biased covariance of shape (electrode, electrode).
+    nComp : int
+        Number of components to keep.
+    threshold : float
+        Principal components with a variance lower than `threshold` times the
+        largest variance are discarded (for instance after re-referencing).
+        `nComp` can't be larger than the number of components kept (the
+        number of electrodes minus one after an average reference).
+
+    Returns
+    -------
+    filters : instance of numpy.array
+        Spatial filters of shape (electrode, nComp).
+    scores : instance of numpy.array
+        Ratio between biased and unbiased power of each component.
+    """
+    eigVals, eigVecs = np.linalg.eigh(c0)
+    keep = eigVals > threshold*eigVals.max()
+    if keep.sum() < nComp:
+        raise ValueError('Only %d components can be computed (rank of the data) but '
+                         '`nComp` is %d' % (keep.sum(), nComp))
+    whitening = eigVecs[:, keep] / np.sqrt(eigVals[keep])
+    c1White = np.dot(whitening.T, np.dot(c1, whitening))
+    scores, rotation = np.linalg.eigh(c1White)
+    order = np.argsort(scores)[::-1][:nComp]
+    filters = np.dot(whitening, rotation[:, order])
+    return filters, scores[order]
+
+def crossValidateDSS(c0, c1, nComp, threshold=1e-9):
+    """
+    Compute the DSS filters of each trial from the covariances of all other
+    trials (leave-one-out). The covariance of the held-out trial is subtracted
+    from the sum of all trials instead of summing the other trials again.
+
+    Parameters
+    ----------
+    c0 : instance of numpy.array
+        Unbiased covariances of shape (trial, electrode, electrode).
+    c1 : instance of numpy.array
+        Biased covariances of shape (trial, electrode, electrode).
+    nComp : int
+        Number of components to keep.
+    threshold : float
+        See `computeDSS`.
+
+    Returns
+    -------
+    filters : instance of numpy.array
+        Spatial filters of shape (trial, electrode, nComp).
+    """
+    c0Sum = c0.sum(axis=0)
+    c1Sum = c1.sum(axis=0)
+    filters = np.zeros((c0.shape[0], c0.shape[1], nComp))
+    for trial in range(c0.shape[0]):
+        filters[trial] = computeDSS(c0Sum - c0[trial], c1Sum - c1[trial], nComp,
+                                    threshold=threshold)[0]
+    return filters
+
+def applyDSS(data, filters):
+    """
+    Project the data on the DSS components.
+
+    Parameters
+    ----------
+    data : array-type
+        Data of shape (trial, time, electrode).
+    filters : instance of numpy.array
+        Spatial filters of shape (electrode, component) or of shape (trial,
+        electrode, component) to use different filters for each trial.
+
+    Returns
+    -------
+    components : instance of numpy.array
+        Data of shape (trial, time, component).
+    """
+    if filters.ndim == 2:
+        return np.dot(data, filters)
+    return np.matmul(data, filters)
+
+def crossValDSS(data, fs, nComp=4, freqs=(36, 44), durs=None):
+    """
+    Compute the tag energies of each trial on cross-validated DSS components.
+    The filters of each trial are computed from the other trials (see
+    `crossValidateDSS`) so the energies can be used to train and test a
+    classifier (like `crossVal`). The data of each trial is projected on its
+    own components (see `applyDSS`) before the Fourier coefficients are
+    computed: the spectral features are computed on `nComp` channels instead
+    of all electrodes.
+
+    Parameters
+    ----------
+    data : array-type
+        Data of shape (trial, time, electrode).
+    fs : float
+        Sampling frequency in Hz.
+    nComp : int
+        Number of components to keep.
+    freqs : array-type
+        Tag frequencies in Hz.
+    durs : array-type
+        List of durations in seconds. Default to the whole trials.
+
+    Returns
+    -------
+    picks : instance of numpy.array
+        Tag energies averaged over components of shape (trial, duration,
+        frequency).
+    """
+    if durs is None:
+        durs = [data.shape[1]/float(fs)]
+    c0, c1 = getTrialCovariances(data, freqs, fs)
+    filters = crossValidateDSS(c0, c1, nComp)
+    # Each trial is projected with its own filters: (trial, time, component)
+    components = applyDSS(data, filters)
+    coefsComp = getTagCoefsByDur(components, freqs, fs, durs)
+    durSamples = np.clip(np.round(np.asarray(durs, dtype=float)*fs), 1, data.shape[1])
+    picks = np.abs(coefsComp).mean(axis=2) / durSamples[:, np.newaxis]
+    return picks
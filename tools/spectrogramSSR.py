@@ -0,0 +1,191 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from lazy import lazyImport
+
+signal = lazyImport('scipy.signal')
+
+def frameView(data, windowSize, step):
+    """
+    Split the trials in overlapping windows as a read-only view (no copy).
+
+    Parameters
+    ----------
+    data : instance of numpy.array
+        Data of shape (trial, time, electrode).
+    windowSize : int
+        Number of samples of each window.
+    step : int
+        Number of samples between the starts of consecutive windows.
+
+    Returns
+    -------
+    frames : instance of numpy.array
+        View of shape (trial, window, sample, electrode).
+    """
+    data = np.asarray(data)
+    windowNum = (data.shape[1] - windowSize)//step + 1
+    if windowSize < 1 or step < 1 or windowNum < 1:
+        raise ValueError('The trials must be longer than one window')
+    trialStride, timeStride, electrodeStride = data.strides
+    return as_strided(data, shape=(data.shape[0], windowNum, windowSize, data.shape[2]),
+                      strides=(trialStride, step*timeStride, timeStride, electrodeStride),
+                      writeable=False)
+
+def getTapers(windowSize, taper='hann', nw=2., taperNum=None):
+    """
+    Get the tapers applied to each window. Each taper has unit energy so the
+    power does not depend on the taper.
+
+    Parameters
+    ----------
+    windowSize : int
+        Number of samples of each window.
+    taper : str
+        'dpss' for multitaper estimation (Slepian sequences) or any window of
+        `scipy.signal.get_window` (for instance 'hann' or 'boxcar').
+    nw : float
+        Time-half bandwidth product of the DPSS tapers.
+    taperNum : int
+        Number of DPSS tapers. Default to 2*nw - 1.
+
+    Returns
+    -------
+    tapers : instance of numpy.array
+        Tapers of shape (taper, sample).
+    """
+    if taper == 'dpss':
+        if taperNum is None:
+            taperNum = max(int(2*nw) - 1, 1)
+        tapers = np.atleast_2d(signal.windows.dpss(windowSize, nw, Kmax=taperNum))
+    else:
+        tapers = signal.get_window(taper, windowSize, fftbins=False)[np.newaxis]
+    return tapers / np.sqrt((tapers**2).sum(axis=1, keepdims=True))
+
+def getTagSpectrogram(data, tagFreqs, fs, windowDur=2., stepDur=1., harmonics=1,
+                      taper='hann', nw=2., taperNum=None, blockSize=4):
+    """
+    Get the power at the tag frequencies for each trial, time window and
+    electrode (short-time Fourier transform restricted to the tag bins). The
+    windows are strided views of the data (see `frameView`) and only the
+    Fourier coefficients of the tag frequencies are computed, as one matrix
+    product between the windows and the tapered complex exponentials. With a
+    window duration multiple of 1/gcd of the tags (0.25 s for 36 and 44 Hz),
+    the tags are exactly on bins of the FFT of the window.
+
+    Parameters
+    ----------
+    data : array-type
+        Data of shape (trial, time, electrode).
+    tagFreqs : array-type
+        Tag frequencies in Hz (for instance [36, 44]).
+    fs : float
+        Sampling frequency in Hz.
+    windowDur : float
+        Duration of the windows in seconds.
+    stepDur : float
+        Time between the starts of consecutive windows in seconds.
+    harmonics : int
+        Number of harmonics to use (their powers are summed).
+    taper : str
+        Taper of the windows (see `getTapers`). With 'dpss', the power is
+        averaged over the tapers (multitaper estimation).
+    nw : float
+        Time-half bandwidth product of the DPSS tapers.
+    taperNum : int
+        Number of DPSS tapers.
+    blockSize : int
+        Number of trials processed at once (the windows of a block are copied
+        for the matrix product).
+
+    Returns
+    -------
+    power : instance of numpy.array
+        Power of shape (trial, window, electrode, tag). It can be used like
+        the energies of `getTagEnergies` with the windows in place of the
+        durations (for instance with `classifyTags`).
+    times : instance of numpy.array
+        Time of the center of each window in seconds.
+    """
+    tagFreqs = np.asarray(tagFreqs, dtype=float)
+    freqs = np.outer(np.arange(1, harmonics + 1), tagFreqs).ravel()
+    if np.any(freqs >= fs/2.):
+        raise ValueError('Harmonics must be below the Nyquist frequency')
+    windowSize = int(np.round(windowDur*fs))
+    step = int(np.round(stepDur*fs))
+    frames = frameView(data, windowSize, step)
+    trialNum, windowNum = frames.shape[:2]
+    electrodeNum = frames.shape[3]
+
+    tapers = getTapers(windowSize, taper=taper, nw=nw, taperNum=taperNum)
+    phase = 2*np.pi*np.outer(np.arange(windowSize), freqs)/fs
+    # Real and imaginary parts of the kernels: (sample, part*taper*frequency)
+    kernels = np.concatenate([tapers[:, :, np.newaxis]*np.cos(phase),
+                              -tapers[:, :, np.newaxis]*np.sin(phase)], axis=0)
+    kernels = kernels.transpose(1, 0, 2).reshape(windowSize, -1)
+
+    power = np.zeros((trialNum, windowNum, electrodeNum, len(freqs)))
+    for start in range(0, trialNum, blockSize):
+        stop = min(start + blockSize, trialNum)
+        coefs = np.tensordot(frames[start:stop], kernels, axes=([2], [0]))
+        coefs = coefs.reshape(coefs.shape[:3] + (2, tapers.shape[0], len(freqs)))
+        power[start:stop] = (coefs**2).sum(axis=3).mean(axis=3)
+    # Sum the harmonics of each tag
+    power = power.reshape(power.shape[:3] + (harmonics, len(tagFreqs))).sum(axis=3)
+    times = (np.arange(windowNum)*step + windowSize/2.)/fs
+    return power, times
+
+def getWindowBaseline(power, labels, tagFreqs):
+    """
+    Get the baseline power of each tag and window from the trials where this
+    tag is attended (like `calculateTagBaseline`, but from the power of each
+    trial).
+
+    Parameters
+    ----------
+    power : instance of numpy.array
+        Power of shape (trial, window, electrode, tag) (see
+        `getTagSpectrogram`).
+    labels : array-type
+        Tag frequency of each trial. Trials with other labels are not used.
+    tagFreqs : array-type
+        Tag frequencies in Hz.
+
+    Returns
+    -------
+    baseline : instance of numpy.array
+        Baseline of shape (window, tag) to be used with `classifyTags` or
+        `getWindowDecisions`.
+    """
+    labels = np.asarray(labels)
+    baseline = np.zeros((power.shape[1], len(tagFreqs)))
+    for k, tag in enumerate(tagFreqs):
+        baseline[:, k] = power[labels == tag, :, :, k].mean(axis=(0, 2))
+    return baseline
+
+def getWindowDecisions(power, tagFreqs, baseline=None):
+    """
+    Get the tag detected in each window of each trial: the tag with the
+    largest power averaged over electrodes (normalized by the baseline). This
+    shows the time course of the attended stream within the trials.
+
+    Parameters
+    ----------
+    power : instance of numpy.array
+        Power of shape (trial, window, electrode, tag).
+    tagFreqs : array-type
+        Tag frequencies in Hz.
+    baseline : instance of numpy.array
+        Baseline of shape (window, tag) (see `getWindowBaseline`).
+
+    Returns
+    -------
+    decisions : instance of numpy.array
+        Tag detected of shape (trial, window).
+    scores : instance of numpy.array
+        Normalized power of each tag averaged over electrodes. Shape (trial,
+        window, tag).
+    """
+    scores = power.mean(axis=2)
+    if baseline is not None:
+        scores = scores / baseline
+    return np.asarray(tagFreqs)[np.argmax(scores, axis=-1)], scores
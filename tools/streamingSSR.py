@@ -0,0 +1,126 @@
+import numpy as np
+
+class StreamingSSRDetector(object):
+    """
+    Real-time detection of the attended AM rate from the aSSR. The EEG is
+    given in blocks of samples and the Fourier coefficients at the two tag
+    frequencies are updated for each electrode (like a bank of Goertzel
+    filters evaluated at the end of each block). The work for each sample is
+    proportional to the number of electrodes.
+
+    At each block, the ratio between the energies at the first and the second
+    frequencies is compared to the baseline for each electrode (like
+    `getSSRAccuracyByDur`) and the proportion of electrodes above the baseline
+    gives the decision.
+
+    Parameters
+    ----------
+    fs : float
+        Sampling frequency in Hz.
+    electrodes : int
+        Number of electrodes.
+    baseline : float
+        Ratio between the energies of the two frequencies in the one stream
+        condition (see `calculateBaseline`).
+    freqs : array-like
+        The two tag frequencies in Hz.
+    windowDur : float
+        Duration of the sliding window in seconds. If None, the coefficients
+        are computed from the beginning of the trial (like
+        `getSSRAccuracyByDur`).
+    maxBlockSize : int
+        Maximum number of samples in one block (only used with a sliding
+        window).
+    """
+    def __init__(self, fs, electrodes, baseline=1., freqs=(36, 44), windowDur=None,
+                 maxBlockSize=512):
+        self.fs = fs
+        self.freqs = np.asarray(freqs, dtype=float)
+        self.omega = 2*np.pi*self.freqs/fs
+        self.baseline = baseline
+        self.electrodes = electrodes
+        if windowDur is None:
+            self.windowSize = None
+        else:
+            self.windowSize = int(np.round(windowDur*fs))
+            if maxBlockSize > self.windowSize:
+                raise ValueError('`maxBlockSize` must be smaller than the window')
+            # Last samples needed to remove their contribution when they leave
+            # the window
+            self.window = np.zeros((self.windowSize, electrodes))
+        self.maxBlockSize = maxBlockSize
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the state to start a new trial.
+        """
+        self.coefs = np.zeros((self.electrodes, len(self.freqs)), dtype=complex)
+        self.count = 0
+        if self.windowSize is not None:
+            self.window[:] = 0
+
+    def getPhasors(self, start, blockSize):
+        """
+        Get the complex exponentials of the tag frequencies for a range of
+        samples.
+
+        Parameters
+        ----------
+        start : int
+            Index of the first sample since the beginning of the trial.
+        blockSize : int
+            Number of samples.
+
+        Returns
+        -------
+        phasors : instance of numpy.array
+            Matrix of shape (blockSize, frequency).
+        """
+        n = np.arange(start, start + blockSize)
+        # Phase modulo 2 pi to keep the precision for long recordings
+        phase = np.mod(np.outer(n, self.omega), 2*np.pi)
+        return np.exp(-1j*phase)
+
+    def update(self, eegBlock):
+        """
+        Process a new block of EEG.
+
+        Parameters
+        ----------
+        eegBlock : instance of numpy.array
+            New EEG samples of shape (time, electrode).
+
+        Returns
+        -------
+        decision : float
+            The frequency detected (first or second element of `freqs`).
+        score : float
+            Proportion of electrodes where the ratio between the energies is
+            larger than the baseline.
+        energies : instance of numpy.array
+            Energies of shape (electrode, frequency) over the current window.
+        """
+        blockSize = eegBlock.shape[0]
+        # Check the block before changing the state
+        if self.windowSize is not None and blockSize > self.maxBlockSize:
+            raise ValueError('The block is larger than `maxBlockSize`')
+        self.coefs += np.dot(eegBlock.T, self.getPhasors(self.count, blockSize))
+
+        if self.windowSize is not None:
+            idx = (self.count + np.arange(blockSize)) % self.windowSize
+            # Remove the samples leaving the window
+            oldStart = self.count - self.windowSize
+            if oldStart + blockSize > 0:
+                keep = max(-oldStart, 0)
+                self.coefs -= np.dot(self.window[idx[keep:]].T,
+                                     self.getPhasors(oldStart + keep, blockSize - keep))
+            self.window[idx] = eegBlock
+        self.count += blockSize
+
+        n = self.count if self.windowSize is None else min(self.count, self.windowSize)
+        energies = np.abs(self.coefs)/n
+        ratios = energies[:, 0]/energies[:, 1]
+        score = np.mean(ratios > self.baseline)
+        decision = self.freqs[0] if score > 0.5 else self.freqs[1]
+        return decision, score, energies
@@ -0,0 +1,251 @@
+import time
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import as_strided
+from lagMatrix import getLags
+
+class StreamingTRFDecoder(object):
+    """
+    Real-time attention decoder from a backward TRF model. The EEG is given
+    in blocks of samples. For each block, the envelope is reconstructed and
+    the correlation between the reconstruction and each candidate envelope
+    (for instance the two streams) is computed over a sliding window.
+
+    The envelope at time t is reconstructed from the EEG at times t + lag
+    for each lag of the model. The reconstruction is therefore delayed by
+    the largest lag: the candidate envelopes given with a block are delayed
+    by the same amount before being compared to the reconstruction.
+
+    The work done for each block only depends on the block size, the number
+    of lags, electrodes and candidates (not on the time since the beginning).
+
+    Parameters
+    ----------
+    weights : instance of numpy.array
+        Weights of the decoder of shape (lag, electrode).
+    lags : array-like
+        Lags in samples corresponding to the rows of `weights` (see
+        `getLags`).
+    fs : float
+        Sampling frequency in Hz.
+    windowDur : float
+        Duration of the sliding window used for the correlations in seconds.
+    maxBlockSize : int
+        Maximum number of samples in one block.
+    candidateNum : int
+        Number of candidate envelopes.
+    bias : float
+        Constant added to the reconstruction.
+    """
+    def __init__(self, weights, lags, fs=64., windowDur=10., maxBlockSize=64,
+                 candidateNum=2, bias=0.):
+        lags = np.asarray(lags)
+        if weights.shape[0] != lags.shape[0]:
+            raise ValueError('`weights` must have one row per lag')
+        if lags.max() < 0:
+            raise ValueError('The largest lag must be positive or zero')
+        self.minLag = int(lags.min())
+        self.maxLag = int(lags.max())
+        span = self.maxLag - self.minLag + 1
+        # Weights for all lags between minLag and maxLag
+        self.weights = np.zeros((span, weights.shape[1]))
+        self.weights[lags - self.minLag] = weights
+        self.bias = bias
+        self.fs = fs
+        self.maxBlockSize = maxBlockSize
+        self.windowSize = int(np.round(windowDur*fs))
+        if maxBlockSize > self.windowSize:
+            raise ValueError('`maxBlockSize` must be smaller than the window')
+        self.candidateNum = candidateNum
+
+        # EEG history followed by the current block
+        self.history = span - 1
+        self.eegBuffer = np.zeros((self.history + maxBlockSize, weights.shape[1]))
+        # Candidates waiting for their reconstruction
+        self.delay = self.maxLag
+        self.candBuffer = np.zeros((self.delay + maxBlockSize, candidateNum))
+        # Sliding window of reconstructions and candidates
+        self.recWindow = np.zeros(self.windowSize)
+        self.candWindow = np.zeros((self.windowSize, candidateNum))
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the buffers to start a new trial.
+        """
+        self.eegBuffer[:] = 0
+        self.candBuffer[:] = 0
+        self.recWindow[:] = 0
+        self.candWindow[:] = 0
+        self.head = 0
+        self.count = 0
+        self.sinceRefresh = 0
+        self.sums = np.zeros((3, self.candidateNum))
+        self.sumRec = 0.
+        self.sumRecSq = 0.
+
+    def getDesign(self, blockSize):
+        """
+        Get the lagged EEG of the current block as a read-only view of the
+        buffer.
+
+        Parameters
+        ----------
+        blockSize : int
+            Number of samples of the current block.
+
+        Returns
+        -------
+        design : instance of numpy.array
+            View of shape (blockSize, lag, electrode).
+        """
+        rowStride, colStride = self.eegBuffer.strides
+        return as_strided(self.eegBuffer,
+                          shape=(blockSize, self.weights.shape[0],
+                                 self.eegBuffer.shape[1]),
+                          strides=(rowStride, rowStride, colStride),
+                          writeable=False)
+
+    def refreshSums(self):
+        """
+        Compute again the sums of the sliding window from the stored samples
+        to avoid the accumulation of numerical errors.
+        """
+        n = min(self.count, self.windowSize)
+        rec = self.recWindow[:n] if n < self.windowSize else self.recWindow
+        cand = self.candWindow[:n] if n < self.windowSize else self.candWindow
+        self.sumRec = rec.sum()
+        self.sumRecSq = (rec*rec).sum()
+        self.sums = np.array([cand.sum(axis=0), (cand*cand).sum(axis=0),
+                              np.dot(rec, cand)])
+        self.sinceRefresh = 0
+
+    def update(self, eegBlock, candidateBlock):
+        """
+        Process a new block of EEG.
+
+        Parameters
+        ----------
+        eegBlock : instance of numpy.array
+            New EEG samples of shape (time, electrode).
+        candidateBlock : instance of numpy.array
+            Candidate envelopes at the same times of shape (time, candidate).
+
+        Returns
+        -------
+        reconstructed : instance of numpy.array
+            Reconstructed envelope of shape (time,). It corresponds to the
+            candidates given `maxLag` samples before.
+        corrs : instance of numpy.array
+            Correlation between the reconstruction and each candidate over the
+            sliding window. Shape (candidate,).
+        """
+        blockSize = eegBlock.shape[0]
+        if blockSize > self.maxBlockSize:
+            raise ValueError('The block is larger than `maxBlockSize`')
+
+        # Reconstruction from the lagged EEG
+        self.eegBuffer[self.history:self.history + blockSize] = eegBlock
+        reconstructed = np.tensordot(self.getDesign(blockSize), self.weights,
+                                     axes=([1, 2], [0, 1])) + self.bias
+        self.eegBuffer[:self.history] = self.eegBuffer[blockSize:blockSize + self.history]
+
+        # Candidates corresponding to the reconstructed samples
+        self.candBuffer[self.delay:self.delay + blockSize] = candidateBlock
+        cand = self.candBuffer[:blockSize].copy()
+        self.candBuffer[:self.delay] = self.candBuffer[blockSize:blockSize + self.delay]
+
+        # Update the sums of the sliding window: remove the oldest samples and
+        # add the new ones
+        idx = (self.head + np.arange(blockSize)) % self.windowSize
+        if self.count >= self.windowSize:
+            oldRec = self.recWindow[idx]
+            oldCand = self.candWindow[idx]
+        else:
+            filled = np.arange(self.count, self.count + blockSize) >= self.windowSize
+            oldRec = np.where(filled, self.recWindow[idx], 0)
+            oldCand = np.where(filled[:, np.newaxis], self.candWindow[idx], 0)
+        self.sumRec += reconstructed.sum() - oldRec.sum()
+        self.sumRecSq += (reconstructed*reconstructed).sum() - (oldRec*oldRec).sum()
+        self.sums += np.array([cand.sum(axis=0) - oldCand.sum(axis=0),
+                               (cand*cand).sum(axis=0) - (oldCand*oldCand).sum(axis=0),
+                               np.dot(reconstructed, cand) - np.dot(oldRec, oldCand)])
+        self.recWindow[idx] = reconstructed
+        self.candWindow[idx] = cand
+        self.head = (self.head + blockSize) % self.windowSize
+        self.count += blockSize
+        self.sinceRefresh += blockSize
+        if self.sinceRefresh >= self.windowSize:
+            self.refreshSums()
+
+        n = float(min(self.count, self.windowSize))
+        sumCand, sumCandSq, sumProd = self.sums
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corrs = ((sumProd - self.sumRec*sumCand/n) /
+                     np.sqrt((self.sumRecSq - self.sumRec**2/n) *
+                             (sumCandSq - sumCand**2/n)))
+        return reconstructed, corrs
+
+def benchmarkStreamingTRF(blockSizes, fs=64., electrodes=64, tmin=-50, tmax=300,
+                          windowDur=10., dur=60., seed=0):
+    """
+    Measure the latency and the throughput of `StreamingTRFDecoder` for
+    different block sizes on random data.
+
+    Parameters
+    ----------
+    blockSizes : array-like
+        List of block sizes in samples.
+    fs : float
+        Sampling frequency in Hz.
+    electrodes : int
+        Number of electrodes.
+    tmin : float
+        Minimum lag in ms.
+    tmax : float
+        Maximum lag in ms.
+    windowDur : float
+        Duration of the sliding window in seconds.
+    dur : float
+        Duration of the simulated recording in seconds.
+    seed : int
+        Seed of the random generator.
+
+    Returns
+    -------
+    results : instance of pandas.core.DataFrame
+        Dataframe containing for each block size the mean, 95th percentile and
+        maximum computation time per block (in ms), the throughput (samples
+        per second) and the decision latency (in ms): the time between the
+        first sample of a block and the decision including it. This is the
+        sum of the block duration (waiting for the block to be complete),
+        the largest lag of the model (the envelope at a time is reconstructed
+        from the EEG up to this lag later) and the computation time.
+    """
+    rng = np.random.RandomState(seed)
+    lags = getLags(tmin, tmax, fs)
+    weights = rng.randn(len(lags), electrodes)
+    sampleNum = int(np.round(dur*fs))
+    eeg = rng.randn(sampleNum, electrodes)
+    candidates = rng.randn(sampleNum, 2)
+
+    results = []
+    for blockSize in blockSizes:
+        decoder = StreamingTRFDecoder(weights, lags, fs=fs, windowDur=windowDur,
+                                      maxBlockSize=blockSize)
+        times = []
+        for start in range(0, sampleNum - blockSize + 1, blockSize):
+            t0 = time.time()
+            decoder.update(eeg[start:start + blockSize],
+                           candidates[start:start + blockSize])
+            times.append(time.time() - t0)
+        times = np.array(times)*1000
+        results.append({'blockSize': blockSize,
+                        'meanTime': times.mean(),
+                        'p95Time': np.percentile(times, 95),
+                        'maxTime': times.max(),
+                        'throughput': blockSize/(times.mean()/1000),
+                        'decisionLatency': ((blockSize + lags.max())/fs*1000 +
+                                            times.mean())})
+    return pd.DataFrame(results, columns=['blockSize', 'meanTime', 'p95Time', 'maxTime',
+                                          'throughput', 'decisionLatency'])